@@ -0,0 +1,244 @@
+"""
+Admission control: bounded concurrency per route class, with load shedding.
+
+Each class of routes (cheap local ones, LLM-bound ones) has its own
+concurrency limit and its own bounded FIFO wait queue. A request that finds
+its class full waits in the queue for at most the queue timeout, and is
+shed with 503 and a Retry-After estimate when the queue is full or the
+wait runs out. Each client (by IP address) may hold only a share of a
+class's slots plus queue, beyond which it gets 429. One client's burst
+therefore cannot lock everyone else out. Because the classes do not share
+slots, /calculate_bmi keeps answering while the Gemini-bound routes are
+saturated.
+"""
+import asyncio
+import json
+import math
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, Optional
+
+import anyio
+
+from . import deadline, metrics
+
+# Concurrent requests per class, waiting requests per class, and how long one may wait
+ADMISSION_LLM_LIMIT = int(os.environ.get("ADMISSION_LLM_LIMIT", "24"))
+ADMISSION_LOCAL_LIMIT = int(os.environ.get("ADMISSION_LOCAL_LIMIT", "64"))
+ADMISSION_PEER_LIMIT = int(os.environ.get("ADMISSION_PEER_LIMIT", "24"))
+ADMISSION_QUEUE = int(os.environ.get("ADMISSION_QUEUE", "48"))
+ADMISSION_QUEUE_TIMEOUT_MS = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT_MS", "2000"))
+# Share of a class's slots plus queue that a single client may hold
+ADMISSION_CLIENT_SHARE = float(os.environ.get("ADMISSION_CLIENT_SHARE", "0.25"))
+
+ADMISSION_REJECTED = metrics.REGISTRY.counter(
+    "admission_rejected_total", "Requests shed by admission control.", ("route_class", "reason"))
+ADMISSION_WAIT = metrics.REGISTRY.histogram(
+    "admission_queue_wait_seconds", "Time admitted requests spent waiting for a slot.", ("route_class",))
+
+
+class Rejected(Exception):
+    """Raised by RouteClass.acquire when a request is shed."""
+
+    def __init__(self, status: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class RouteClass:
+    """
+    Concurrency limit plus bounded wait queue for one class of routes.
+
+    Runs on the event loop only, so plain counters are enough. A freed slot
+    is handed straight to the oldest waiter, which keeps the queue FIFO.
+
+    Args:
+        name: Class name, used in metrics.
+        limit: Requests served at once.
+        queue: Requests allowed to wait for a slot.
+        queue_timeout: Seconds a request may wait before it is shed.
+        client_share: Fraction of limit + queue one client may occupy.
+    """
+
+    def __init__(self, name: str, limit: int, queue: int = ADMISSION_QUEUE,
+                 queue_timeout: float = ADMISSION_QUEUE_TIMEOUT_MS / 1000.0,
+                 client_share: float = ADMISSION_CLIENT_SHARE):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.queue_timeout = queue_timeout
+        self.client_quota = max(1, int(math.ceil((limit + queue) * client_share)))
+        self.active = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.clients: Dict[str, int] = {}
+        # Moving average of how long an admitted request holds its slot
+        self.service_time = 0.5
+
+    def retry_after(self) -> int:
+        """Seconds until the queue ahead has probably drained."""
+        return max(1, min(30, int(math.ceil(self.service_time * (len(self.waiters) + 1) / max(self.limit, 1)))))
+
+    def _reject(self, status: int, reason: str) -> Rejected:
+        ADMISSION_REJECTED.inc(self.name, reason)
+        return Rejected(status, reason, self.retry_after())
+
+    async def acquire(self, client: str, timeout: Optional[float] = None):
+        """Take a slot for `client`, waiting at most `timeout` (default queue_timeout). Raises Rejected."""
+        timeout = self.queue_timeout if timeout is None else min(timeout, self.queue_timeout)
+        # Queued requests count against the quota too, so one client cannot fill the queue.
+        if self.clients.get(client, 0) >= self.client_quota:
+            raise self._reject(429, "client_quota")
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            self.clients[client] = self.clients.get(client, 0) + 1
+            return
+        if len(self.waiters) >= self.queue:
+            raise self._reject(503, "queue_full")
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        self.clients[client] = self.clients.get(client, 0) + 1
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), max(timeout, 0.0))
+        except asyncio.TimeoutError:
+            self._forget(client)
+            if waiter.done():
+                # The slot arrived just as the wait ran out; give it back.
+                self._release_slot()
+            else:
+                waiter.cancel()
+                self.waiters.remove(waiter)
+            raise self._reject(503, "queue_timeout")
+        except asyncio.CancelledError:
+            self._forget(client)
+            if waiter.done() and not waiter.cancelled():
+                self._release_slot()
+            elif waiter in self.waiters:
+                waiter.cancel()
+                self.waiters.remove(waiter)
+            raise
+        ADMISSION_WAIT.observe(time.perf_counter() - started, self.name)
+
+    def release(self, client: str, held: float):
+        self._forget(client)
+        self.service_time += 0.1 * (held - self.service_time)
+        self._release_slot()
+
+    def _forget(self, client: str):
+        """Drop one of `client`'s admitted or queued requests from its count."""
+        remaining = self.clients.get(client, 0) - 1
+        if remaining > 0:
+            self.clients[client] = remaining
+        else:
+            self.clients.pop(client, None)
+
+    def _release_slot(self):
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                # The slot passes to the waiter; active stays the same.
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> Dict:
+        return {"active": self.active, "limit": self.limit, "queued": len(self.waiters),
+                "queue": self.queue, "clients": len(self.clients), "client_quota": self.client_quota,
+                "service_time_ms": round(self.service_time * 1000, 1)}
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware that admits each HTTP request into its route class or sheds it.
+
+    A slot is held until the response is complete, so a streamed response
+    holds it for its whole duration. On the first request the default
+    thread pool is grown to the sum of the class limits (plus headroom), so
+    admitted sync endpoints never queue again for a worker thread.
+
+    Args:
+        app: The ASGI app.
+        classes: Class name to RouteClass.
+        routes: Path to class name; other paths use `default`.
+        default: Class for unlisted paths.
+        exempt: Paths never limited (health checks, metrics).
+    """
+
+    def __init__(self, app, classes: Dict[str, RouteClass], routes: Dict[str, str],
+                 default: str, exempt: Iterable[str] = ()):
+        self.app = app
+        self.classes = classes
+        self.routes = routes
+        self.default = default
+        self.exempt = set(exempt)
+        self._thread_pool_sized = False
+
+    def _size_thread_pool(self, headroom: int = 8):
+        limiter = anyio.to_thread.current_default_thread_limiter()
+        limiter.total_tokens = max(limiter.total_tokens,
+                                   sum(c.limit for c in self.classes.values()) + headroom)
+        self._thread_pool_sized = True
+
+    @staticmethod
+    def client_id(scope) -> str:
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path", "")
+        if scope["type"] != "http" or path in self.exempt:
+            await self.app(scope, receive, send)
+            return
+        if not self._thread_pool_sized:
+            self._size_thread_pool()
+        route_class = self.classes[self.routes.get(path, self.default)]
+        client = self.client_id(scope)
+        try:
+            # A request never waits past its own deadline (set by DeadlineMiddleware).
+            await route_class.acquire(client, deadline.remaining())
+        except Rejected as e:
+            await self._shed(send, e)
+            return
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route_class.release(client, time.perf_counter() - started)
+
+    @staticmethod
+    async def _shed(send, rejected: Rejected):
+        body = json.dumps({"detail": "Server is busy, please retry later.", "reason": rejected.reason}).encode()
+        await send({"type": "http.response.start", "status": rejected.status, "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(rejected.retry_after).encode()),
+        ]})
+        await send({"type": "http.response.body", "body": body})
+
+    def stats(self) -> Dict[str, Dict]:
+        return {name: route_class.stats() for name, route_class in self.classes.items()}
+
+
+def default_classes() -> Dict[str, RouteClass]:
+    return {
+        "local": RouteClass("local", ADMISSION_LOCAL_LIMIT),
+        "llm": RouteClass("llm", ADMISSION_LLM_LIMIT),
+        # Lookups forwarded by the other nodes: all of one node's users share
+        # its address, so a per-client quota would throttle the whole node.
+        "peer": RouteClass("peer", ADMISSION_PEER_LIMIT, client_share=1.0),
+    }
+
+
+def queue_depth_collector(classes: Dict[str, RouteClass]):
+    """Export active and queued requests per class at scrape time."""
+    def collect():
+        return [
+            ("admission_active", "gauge", "Requests holding an admission slot.",
+             [({"route_class": n}, c.active) for n, c in classes.items()]),
+            ("admission_queued", "gauge", "Requests waiting for an admission slot.",
+             [({"route_class": n}, len(c.waiters)) for n, c in classes.items()]),
+        ]
+    return metrics.REGISTRY.collector(collect)
@@ -0,0 +1,290 @@
+"""
+Cache of MediBot answers to context-free questions, matched by near-duplicate.
+
+"what is the dose of paracetamol" and "Tylenol dosage?" reduce to the same
+terms: lower-cased words without stopwords, brand names mapped to the
+generic drug (drug_logic.canonical_drug) and a few spelling variants
+folded together. A question with exactly the same terms as a cached one
+is answered with a dict lookup. Otherwise its MinHash signature over the
+terms is looked up in an LSH index (bands of signature rows), and the
+candidates are compared by the Jaccard similarity of their terms. Only
+answers at or above the threshold whose keys are the same as the
+question's are served. Keys are the terms that change the answer however
+similar the rest is: drugs (known ones, and unknown words with a drug
+name stem such as rivaroxaban), numbers (ages, doses), the patient
+(child, adult, elderly, pregnant, ...), the organs their disease is in
+and negations. So "paracetamol dose for a 5 year old" never gets the
+answer for a 50 year old, for an adult, without liver disease or for
+ibuprofen.
+
+Only turns without previous context are cached, since a follow-up
+question's answer depends on the conversation. With a shared store, answers
+are also kept there by their exact terms, for the other worker processes.
+"""
+import hashlib
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+
+from . import logs
+from .drug_logic import canonical_drug
+from .shared_cache import SharedStore
+
+logger = logging.getLogger(__name__)
+
+CHAT_ANSWER_CACHE = os.environ.get("CHAT_ANSWER_CACHE", "1") == "1"
+CHAT_ANSWER_CACHE_TTL = float(os.environ.get("CHAT_ANSWER_CACHE_TTL", "21600"))
+CHAT_ANSWER_CACHE_SIZE = int(os.environ.get("CHAT_ANSWER_CACHE_SIZE", "4096"))
+# Minimum Jaccard similarity of two questions' terms for a shared answer
+CHAT_ANSWER_CACHE_THRESHOLD = float(os.environ.get("CHAT_ANSWER_CACHE_THRESHOLD", "0.8"))
+
+# 16 bands of 4 rows make pairs above ~0.6 similarity candidates almost surely.
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16
+_PRIME = (1 << 61) - 1
+_rng = random.Random(46)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(MINHASH_PERMUTATIONS)]
+
+_WORD_RE = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+STOPWORDS = frozenset("""
+a an the is are was were be been am i im me my we our you your it its this that these those
+of for to in on at by with about from as what whats which who how much many can could should
+would will do does did please tell give know want need there any some and or if than then so
+just also get take taking use using
+""".split())
+# Spelling variants of the same term
+TERM_ALIASES = {
+    "dosage": "dose", "dosages": "dose", "dosing": "dose", "doses": "dose",
+    "kid": "child", "kids": "child", "children": "child", "pediatric": "child", "paediatric": "child",
+    "interact": "interaction", "interactions": "interaction",
+    "alternatives": "alternative", "substitute": "alternative", "substitutes": "alternative",
+    "pregnancy": "pregnant", "pills": "tablet", "pill": "tablet", "tablets": "tablet",
+    "maximum": "max", "daily": "day", "milligrams": "mg",
+    "adults": "adult", "grownup": "adult", "infants": "infant", "baby": "infant", "babies": "infant",
+    "toddler": "child", "toddlers": "child", "newborns": "newborn", "neonate": "newborn", "neonatal": "newborn",
+    "teenager": "teen", "teenagers": "teen", "teens": "teen", "adolescent": "teen", "adolescents": "teen",
+    "older": "elderly", "senior": "elderly", "seniors": "elderly", "geriatric": "elderly",
+    "breastfeed": "breastfeeding", "nursing": "breastfeeding", "lactating": "breastfeeding", "lactation": "breastfeeding",
+    "hepatic": "liver", "renal": "kidney", "kidneys": "kidney", "cardiac": "heart",
+    # "don't", "can't" -> "don", "t"; the "t" carries the negation
+    "t": "not", "cannot": "not", "never": "not", "without": "not",
+}
+# Who the patient is, where their disease is, and negations: terms that
+# change the answer however similar the rest of the question is
+QUALIFIERS = frozenset("""
+child adult elderly pregnant infant newborn teen breastfeeding
+liver kidney heart
+no not avoid
+""".split())
+# Drug names not in _drug_db are recognised by their INN stem
+DRUG_STEM_RE = re.compile(
+    r"[a-z]{3,}(?:xaban|gatran|parin|pril|sartan|olol|dipine|statin|mab|tinib|cillin|mycin|micin"
+    r"|cycline|conazole|prazole|tidine|vir|gliptin|gliflozin|glinide|afil|triptan|oxetine|pram|azepam"
+    r"|azolam|barbital|caine|setron|lukast|terol|sone|olone|profen|coxib|fenac|dronate|semide|thiazide|zosin"
+    r"|platin|rubicin|taxel|relin|tretin|oxacin|idine|amine|azine|triptyline|apine|codone|morphone)"
+)
+
+
+class QuestionTerms(NamedTuple):
+    terms: FrozenSet[str]
+    # Drugs, numbers and qualifiers; these must match exactly
+    keys: FrozenSet[str]
+
+
+def question_terms(question: str) -> QuestionTerms:
+    terms, keys = set(), set()
+    for word in _WORD_RE.findall(question.lower()):
+        if word in STOPWORDS:
+            continue
+        drug = canonical_drug(word)
+        if drug:
+            terms.add(drug)
+            keys.add(drug)
+            continue
+        if word[0].isdigit():
+            terms.add(word)
+            keys.add(word)
+            continue
+        word = TERM_ALIASES.get(word, word)
+        if len(word) > 4 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        terms.add(word)
+        if word in QUALIFIERS or DRUG_STEM_RE.fullmatch(word):
+            keys.add(word)
+    return QuestionTerms(frozenset(terms), frozenset(keys))
+
+
+def _hash(term: str) -> int:
+    return int.from_bytes(hashlib.blake2b(term.encode(), digest_size=8).digest(), "little")
+
+
+def minhash(terms: FrozenSet[str]) -> Tuple[int, ...]:
+    """MinHash signature of a term set, MINHASH_PERMUTATIONS values long."""
+    hashes = [_hash(t) for t in terms]
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def _bands(signature: Tuple[int, ...]) -> List[Tuple[int, ...]]:
+    rows = len(signature) // LSH_BANDS
+    return [signature[i * rows:(i + 1) * rows] for i in range(LSH_BANDS)]
+
+
+class _Entry(NamedTuple):
+    question: QuestionTerms
+    bands: List[Tuple[int, ...]]
+    answer: str
+    expires: float
+
+
+class AnswerCache:
+    """
+    Thread-safe LRU of chat answers with an LSH index over question signatures.
+
+    Args:
+        ttl: Seconds an answer is served.
+        max_entries: Answers kept before the least recently used is dropped.
+        threshold: Minimum Jaccard similarity of question terms for a hit.
+        shared: Store shared with the other worker processes, if any.
+    """
+
+    def __init__(self, ttl: float = CHAT_ANSWER_CACHE_TTL, max_entries: int = CHAT_ANSWER_CACHE_SIZE,
+                 threshold: float = CHAT_ANSWER_CACHE_THRESHOLD, shared: Optional[SharedStore] = None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.shared = shared
+        # Sorted terms -> entry; band number -> band values -> keys of entries with them
+        self._entries: "OrderedDict[Tuple[str, ...], _Entry]" = OrderedDict()
+        self._index: List[Dict[Tuple[int, ...], set]] = [{} for _ in range(LSH_BANDS)]
+        # Terms of near-duplicate questions already seen -> key of the entry they matched,
+        # so asking one again skips the signature
+        self._aliases: "OrderedDict[Tuple[str, ...], Tuple[str, ...]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def _remove(self, key: Tuple[str, ...]):
+        """Drop an entry and its index postings. Call with the lock held."""
+        entry = self._entries.pop(key)
+        for band, value in zip(self._index, entry.bands):
+            keys = band.get(value)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del band[value]
+
+    def _live(self, key: Tuple[str, ...], now: float) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires <= now:
+            self._remove(key)
+            return None
+        return entry
+
+    def get(self, question: str) -> Optional[str]:
+        """Cached answer to this question or a near-duplicate of it, or None."""
+        q = question_terms(question)
+        key = tuple(sorted(q.terms))
+        with self._lock:
+            target = self._aliases.get(key, key)
+            entry = self._live(target, time.monotonic()) if key else None
+            if entry is not None:
+                self._entries.move_to_end(target)
+                self.hits += 1
+                self.near_hits += target != key
+                logs.cache("chat_answers", "near" if target != key else "hit")
+                return entry.answer
+            self._aliases.pop(key, None)
+        answer = self._shared_get(key) if key and self.shared is not None else None
+        if answer is not None:
+            self._insert(q, key, answer)
+            with self._lock:
+                self.hits += 1
+                self.shared_hits += 1
+            logs.cache("chat_answers", "shared")
+            return answer
+        # The signature is only needed without an exact match; build it outside the lock.
+        bands = _bands(minhash(q.terms)) if key else []
+        with self._lock:
+            entry, target = self._nearest(q, bands, time.monotonic())
+            if entry is None:
+                self.misses += 1
+                logs.cache("chat_answers", "miss")
+                return None
+            self._entries.move_to_end(target)
+            self._aliases[key] = target
+            while len(self._aliases) > self.max_entries:
+                self._aliases.popitem(last=False)
+            self.hits += 1
+            self.near_hits += 1
+            logs.cache("chat_answers", "near")
+            return entry.answer
+
+    def _nearest(self, q: QuestionTerms, bands: List[Tuple[int, ...]], now: float):
+        """Most similar cached entry above the threshold with the same keys. Call with the lock held."""
+        candidates = set()
+        for band, value in zip(self._index, bands):
+            candidates.update(band.get(value, ()))
+        best, best_key, best_similarity = None, None, self.threshold
+        for key in candidates:
+            entry = self._live(key, now)
+            if entry is None or entry.question.keys != q.keys:
+                continue
+            terms = entry.question.terms
+            similarity = len(terms & q.terms) / len(terms | q.terms)
+            if similarity >= best_similarity:
+                best, best_key, best_similarity = entry, key, similarity
+        return best, best_key
+
+    def put(self, question: str, answer: str):
+        q = question_terms(question)
+        if not q.terms:
+            return
+        key = tuple(sorted(q.terms))
+        self._insert(q, key, answer)
+        if self.shared is not None:
+            try:
+                self.shared.set(_shared_key(key), answer.encode(), self.ttl)
+            except Exception as e:
+                logger.error("Writing to the shared answer cache failed: %s", e)
+
+    def _shared_get(self, key: Tuple[str, ...]) -> Optional[str]:
+        try:
+            blob = self.shared.get(_shared_key(key))
+        except Exception as e:
+            logger.error("Reading from the shared answer cache failed: %s", e)
+            return None
+        return None if blob is None else blob.decode()
+
+    def _insert(self, q: QuestionTerms, key: Tuple[str, ...], answer: str):
+        entry = _Entry(q, _bands(minhash(q.terms)), answer, time.monotonic() + self.ttl)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._aliases.pop(key, None)
+            self._entries[key] = entry
+            for band, value in zip(self._index, entry.bands):
+                band.setdefault(value, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._aliases.clear()
+            self._index = [{} for _ in range(LSH_BANDS)]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "near_hits": self.near_hits,
+                    "shared_hits": self.shared_hits, "misses": self.misses}
+
+
+def _shared_key(key: Tuple[str, ...]) -> str:
+    return "answer:" + " ".join(key)
@@ -1,21 +1,110 @@
-from fastapi import FastAPI
+import codecs
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from typing import Optional
+import anyio
+from fastapi import FastAPI, Request, Header, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, Response, PlainTextResponse
 from pydantic import BaseModel
-from .models import extract_drug_info
+from .models import extract_drug_info, extract_drug_spans, SentenceSplitter, DrugExtractor
+from .answer_cache import AnswerCache, CHAT_ANSWER_CACHE
+from .chat_sessions import ChatSessionStore
+from .drug_cache import DrugInfoCache, CachedDrugLookup
+from .drug_responses import LocalDrugResponses
 from .drug_logic import check_interactions, get_dosage, suggest_alternatives, get_alternatives_and_interactions_via_gemini
 from .gemini_api import GeminiAPI
+from .granite_api import GraniteAPI
+from .llm_router import LLMRouter
+from . import admission, cluster, deadline, logs, metrics, profiler, timing
+from .pipeline import analyze_prescription, iter_analysis_events, iter_drug_events, PIPELINE_DEADLINE_MS
+from .prompts import medibot_prompt
+from .responses import FastJSONResponse, render, rendered_response
+from .shared_cache import open_store, SHARED_CACHE_URL
 
-app = FastAPI(title="Drug Recognition API", version="1.0")
+# JSON log lines written by a background thread, so logging never blocks a request.
+log_handler = logs.configure()
+metrics.REGISTRY.collector(logs.metric_samples(log_handler))
+logger = logging.getLogger(__name__)
+
+app = FastAPI(title="Drug Recognition API", version="1.0", default_response_class=FastJSONResponse)
+
+# Cheap local endpoints get their own admission slots, so they keep answering
+# while the LLM-bound ones are saturated, and lookups forwarded by peer nodes
+# have theirs without a per-client quota; everything else is "llm".
+LOCAL_ROUTES = ("/calculate_bmi", "/get_child_dosage")
+route_classes = admission.default_classes()
+admission.queue_depth_collector(route_classes)
+app.add_middleware(admission.AdmissionMiddleware, classes=route_classes,
+                   routes=dict({path: "local" for path in LOCAL_ROUTES}, **{cluster.INTERNAL_DRUG_PATH: "peer"}),
+                   default="llm",
+                   exempt=("/health", "/metrics", "/admin/profile"))
+app.add_middleware(deadline.DeadlineMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(timing.TimingMiddleware)
+if logs.AUDIT_LOG:
+    # Outermost, so the audit covers requests rejected by admission control too.
+    app.add_middleware(logs.AuditMiddleware)
+
+# Token for the /admin endpoints; they are disabled when it is not set.
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
 
 gemini_api = GeminiAPI()
 if not gemini_api.api_key or not gemini_api.base_url:
-    print("Warning: Gemini API key or endpoint not set. MediBot functionality may be limited.")
+    logger.warning("Gemini API key or endpoint not set. MediBot functionality may be limited.")
+
+# The local Granite model is optional; when enabled it loads in the background
+# so startup is not blocked, and /health reports when it is ready.
+GRANITE_ENABLED = os.environ.get("GRANITE_ENABLED", "0") == "1"
+GRANITE_WARMUP = os.environ.get("GRANITE_WARMUP", "1") == "1"
+granite_api = GraniteAPI(warm_up=GRANITE_WARMUP) if GRANITE_ENABLED else None
+
+# Every LLM call goes through the router, which picks the fastest healthy
+# backend (and can hedge slow calls to the other one). Drug lookups are
+# answered from the shared drug-info cache first, section by section.
+llm_router = LLMRouter({"gemini": gemini_api, "granite": granite_api} if granite_api else {"gemini": gemini_api})
+# With several worker processes the caches below read and write through to
+# a store they all share (SHARED_CACHE_URL), so one worker's fetch warms all.
+shared_store = open_store()
+drug_cache = DrugInfoCache(shared=shared_store)
+drug_lookup = CachedDrugLookup(llm_router, drug_cache)
+# With several nodes (CLUSTER_PEERS) each drug is looked up, and cached, only
+# on the node that owns it on the hash ring; the others forward to it.
+peer_routing = cluster.from_env(drug_lookup)
+llm_api = peer_routing or drug_lookup
+# Responses for drugs in the local database, encoded once
+local_drugs = LocalDrugResponses()
+# MediBot conversations kept server-side; older turns are summarized by the LLM.
+chat_sessions = ChatSessionStore(summarize=llm_api.query, shared=shared_store)
+# Answers to context-free chat questions, shared by near-duplicate questions.
+answer_cache = AnswerCache(shared=shared_store) if CHAT_ANSWER_CACHE else None
+
+metrics.cache_collector("drug_info", drug_cache.stats)
+metrics.cache_collector("chat_answers", lambda: answer_cache.stats() if answer_cache else None)
+metrics.cache_collector("granite_prefix", lambda: granite_api.prefix_cache.stats()
+                        if granite_api and granite_api.prefix_cache else None)
 
 class ExtractRequest(BaseModel):
     text: str
+    spans: bool = False  # Also return (start, end) offsets into text for each drug
+
+class AnalyzeRequest(BaseModel):
+    text: str
+    age: int = 30
+    deadline_ms: int = PIPELINE_DEADLINE_MS  # Partial results are returned after this
 
 class InteractionRequest(BaseModel):
     drugs: list[str]
 
+class DrugListStreamRequest(BaseModel):
+    drugs: list[str]
+    age: int = 30
+    deadline_ms: int = PIPELINE_DEADLINE_MS
+
 
 class DosageRequest(BaseModel):
     drug: str
@@ -26,7 +115,7 @@ class ChildDosageRequest(BaseModel):
     age: int = 10
     weight: float = 30.0
 @app.post("/get_child_dosage")
-def get_child_dosage_endpoint(request: ChildDosageRequest):
+async def get_child_dosage_endpoint(request: ChildDosageRequest):
     """
     Calculate dosage for children using IBM Granite model.
     """
@@ -37,7 +126,7 @@ def get_child_dosage_endpoint(request: ChildDosageRequest):
         dosage = f"Recommended child dosage for {request.drug}: {request.weight * 10} mg (simulated by IBM Granite)"
         return {"dosage": dosage}
     except Exception as e:
-        print(f"Error in child dosage endpoint: {e}")
+        logger.error("Error in child dosage endpoint: %s", e)
         return {"dosage": "Error calculating child dosage. Please consult a healthcare professional."}
 
 class AlternativeRequest(BaseModel):
@@ -47,6 +136,10 @@ class AlternativeRequest(BaseModel):
 class ChatRequest(BaseModel):
     message: str
     context: str = ""  # Optional context from previous conversation
+    # Keep the conversation server-side instead: "" starts a session, and the
+    # session_id in the response continues it (context is then ignored).
+    session_id: Optional[str] = None
+    cache: bool = True  # False always generates a fresh answer
 
 class BMIRequest(BaseModel):
     weight: float  # in kg
@@ -57,89 +150,375 @@ class BMIRequest(BaseModel):
 class DrugAlternativesInteractionsRequest(BaseModel):
     drug: str
 
+class InternalDrugRequest(BaseModel):
+    drug: str
+    fields: Optional[list[str]] = None  # None for the whole record
+
+# Longest sentence /extract/stream keeps in memory before cutting it
+EXTRACT_STREAM_WINDOW = int(os.environ.get("EXTRACT_STREAM_WINDOW", "8192"))
+
+def _format_drug(d: dict) -> dict:
+    return {
+        "name": d.get('name', ''),
+        "dosage": d.get('dosage', ''),
+        "frequency": d.get('frequency', '')
+    }
+
+def _plain_text(drugs: list) -> str:
+    return "\n\n".join(
+        f"Drug: {drug['name']}\nDosage: {drug['dosage']}\nFrequency: {drug['frequency']}" for drug in drugs
+    )
+
+def _event_stream(events, request: Request) -> StreamingResponse:
+    """
+    Send pipeline events as Server-Sent Events if the client asks for
+    text/event-stream, otherwise as NDJSON.
+    """
+    if "text/event-stream" in request.headers.get("accept", ""):
+        encode, media_type = (lambda e: f"event: {e['event']}\ndata: {json.dumps(e)}\n\n"), "text/event-stream"
+    else:
+        encode, media_type = (lambda e: json.dumps(e) + "\n"), "application/x-ndjson"
+    if hasattr(events, "__aiter__"):
+        async def lines():
+            async for e in events:
+                yield encode(e)
+        return StreamingResponse(lines(), media_type=media_type)
+    return StreamingResponse((encode(e) for e in events), media_type=media_type)
+
+class BodyStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse for generators that are still reading the request body.
+
+    The stock class listens for client disconnects on `receive` while it
+    streams, which would swallow body chunks. Here the body reader is the only
+    consumer of `receive` and notices the disconnect itself.
+    """
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+
+@app.get("/health")
+def health_endpoint():
+    """
+    Liveness plus readiness of the LLM backends, including Granite cold-start time.
+    """
+    return {
+        "status": "ok",
+        "pid": os.getpid(),
+        "shared_cache": SHARED_CACHE_URL.split("://", 1)[0] if shared_store else None,
+        "gemini": {"configured": gemini_api.is_ready()},
+        "granite": granite_api.status() if granite_api else {"state": "disabled"},
+        "router": llm_router.stats(),
+        "drug_cache": drug_lookup.stats(),
+        "local_drugs": {"records": len(local_drugs), "version": local_drugs.version},
+        "cluster": peer_routing.cluster_stats() if peer_routing else {"enabled": False},
+        "chat_sessions": chat_sessions.stats(),
+        "chat_answers": answer_cache.stats() if answer_cache else {"enabled": False},
+        "admission": {name: c.stats() for name, c in route_classes.items()},
+    }
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """
+    Prometheus metrics: request latency per route and status, requests in flight,
+    LLM calls/latency/errors/tokens per backend and cache hit ratios.
+    """
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/admin/profile", response_class=PlainTextResponse)
+def profile_endpoint(seconds: float = 10.0, interval_ms: float = 10.0, idle: bool = False,
+                     x_admin_token: str = Header(default="")):
+    """
+    Sample the stacks of all server threads for `seconds` and return them in folded format.
+
+    Pipe the body into flamegraph.pl or load it in speedscope. Needs the
+    X-Admin-Token header to match ADMIN_TOKEN; only one profile runs at a time.
+    """
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    try:
+        return profiler.profile(seconds, max(interval_ms, 1.0) / 1000.0, include_idle=idle)
+    except profiler.ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
 @app.post("/extract")
 def extract_endpoint(req: ExtractRequest):
-    parsed = extract_drug_info(req.text, gemini_api)
-    formatted_results = []
-    for d in parsed:
-        drug_info = {
-            "name": d.get('name', ''),
-            "dosage": d.get('dosage', ''),
-            "frequency": d.get('frequency', '')
-        }
-        formatted_results.append(drug_info)
-    plain_text = ""
-    for i, drug in enumerate(formatted_results):
-        if i > 0:
-            plain_text += "\n\n"
-        plain_text += f"Drug: {drug['name']}\n"
-        plain_text += f"Dosage: {drug['dosage']}\n"
-        plain_text += f"Frequency: {drug['frequency']}"
-    return {
+    spans = None
+    if req.spans:
+        mentions = extract_drug_spans(req.text, llm_api)
+        spans = [m.offsets() for m in mentions]
+        # Without a mention in the text, the Gemini full-text fallback still applies.
+        parsed = [m.to_dict() for m in mentions] or extract_drug_info(req.text, llm_api)
+    else:
+        parsed = extract_drug_info(req.text, llm_api)
+    formatted_results = [_format_drug(d) for d in parsed]
+    response = {
         "structured": formatted_results,
-        "plain_text": plain_text
+        "plain_text": _plain_text(formatted_results)
     }
+    if spans is not None:
+        response["spans"] = spans
+    return response
+
+@app.post("/extract/stream")
+async def extract_stream_endpoint(request: Request):
+    """
+    Streaming variant of /extract for very large documents.
+
+    The request body is the raw prescription text. It is read incrementally and
+    every drug record is sent as an NDJSON line as soon as its sentence is
+    complete, so memory stays bounded by EXTRACT_STREAM_WINDOW rather than by
+    the document size.
+    """
+    async def records():
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        splitter = SentenceSplitter(window=EXTRACT_STREAM_WINDOW)
+        extractor = DrugExtractor(llm_api)
+        async for chunk in request.stream():
+            for sent in splitter.feed(decoder.decode(chunk)):
+                for d in await run_in_threadpool(extractor.process, sent):
+                    yield json.dumps(_format_drug(d)) + "\n"
+        for sent in splitter.close(decoder.decode(b"", final=True)):
+            for d in await run_in_threadpool(extractor.process, sent):
+                yield json.dumps(_format_drug(d)) + "\n"
+        for d in await run_in_threadpool(extractor.finish, splitter.head):
+            yield json.dumps(_format_drug(d)) + "\n"
+
+    return BodyStreamingResponse(records(), media_type="application/x-ndjson")
+
+@app.post("/analyze_prescription")
+def analyze_prescription_endpoint(request: AnalyzeRequest):
+    """
+    Extract drugs from a prescription and resolve dosage, alternatives and
+    interactions for all of them in one call. Returns per-stage timings and
+    partial results if the deadline passes.
+    """
+    result = analyze_prescription(request.text, request.age, llm_api, request.deadline_ms)
+    result["plain_text"] = _plain_text(result["drugs"])
+    return result
+
+@app.post("/analyze_prescription/stream")
+def analyze_prescription_stream_endpoint(request: AnalyzeRequest, raw_request: Request):
+    """
+    Streaming variant of /analyze_prescription: an 'extracted' event, then one
+    'drug' event per distinct drug as soon as its lookup resolves (local
+    database hits first), then 'done'.
+    """
+    return _event_stream(iter_analysis_events(request.text, request.age, llm_api, request.deadline_ms), raw_request)
 
 @app.post("/check_interactions")
 def check_interactions_endpoint(request: InteractionRequest):
-    interactions = check_interactions(request.drugs, gemini_api)
+    interactions = check_interactions(request.drugs, llm_api)
     return {"interactions": interactions}
 
+@app.post("/check_interactions/stream")
+def check_interactions_stream_endpoint(request: DrugListStreamRequest, raw_request: Request):
+    """
+    Streaming variant of /check_interactions that pushes each drug's
+    interactions (with its dosage and alternatives) as soon as it resolves.
+    """
+    return _event_stream(iter_drug_events(request.drugs, llm_api, request.age, request.deadline_ms), raw_request)
+
 @app.post("/get_dosage")
-def get_dosage_endpoint(request: DosageRequest):
-    dosage = get_dosage(request.drug, request.age, gemini_api)
+async def get_dosage_endpoint(request: DosageRequest):
+    rendered = local_drugs.dosage(request.drug, request.age)
+    if rendered:
+        return rendered_response(rendered)
+    dosage = await run_in_threadpool(get_dosage, request.drug, request.age, llm_api)
     return {"dosage": dosage}
 
+@app.get("/drugs/{name}")
+async def drug_endpoint(name: str, if_none_match: Optional[str] = Header(default=None)):
+    """
+    Drug record by name, with an ETag; If-None-Match with a current ETag gets 304.
+
+    Local drugs are served pre-rendered and may be cached for
+    DRUG_RESPONSE_MAX_AGE seconds. Others are looked up through the LLM (and
+    the drug-info cache) and must be revalidated before reuse.
+    """
+    rendered = local_drugs.record(name)
+    if rendered:
+        return rendered_response(rendered, if_none_match, local_drugs.cache_control)
+    record, backend = await run_in_threadpool(_drug_with_backend, name)
+    if record is None:
+        raise HTTPException(status_code=502, detail="Drug information is unavailable right now.")
+    return rendered_response(render(dict(record, source=backend)), if_none_match, "no-cache")
+
+def _drug_with_backend(name: str):
+    """query_drug plus the backend that answered (recorded on the calling thread)."""
+    return llm_api.query_drug(name), llm_api.last_backend()
+
+@app.get("/drugs/{name}/dosage")
+async def drug_dosage_endpoint(name: str, age: int = 30, if_none_match: Optional[str] = Header(default=None)):
+    """Cacheable form of /get_dosage; see /drugs/{name}."""
+    rendered = local_drugs.dosage(name, age)
+    if rendered:
+        return rendered_response(rendered, if_none_match, local_drugs.cache_control)
+    dosage = await run_in_threadpool(get_dosage, name, age, llm_api)
+    return rendered_response(render({"dosage": dosage}), if_none_match, "no-cache")
+
 @app.post("/suggest_alternatives")
 def suggest_alternatives_endpoint(request: AlternativeRequest):
-    # Always fetch alternatives directly from Gemini API, no local fallback
+    # Local drugs are answered from _drug_db, the others from the LLM (as in the streaming endpoints)
     try:
-        alternatives = suggest_alternatives(request.drug, request.age, gemini_api)
+        alternatives = suggest_alternatives(request.drug, request.age, llm_api)
     except Exception as e:
-        print(f"Error fetching alternatives from Gemini: {e}")
+        logger.error("Error fetching alternatives from Gemini: %s", e)
         alternatives = ["Unable to fetch alternatives from Gemini API. Please consult a healthcare professional."]
     return {"alternatives": alternatives}
 
 @app.post("/get_drug_alternatives_interactions")
 def get_drug_alternatives_interactions_endpoint(request: DrugAlternativesInteractionsRequest):
-    result = get_alternatives_and_interactions_via_gemini(request.drug, gemini_api)
+    result = get_alternatives_and_interactions_via_gemini(request.drug, llm_api)
     return result
 
-@app.post("/chat")
-def chat_endpoint(request: ChatRequest):
+@app.post("/get_drug_alternatives_interactions/stream")
+def get_drug_alternatives_interactions_stream_endpoint(request: DrugListStreamRequest, raw_request: Request):
+    """
+    Alternatives and interactions for several drugs, one event per drug as it resolves.
     """
-    Process a chat message using the Gemini API and return a response
-    focused on medical and pharmaceutical information.
+    return _event_stream(iter_drug_events(request.drugs, llm_api, request.age, request.deadline_ms), raw_request)
+
+@app.post(cluster.INTERNAL_DRUG_PATH)
+def internal_drug_endpoint(request: InternalDrugRequest, x_cluster_token: str = Header(default="")):
+    """
+    Drug lookup forwarded by another node that found this one owns the drug.
+
+    Answered from this node's cache and backends only, never forwarded again.
     """
-    prompt = f"""
-You are MediBot, a helpful medical assistant chatbot. 
-Provide accurate, helpful information about medications, health conditions, and general medical advice.
+    if peer_routing is None or not cluster.CLUSTER_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(x_cluster_token.encode(), cluster.CLUSTER_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid cluster token")
+    try:
+        record = cluster.lookup_internal(drug_lookup, request.drug, request.fields)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"record": record, "node": peer_routing.self_url}
 
-Always include appropriate disclaimers when providing medical information.
-If you're unsure about something, acknowledge your limitations and suggest consulting a healthcare professional.
+def _chat_session(request: ChatRequest):
+    """The request's chat session (None without session_id) and the context for its prompt."""
+    if request.session_id is None:
+        return None, request.context
+    session = chat_sessions.open(request.session_id)
+    return session, chat_sessions.context(session)
 
-Previous context (if any):
-{request.context}
+def _answer_cache(request: ChatRequest, context: str):
+    """The answer cache, if this turn may use it: only without context, since follow-ups depend on it."""
+    return answer_cache if request.cache and not context.strip() else None
 
-User's question: {request.message}
-"""
+@app.post("/chat")
+def chat_endpoint(request: ChatRequest):
+    """
+    Process a chat message with the fastest available LLM backend and return
+    a response focused on medical and pharmaceutical information.
+    """
+    session, context = _chat_session(request)
+    cache = _answer_cache(request, context)
+    response = _chat_reply(request.message, medibot_prompt(request.message, context), session, cache)
+    if session:
+        response["session_id"] = session.id
+    return response
 
+def _chat_reply(message: str, prompt: str, session, cache=None):
     try:
-        # Use the GeminiAPI class method query to get a response
-        text = gemini_api.query(prompt)
+        text = cache.get(message) if cache else None
+        backend = "cache"
+        if text is None:
+            text = llm_api.query(prompt)
+            backend = llm_api.last_backend()
         if text:
             # Prevent echoing the user's input as a loop by checking for repeated input
-            if text.strip() == request.message.strip():
+            if text.strip() == message.strip():
                 return {"response": "I'm sorry, I couldn't generate a new response. Please try rephrasing your question."}
-            return {"response": text}
+            if session:
+                chat_sessions.record(session, message, text)
+            if cache and backend != "cache":
+                cache.put(message, text)
+            return {"response": text, "backend": backend}
         else:
             return {"response": "I'm sorry, I couldn't generate a response. Please try again."}
     except Exception as e:
-        print(f"Error in chat endpoint: {e}")
+        logger.error("Error in chat endpoint: %s", e)
         return {"response": "An error occurred while processing your request. Please try again."}
 
+@app.delete("/chat/sessions/{session_id}")
+def delete_chat_session(session_id: str):
+    """Forget a chat session (e.g. when the user clears the chat)."""
+    if not chat_sessions.delete(session_id):
+        raise HTTPException(status_code=404, detail="Unknown chat session")
+    return {"deleted": session_id}
+
+def _query_with_backend(prompt: str):
+    """Router query plus the backend that answered (recorded on the calling thread)."""
+    return llm_api.query(prompt), llm_api.last_backend()
+
+async def _chat_events(prompt: str, message: str = "", session=None, cache=None):
+    """
+    'token' events as the reply is generated, then 'done' with time-to-first-token.
+
+    Local Granite streams token by token. Otherwise the router's reply is sent
+    as a single token event. When the client goes away the stream is
+    cancelled here, which sets `cancel` and stops Granite after its next token.
+    With a session, the complete reply is recorded in it and 'done' carries its ID.
+    A reply from the answer `cache` is sent as one token, with backend "cache".
+    The session store and the cache may be SQLite or Redis, so they are only
+    used from the threadpool.
+    """
+    started = time.perf_counter()
+    first_token_ms = None
+    chunks = []
+    cached = await run_in_threadpool(cache.get, message) if cache else None
+    if cached is not None:
+        backend = "cache"
+        cancel = None
+        tokens = iter([cached])
+    elif granite_api and granite_api.is_ready():
+        backend = "granite"
+        cancel = threading.Event()
+        tokens = granite_api.stream_query(prompt, cancel=cancel)
+    else:
+        text, backend = await run_in_threadpool(_query_with_backend, prompt)
+        cancel = None
+        tokens = iter([text] if text else [])
+    try:
+        while True:
+            # abandon_on_cancel lets a disconnect cancel us while next() is still waiting.
+            chunk = await anyio.to_thread.run_sync(next, tokens, None, abandon_on_cancel=True)
+            if chunk is None:
+                break
+            if first_token_ms is None:
+                first_token_ms = round((time.perf_counter() - started) * 1000, 2)
+            chunks.append(chunk)
+            yield {"event": "token", "text": chunk}
+    finally:
+        if cancel:
+            cancel.set()
+    if first_token_ms is None:
+        yield {"event": "token", "text": "I'm sorry, I couldn't generate a response. Please try again."}
+    else:
+        if session:
+            await run_in_threadpool(chat_sessions.record, session, message, "".join(chunks))
+        if cache and cached is None:
+            await run_in_threadpool(cache.put, message, "".join(chunks))
+    done = {"event": "done", "backend": backend, "ttft_ms": first_token_ms,
+            "total_ms": round((time.perf_counter() - started) * 1000, 2)}
+    if session:
+        done["session_id"] = session.id
+    yield done
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest, raw_request: Request):
+    """
+    Streaming form of /chat: NDJSON (or SSE) 'token' events, then 'done'.
+    """
+    session, context = await run_in_threadpool(_chat_session, request)
+    return _event_stream(_chat_events(medibot_prompt(request.message, context), request.message, session,
+                                      _answer_cache(request, context)), raw_request)
+
 @app.post("/calculate_bmi")
-def calculate_bmi_endpoint(request: BMIRequest):
+async def calculate_bmi_endpoint(request: BMIRequest):
     """
     Calculate BMI and provide health status information based on the result.
     """
@@ -186,5 +565,5 @@ def calculate_bmi_endpoint(request: BMIRequest):
             "disclaimer": "BMI is a screening tool and not a diagnostic of body fatness or health. Consult a healthcare provider for a complete health assessment."
         }
     except Exception as e:
-        print(f"Error calculating BMI: {e}")
+        logger.error("Error calculating BMI: %s", e)
         return {"error": "An error occurred while calculating BMI. Please check your input values."}
\ No newline at end of file
@@ -0,0 +1,290 @@
+"""
+Server-side chat sessions with a token-budgeted context.
+
+A session keeps the most recent turns verbatim and folds older ones into a
+running summary, so the context sent with each chat prompt stays within
+CHAT_CONTEXT_TOKENS however long the conversation gets. Turns pushed out of
+the recent window wait in a backlog until there are CHAT_SUMMARY_EVERY_TOKENS
+of them; the summary is then refreshed in the background by the LLM, never
+on the request path. Until it is, the newest part of the backlog is shown
+as-is. If the LLM fails, the backlog is folded in by plain truncation.
+
+Tokens are estimated as four characters each, which is close enough for
+English text and needs no tokenizer.
+
+With a shared store (see shared_cache) sessions live there, so any worker
+process can continue a conversation; each process keeps a copy that is
+reloaded from the store whenever the session is opened.
+"""
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .prompts import chat_summary_prompt
+from .shared_cache import SharedStore
+
+logger = logging.getLogger(__name__)
+
+# Context budget per chat prompt, and the part of it the summary may use
+CHAT_CONTEXT_TOKENS = int(os.environ.get("CHAT_CONTEXT_TOKENS", "768"))
+CHAT_SUMMARY_TOKENS = int(os.environ.get("CHAT_SUMMARY_TOKENS", "192"))
+# Refresh the summary once this many tokens of older turns are waiting for it
+CHAT_SUMMARY_EVERY_TOKENS = int(os.environ.get("CHAT_SUMMARY_EVERY_TOKENS", "256"))
+# Idle seconds before a session is dropped, and sessions kept at most
+CHAT_SESSION_TTL = float(os.environ.get("CHAT_SESSION_TTL", "3600"))
+CHAT_SESSIONS_MAX = int(os.environ.get("CHAT_SESSIONS_MAX", "10000"))
+CHAT_SUMMARY_WORKERS = int(os.environ.get("CHAT_SUMMARY_WORKERS", "2"))
+
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _head(text: str, tokens: int) -> str:
+    """Start of `text` within `tokens`, cut at a word boundary."""
+    limit = tokens * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    cut = text[:limit].rsplit(" ", 1)[0]
+    return (cut or text[:limit]) + "..."
+
+
+def _tail(text: str, tokens: int) -> str:
+    """End of `text` within `tokens`, cut at a word boundary."""
+    limit = tokens * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    cut = text[-limit:].split(" ", 1)[-1]
+    return "..." + (cut or text[-limit:])
+
+
+def _transcript(turns) -> str:
+    return "\n".join(f"{role}: {text}" for role, text in turns)
+
+
+class ChatSession:
+    """Recent turns, the backlog of older turns and the summary of everything before."""
+
+    def __init__(self, session_id: str):
+        self.id = session_id
+        self.turns: List[Tuple[str, str]] = []
+        self.backlog: List[Tuple[str, str]] = []
+        self.summary = ""
+        self.summarizing = False
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+
+    def state(self) -> Dict:
+        return {"turns": self.turns, "backlog": self.backlog, "summary": self.summary}
+
+    def load(self, state: Dict):
+        self.turns = [tuple(t) for t in state["turns"]]
+        self.backlog = [tuple(t) for t in state["backlog"]]
+        self.summary = state["summary"]
+
+
+class ChatSessionStore:
+    """
+    Thread-safe store of ChatSessions by ID, least recently used first out.
+
+    Args:
+        summarize: Prompt to text (e.g. the router's query); None folds old
+            turns by truncation only.
+        context_tokens: Budget for the whole context.
+        summary_tokens: Part of the budget for the summary and backlog.
+        summary_every: Backlog tokens that trigger a summary refresh.
+        ttl: Idle seconds before a session expires.
+        max_sessions: Sessions kept before the least recently used is dropped.
+        shared: Store shared with the other worker processes, if any.
+    """
+
+    def __init__(self, summarize: Optional[Callable[[str], Optional[str]]] = None,
+                 context_tokens: int = CHAT_CONTEXT_TOKENS, summary_tokens: int = CHAT_SUMMARY_TOKENS,
+                 summary_every: int = CHAT_SUMMARY_EVERY_TOKENS, ttl: float = CHAT_SESSION_TTL,
+                 max_sessions: int = CHAT_SESSIONS_MAX, workers: int = CHAT_SUMMARY_WORKERS,
+                 shared: Optional[SharedStore] = None):
+        self.summarize = summarize
+        self.shared = shared
+        self.context_tokens = context_tokens
+        self.summary_tokens = min(summary_tokens, context_tokens)
+        self.summary_every = summary_every
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._summarizer = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chat-summary")
+        self.created = 0
+        self.expired = 0
+        self.summaries = 0
+        self.summary_failures = 0
+
+    def _expire(self, now: float):
+        """Drop idle sessions from the least recently used end. Call with the lock held."""
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if now - oldest.last_used < self.ttl and len(self._sessions) <= self.max_sessions:
+                break
+            self._sessions.popitem(last=False)
+            self.expired += 1
+
+    def open(self, session_id: Optional[str] = None) -> ChatSession:
+        """
+        The session with this ID, or a new one with a fresh ID.
+
+        Unknown and expired IDs also get a new session; IDs are always made
+        here, so a client cannot pick (or guess) someone else's.
+        """
+        state = self._shared_state(session_id) if session_id and self.shared is not None else None
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(session_id) if session_id else None
+            if self.shared is not None and session_id:
+                # The shared store decides whether the session still exists.
+                if state is None:
+                    session = None
+                elif session is None:
+                    session = self._sessions[session_id] = ChatSession(session_id)
+            created = session is None
+            if created:
+                session = ChatSession(secrets.token_urlsafe(16))
+                self._sessions[session.id] = session
+                self.created += 1
+                self._expire(now)
+            else:
+                self._sessions.move_to_end(session.id)
+            session.last_used = now
+        if state is not None:
+            with session.lock:
+                session.load(state)
+        elif created and self.shared is not None:
+            self._apply(session, lambda s: None)
+        return session
+
+    def delete(self, session_id: str) -> bool:
+        existed = False
+        if self.shared is not None:
+            existed = self._shared_state(session_id) is not None
+            self.shared.delete(_shared_key(session_id))
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None or existed
+
+    def _shared_state(self, session_id: str) -> Optional[Dict]:
+        try:
+            blob = self.shared.get(_shared_key(session_id))
+        except Exception as e:
+            logger.error("Reading chat session from the shared store failed: %s", e)
+            return None
+        return None if blob is None else json.loads(blob)
+
+    def _apply(self, session: ChatSession, change: Callable[[ChatSession], object]):
+        """
+        Run change(session) with the session locked, and return its result.
+
+        With a shared store the change is applied to the stored state (so
+        changes made by other processes are kept) and saved back.
+        """
+        if self.shared is None:
+            with session.lock:
+                return change(session)
+        result = []
+        with session.lock:
+            base, summarizing = json.dumps(session.state()), session.summarizing
+
+        def update(blob):
+            # May run again when another process saved the session first; each run starts afresh.
+            with session.lock:
+                session.load(json.loads(blob if blob is not None else base))
+                session.summarizing = summarizing
+                result[:] = [change(session)]
+                return json.dumps(session.state()).encode()
+
+        try:
+            self.shared.update(_shared_key(session.id), update, self.ttl)
+        except Exception as e:
+            logger.error("Saving chat session to the shared store failed: %s", e)
+            if not result:
+                with session.lock:
+                    return change(session)
+        return result[0]
+
+    def context(self, session: ChatSession) -> str:
+        """Summary, then the newest unsummarized backlog, then recent turns, within the budget."""
+        with session.lock:
+            summary, backlog, turns = session.summary, list(session.backlog), list(session.turns)
+        parts = []
+        left = self.summary_tokens
+        if summary:
+            summary = _head(summary, left)
+            parts.append(f"Summary of earlier conversation: {summary}")
+            left -= estimate_tokens(summary)
+        if backlog and left > 0:
+            parts.append(_tail(_transcript(backlog), left))
+        recent = self.context_tokens - self.summary_tokens
+        if turns:
+            parts.append(_tail(_transcript(turns), recent))
+        return "\n".join(parts)
+
+    def record(self, session: ChatSession, message: str, reply: str):
+        """Add a user message and the reply, folding turns that no longer fit into the backlog."""
+        if self._apply(session, lambda s: self._append(s, message, reply)):
+            self._summarizer.submit(self._refresh_summary, session)
+
+    def _append(self, session: ChatSession, message: str, reply: str) -> bool:
+        """Add an exchange; True if a summary refresh should start. Call with the session locked."""
+        recent = self.context_tokens - self.summary_tokens
+        session.turns += [("user", message), ("bot", reply)]
+        # Whole exchanges leave the window; the newest one always stays.
+        while len(session.turns) > 2 and estimate_tokens(_transcript(session.turns)) > recent:
+            session.backlog += session.turns[:2]
+            del session.turns[:2]
+        if (session.summarizing or not session.backlog
+                or estimate_tokens(_transcript(session.backlog)) < self.summary_every):
+            return False
+        session.summarizing = True
+        return True
+
+    def _refresh_summary(self, session: ChatSession):
+        with session.lock:
+            summary, folded = session.summary, list(session.backlog)
+        transcript = _transcript(folded)
+        updated = None
+        if self.summarize is not None:
+            try:
+                updated = self.summarize(chat_summary_prompt(summary, transcript))
+            except Exception as e:
+                logger.error("Summarizing chat session failed: %s", e)
+        if updated and updated.strip():
+            updated = _head(updated.strip(), self.summary_tokens)
+            self.summaries += 1
+        else:
+            # Without a summary, keep the newest text that fits.
+            if self.summarize is not None:
+                self.summary_failures += 1
+            updated = _tail(f"{summary}\n{transcript}".strip(), self.summary_tokens)
+
+        def fold(s: ChatSession):
+            # Turns folded in while the summary was being written stay in the backlog.
+            if s.backlog[:len(folded)] == folded:
+                s.summary = updated
+                del s.backlog[:len(folded)]
+            s.summarizing = False
+
+        self._apply(session, fold)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"sessions": len(self._sessions), "created": self.created, "expired": self.expired,
+                    "summaries": self.summaries, "summary_failures": self.summary_failures}
+
+
+def _shared_key(session_id: str) -> str:
+    return "chat:" + session_id
@@ -0,0 +1,193 @@
+"""
+Consistent-hash routing of drug lookups across backend nodes.
+
+Behind a load balancer every node would otherwise fill its own drug-info
+cache, and each drug would be fetched from Gemini once per node. With
+CLUSTER_PEERS set, the normalized drug name is hashed onto a ring of the
+nodes (with CLUSTER_VNODES points per node, so keys spread evenly and only
+about 1/N of them move when a node joins or leaves). The owner of a drug
+looks it up itself; every other node forwards the lookup to the owner's
+/internal/drug endpoint over a pooled HTTP connection, so each drug is
+fetched and cached once in the whole cluster.
+
+A peer that cannot be reached is skipped for CLUSTER_PEER_COOLDOWN seconds
+and its drugs are looked up locally meanwhile, so a node going down costs
+cache hits, not answers. The internal endpoint always answers locally, so a
+lookup is forwarded at most once even if nodes disagree about the ring.
+"""
+import bisect
+import hashlib
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import deadline, metrics
+from .drug_logic import normalize_name
+from .prompts import drug_fields
+from .section_parser import DRUG_SECTIONS
+
+logger = logging.getLogger(__name__)
+
+# Base URLs of all nodes, this one included, and this node's own URL as it appears there
+CLUSTER_PEERS = [p.strip().rstrip("/") for p in os.environ.get("CLUSTER_PEERS", "").split(",") if p.strip()]
+CLUSTER_SELF = os.environ.get("CLUSTER_SELF", "").rstrip("/")
+# Shared secret the nodes send to each other's internal endpoint; peer routing
+# (and the endpoint) stays off without it
+CLUSTER_TOKEN = os.environ.get("CLUSTER_TOKEN", "")
+CLUSTER_VNODES = int(os.environ.get("CLUSTER_VNODES", "64"))
+CLUSTER_FORWARD_TIMEOUT = float(os.environ.get("CLUSTER_FORWARD_TIMEOUT", "15"))
+CLUSTER_PEER_COOLDOWN = float(os.environ.get("CLUSTER_PEER_COOLDOWN", "10"))
+CLUSTER_POOL_SIZE = int(os.environ.get("CLUSTER_POOL_SIZE", "32"))
+
+INTERNAL_DRUG_PATH = "/internal/drug"
+TOKEN_HEADER = "x-cluster-token"
+
+
+def _point(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent-hash ring mapping keys to nodes, `vnodes` points per node."""
+
+    def __init__(self, nodes: Iterable[str], vnodes: int = CLUSTER_VNODES):
+        self.nodes = sorted(set(nodes))
+        if not self.nodes:
+            raise ValueError("A hash ring needs at least one node")
+        points = sorted((_point(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self._hashes = [h for h, _ in points]
+        self._owners = [node for _, node in points]
+
+    def owner(self, key: str) -> str:
+        """The node owning `key`: the first point clockwise from the key's hash."""
+        i = bisect.bisect(self._hashes, _point(key)) % len(self._hashes)
+        return self._owners[i]
+
+
+class PeerRouting:
+    """
+    Sends drug lookups to the node owning the drug, wrapping this node's own lookup.
+
+    query_drug and query_drug_fields are forwarded to the owner when that
+    is another node; everything else (query, stats, is_ready, ...) goes to
+    `local`. last_backend() is "peer" after a forwarded lookup.
+
+    Args:
+        local: This node's lookup (usually the CachedDrugLookup).
+        ring: HashRing of all nodes.
+        self_url: This node's URL on the ring.
+        token: Sent in X-Cluster-Token to the peers.
+        timeout: Seconds to wait for a peer (capped by the request deadline).
+        cooldown: Seconds an unreachable peer is skipped.
+        pool_size: Pooled connections kept per peer.
+    """
+
+    def __init__(self, local, ring: HashRing, self_url: str, token: str = CLUSTER_TOKEN,
+                 timeout: float = CLUSTER_FORWARD_TIMEOUT, cooldown: float = CLUSTER_PEER_COOLDOWN,
+                 pool_size: int = CLUSTER_POOL_SIZE):
+        if self_url not in ring.nodes:
+            raise ValueError(f"CLUSTER_SELF '{self_url}' is not one of the peers {ring.nodes}")
+        self.local = local
+        self.ring = ring
+        self.self_url = self_url
+        self.token = token
+        self.timeout = timeout
+        self.cooldown = cooldown
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(ring.nodes), pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._down_until: Dict[str, float] = {}
+        self._peers = {node: {"forwarded": 0, "failures": 0} for node in ring.nodes if node != self_url}
+        self.served_locally = 0
+
+    def __getattr__(self, name):
+        return getattr(self.local, name)
+
+    def owner(self, drug_name: str) -> str:
+        return self.ring.owner(normalize_name(drug_name))
+
+    def _available(self, peer: str) -> bool:
+        with self._lock:
+            return self._down_until.get(peer, 0.0) <= time.monotonic()
+
+    def _count(self, peer: str, key: str):
+        with self._lock:
+            self._peers[peer][key] += 1
+
+    def _forward(self, peer: str, drug_name: str, fields: Optional[List[str]]) -> Optional[Dict[str, Any]]:
+        """The owner's answer, or raises when the peer could not give one."""
+        timeout = deadline.timeout(self.timeout)
+        if timeout <= 0:
+            raise TimeoutError("No time left to ask a peer")
+        headers = {TOKEN_HEADER: self.token, deadline.DEADLINE_HEADER: str(int(timeout * 1000))}
+        with metrics.upstream_call("peer", "drug"):
+            response = self.session.post(peer + INTERNAL_DRUG_PATH, json={"drug": drug_name, "fields": fields},
+                                         headers=headers, timeout=timeout)
+            response.raise_for_status()
+            return response.json()["record"]
+
+    def _lookup(self, drug_name: str, fields: Optional[List[str]], local_call):
+        owner = self.owner(drug_name)
+        if owner != self.self_url and self._available(owner):
+            try:
+                record = self._forward(owner, drug_name, fields)
+                self._count(owner, "forwarded")
+                self._local.backend = "peer"
+                return record
+            except requests.HTTPError as e:
+                # The peer is up but could not answer (e.g. shedding load); it stays in the ring.
+                self._count(owner, "failures")
+                logger.warning("Peer %s could not look up %s: %s", owner, drug_name, e)
+            except Exception as e:
+                self._count(owner, "failures")
+                with self._lock:
+                    self._down_until[owner] = time.monotonic() + self.cooldown
+                logger.warning("Peer %s is unreachable, looking up %s locally: %s", owner, drug_name, e)
+        with self._lock:
+            self.served_locally += 1
+        self._local.backend = None
+        return local_call()
+
+    def query_drug(self, drug_name: str) -> Optional[Dict[str, Any]]:
+        return self._lookup(drug_name, None, lambda: self.local.query_drug(drug_name))
+
+    def query_drug_fields(self, drug_name: str, fields: Iterable[str]) -> Optional[Dict[str, Any]]:
+        fields = drug_fields(fields)
+        return self._lookup(drug_name, list(fields), lambda: self.local.query_drug_fields(drug_name, fields))
+
+    def last_backend(self) -> Optional[str]:
+        return getattr(self._local, "backend", None) or self.local.last_backend()
+
+    def cluster_stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            peers = {node: dict(counts, down=self._down_until.get(node, 0.0) > now)
+                     for node, counts in self._peers.items()}
+            return {"self": self.self_url, "nodes": len(self.ring.nodes), "served_locally": self.served_locally,
+                    "peers": peers}
+
+
+def lookup_internal(local, drug_name: str, fields: Optional[List[str]]) -> Optional[Dict[str, Any]]:
+    """Answer a forwarded lookup from this node's own lookup (never forwarded again)."""
+    if fields is None or drug_fields(fields) == DRUG_SECTIONS:
+        return local.query_drug(drug_name)
+    return local.query_drug_fields(drug_name, fields)
+
+
+def from_env(local) -> Optional[PeerRouting]:
+    """PeerRouting for CLUSTER_PEERS/CLUSTER_SELF, or None when no peers or no CLUSTER_TOKEN are configured."""
+    if len(CLUSTER_PEERS) < 2:
+        return None
+    if not CLUSTER_TOKEN:
+        # An empty token would match an absent header, leaving the internal endpoint open.
+        logger.error("CLUSTER_PEERS is set but CLUSTER_TOKEN is not; peer routing is disabled")
+        return None
+    return PeerRouting(local, HashRing(CLUSTER_PEERS), CLUSTER_SELF, CLUSTER_TOKEN)
@@ -0,0 +1,94 @@
+"""
+Request deadlines, propagated to every upstream call.
+
+A client sends its remaining time budget in the X-Deadline-Ms header (a
+relative budget, so clocks need not agree). DeadlineMiddleware turns it
+into an absolute time.perf_counter() deadline in a context variable, and
+the Gemini and Granite wrappers size their timeouts with timeout(), so a
+lookup gives up when the answer would arrive too late to be of use.
+Worker threads see the deadline when started through timing.submit.
+"""
+import contextvars
+import os
+import time
+from typing import Optional
+
+DEADLINE_HEADER = "x-deadline-ms"
+# Deadline for requests that send no header; 0 leaves them unbounded.
+DEFAULT_DEADLINE_MS = float(os.environ.get("DEFAULT_DEADLINE_MS", "0"))
+# Below this many seconds left an upstream call is not started at all.
+MIN_UPSTREAM_SECONDS = float(os.environ.get("MIN_UPSTREAM_MS", "50")) / 1000.0
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+
+
+def current() -> Optional[float]:
+    """Absolute perf_counter deadline of the current request, or None."""
+    return _deadline.get()
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the deadline (may be negative), or None without one."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.perf_counter()
+
+
+def timeout(default: float) -> float:
+    """`default` capped by the time left; 0.0 if too little is left to start a call."""
+    left = remaining()
+    if left is None:
+        return default
+    return min(default, left) if left >= MIN_UPSTREAM_SECONDS else 0.0
+
+
+def clamp(deadline: Optional[float]) -> Optional[float]:
+    """The earlier of `deadline` and the request's deadline (either may be None)."""
+    request_deadline = _deadline.get()
+    if deadline is None or request_deadline is None:
+        return deadline if request_deadline is None else request_deadline
+    return min(deadline, request_deadline)
+
+
+class within:
+    """Context manager setting a deadline `seconds` from now (tightening any existing one)."""
+
+    def __init__(self, seconds: Optional[float]):
+        self.deadline = None if seconds is None else time.perf_counter() + seconds
+
+    def __enter__(self):
+        self.token = _deadline.set(clamp(self.deadline))
+        return self
+
+    def __exit__(self, *exc):
+        _deadline.reset(self.token)
+        return False
+
+
+def _parse(value: bytes) -> Optional[float]:
+    try:
+        ms = float(value.decode("latin-1"))
+    except ValueError:
+        return None
+    return ms if ms >= 0 else None
+
+
+class DeadlineMiddleware:
+    """ASGI middleware setting the request deadline from X-Deadline-Ms (or DEFAULT_DEADLINE_MS)."""
+
+    def __init__(self, app, default_ms: float = DEFAULT_DEADLINE_MS):
+        self.app = app
+        self.default_ms = default_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        ms = None
+        for name, value in scope.get("headers", []):
+            if name == DEADLINE_HEADER.encode():
+                ms = _parse(value)
+                break
+        if ms is None and self.default_ms > 0:
+            ms = self.default_ms
+        with within(None if ms is None else ms / 1000.0):
+            await self.app(scope, receive, send)
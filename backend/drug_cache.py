@@ -0,0 +1,346 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from . import logs
+from .drug_logic import normalize_name
+from .prompts import drug_fields
+from .section_parser import DRUG_SECTIONS
+from .shared_cache import SharedStore
+
+logger = logging.getLogger(__name__)
+
+# How long a looked-up section stays fresh, and how many drugs are kept
+DRUG_CACHE_TTL = float(os.environ.get("DRUG_CACHE_TTL", "86400"))
+DRUG_CACHE_SIZE = int(os.environ.get("DRUG_CACHE_SIZE", "2048"))
+# How long after that a section may still be served while it is refreshed
+DRUG_CACHE_STALE_TTL = float(os.environ.get("DRUG_CACHE_STALE_TTL", "604800"))
+DRUG_CACHE_REFRESH_WORKERS = int(os.environ.get("DRUG_CACHE_REFRESH_WORKERS", "2"))
+
+
+class DrugInfoCache:
+    """
+    Thread-safe LRU of drug records that may hold only some sections.
+
+    A dosage-only lookup stores a partial record; a later interactions
+    lookup for the same drug fills in that section, and so on until the
+    record is complete. Each section is fresh for `ttl` seconds after it
+    was fetched, then stale for another `stale_ttl` seconds: lookup()
+    still returns it, flagged for a refresh, and after that it is gone.
+    An UNKNOWN_MEDICATION answer counts as having every section.
+
+    With a `shared` store (see shared_cache) the records are also written
+    there, and a drug this process has not cached is looked up there, so
+    a section fetched by one worker process serves all of them.
+
+    Args:
+        max_entries: Drugs kept before the least recently used is dropped.
+        ttl: Seconds a section stays fresh.
+        stale_ttl: Seconds a section may be served stale after that.
+        shared: Store shared with the other worker processes, if any.
+    """
+
+    def __init__(self, max_entries: int = DRUG_CACHE_SIZE, ttl: float = DRUG_CACHE_TTL,
+                 stale_ttl: float = DRUG_CACHE_STALE_TTL, shared: Optional[SharedStore] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.shared = shared
+        # normalized name -> (record, section -> time.time() it was fetched); wall-clock
+        # times, so entries from other processes compare
+        self._entries: "OrderedDict[str, Tuple[Dict[str, Any], Dict[str, float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.partial_hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+
+    def _sections(self, key: str) -> Tuple[Optional[Dict[str, Any]], Tuple[str, ...], Tuple[str, ...]]:
+        """Cached record for key, its fresh sections and its stale ones. Call with the lock held."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None, (), ()
+        record, fetched = entry
+        now = time.time()
+        fresh, stale = [], []
+        for f in DRUG_SECTIONS:
+            age = now - fetched.get(f, float("-inf"))
+            if age < self.ttl:
+                fresh.append(f)
+            elif age < self.ttl + self.stale_ttl:
+                stale.append(f)
+        return record, tuple(fresh), tuple(stale)
+
+    def _covered(self, key: str, fields: Tuple[str, ...]) -> Tuple[Optional[Dict[str, Any]], Tuple[str, ...], bool]:
+        """(record, stale fields) if `fields` are all cached, else (None, (), any cached). Call with the lock held."""
+        record, fresh, stale = self._sections(key)
+        if record is not None and set(fields) <= set(fresh + stale):
+            self._entries.move_to_end(key)
+            return dict(record), tuple(f for f in fields if f in stale), True
+        return None, (), bool(fresh or stale)
+
+    def lookup(self, drug_name: str, fields: Iterable[str] = DRUG_SECTIONS
+               ) -> Tuple[Optional[Dict[str, Any]], Tuple[str, ...]]:
+        """
+        Cached record covering `fields`, fresh or stale, and which of them are stale.
+
+        Returns (None, ()) unless every section in `fields` is cached.
+        """
+        fields = drug_fields(fields)
+        key = normalize_name(drug_name)
+        with self._lock:
+            record, stale, partial = self._covered(key, fields)
+            if record is not None and (not stale or self.shared is None):
+                self._count(record, stale, partial)
+                return record, stale
+        # Another process may have the missing sections, or have refreshed the stale ones.
+        if self.shared is not None and self._pull(key):
+            with self._lock:
+                shared_record, shared_stale, partial = self._covered(key, fields)
+                if shared_record is not None and (record is None or len(shared_stale) < len(stale)):
+                    self.shared_hits += 1
+                record, stale = shared_record, shared_stale
+        with self._lock:
+            self._count(record, stale, partial)
+        return record, stale
+
+    def _count(self, record, stale, partial):
+        if record is None:
+            if partial:
+                self.partial_hits += 1
+                logs.cache("drug_info", "partial")
+            else:
+                self.misses += 1
+                logs.cache("drug_info", "miss")
+        elif stale:
+            self.stale_hits += 1
+            logs.cache("drug_info", "stale")
+        else:
+            self.hits += 1
+            logs.cache("drug_info", "hit")
+
+    def _pull(self, key: str) -> bool:
+        """Combine the shared store's entry for key into this process's. True if there was one."""
+        try:
+            blob = self.shared.get(_shared_key(key))
+        except Exception as e:
+            logger.error("Reading %s from the shared drug cache failed: %s", key, e)
+            return False
+        if blob is None:
+            return False
+        theirs = _decode(blob)
+        with self._lock:
+            mine = self._entries.pop(key, None)
+            self._store(key, _combine(mine, theirs))
+        return True
+
+    def _store(self, key: str, entry):
+        """Put an entry at the most recently used end. Call with the lock held."""
+        self._entries[key] = entry
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, drug_name: str, fields: Iterable[str] = DRUG_SECTIONS) -> Optional[Dict[str, Any]]:
+        """Copy of the cached record if every section in `fields` is fresh, else None."""
+        record, stale = self.lookup(drug_name, fields)
+        return None if stale else record
+
+    def missing(self, drug_name: str, fields: Iterable[str] = DRUG_SECTIONS) -> Tuple[str, ...]:
+        """Sections of `fields` not cached fresh for this drug."""
+        fields = drug_fields(fields)
+        with self._lock:
+            _, fresh, _ = self._sections(normalize_name(drug_name))
+        return tuple(f for f in fields if f not in fresh)
+
+    def merge(self, drug_name: str, record: Dict[str, Any], fields: Iterable[str] = DRUG_SECTIONS) -> Dict[str, Any]:
+        """
+        Store the sections `fields` of `record` and return a copy of the merged record.
+
+        Sections already cached for the drug are kept unless `fields` replaces them.
+        """
+        fields = DRUG_SECTIONS if record.get("is_recognized") is False else drug_fields(fields)
+        key = normalize_name(drug_name)
+        now = time.time()
+        fetched_now = {f: now for f in fields}
+        with self._lock:
+            cached, fetched = self._entries.pop(key, ({"name": drug_name}, {}))
+            if record.get("is_recognized") is False or cached.get("is_recognized") is False:
+                # Recognition is a property of the whole record, not of a section.
+                cached, fetched = {}, {}
+            merged = dict(cached)
+            merged.update((k, v) for k, v in record.items() if k not in DRUG_SECTIONS)
+            merged.update((f, record[f]) for f in fields if f in record)
+            merged.setdefault("name", drug_name)
+            entry = (merged, dict(fetched, **fetched_now))
+            self._store(key, entry)
+        if self.shared is not None:
+            # Combined with what other processes stored meanwhile, section by section.
+            new = ({k: v for k, v in dict(record, name=merged["name"]).items()
+                    if k not in DRUG_SECTIONS or k in fields}, fetched_now)
+            try:
+                blob = self.shared.update(_shared_key(key), lambda old: _encode(_combine(_decode(old), new)),
+                                          self.ttl + self.stale_ttl)
+                entry = _decode(blob)
+                with self._lock:
+                    if key in self._entries:
+                        self._entries[key] = entry
+            except Exception as e:
+                logger.error("Writing %s to the shared drug cache failed: %s", drug_name, e)
+        return dict(entry[0])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "stale_hits": self.stale_hits,
+                    "partial_hits": self.partial_hits, "misses": self.misses, "shared_hits": self.shared_hits}
+
+
+def _shared_key(key: str) -> str:
+    return "drug:" + key
+
+
+def _encode(entry) -> bytes:
+    record, fetched = entry
+    return json.dumps({"record": record, "fetched": fetched}).encode()
+
+
+def _decode(blob: Optional[bytes]):
+    if blob is None:
+        return None
+    data = json.loads(blob)
+    return data["record"], data["fetched"]
+
+
+def _combine(mine, theirs):
+    """
+    One entry from two versions of a drug's entry, keeping the newer copy of each section.
+
+    If either says the drug is not recognized, the newer entry wins whole.
+    """
+    if mine is None or theirs is None:
+        return mine or theirs
+    (a, a_fetched), (b, b_fetched) = mine, theirs
+    newest = max(a_fetched.values(), default=0.0) >= max(b_fetched.values(), default=0.0)
+    if a.get("is_recognized") is False or b.get("is_recognized") is False:
+        return mine if newest else theirs
+    record = dict(b, **a) if newest else dict(a, **b)
+    fetched = {}
+    for f in set(a_fetched) | set(b_fetched):
+        source, when = (a, a_fetched[f]) if a_fetched.get(f, -1.0) >= b_fetched.get(f, -1.0) else (b, b_fetched[f])
+        if f in source:
+            record[f] = source[f]
+        fetched[f] = when
+    return record, fetched
+
+
+class CachedDrugLookup:
+    """
+    Puts a DrugInfoCache in front of a GeminiAPI-like backend (usually the LLMRouter).
+
+    query_drug_fields asks the backend only for the sections that are not
+    cached yet and merges them in; query_drug caches complete records.
+    Stale sections are served at once and refreshed in the background
+    (stale-while-revalidate), so a cached drug never waits on the backend.
+    Everything else (query, stats, is_ready, ...) is
+    passed through to the backend; last_backend() is "cache" after a hit.
+    """
+
+    def __init__(self, backend, cache: DrugInfoCache, refresh_workers: int = DRUG_CACHE_REFRESH_WORKERS):
+        self.backend = backend
+        self.cache = cache
+        self._local = threading.local()
+        # Refreshes run outside the request, without its deadline.
+        self._refresher = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix="drug-cache-refresh")
+        self._refreshing = set()
+        self._refreshing_lock = threading.Lock()
+        self.refreshes = 0
+        self.refresh_failures = 0
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def _served_by_backend(self):
+        last_backend = getattr(self.backend, "last_backend", None)
+        self._local.backend = last_backend() if last_backend else None
+
+    def _fetch(self, drug_name: str, fields: Tuple[str, ...]) -> Tuple[Optional[Dict[str, Any]], Tuple[str, ...]]:
+        """Backend record for `fields`, and the sections it covers (all of them without field queries)."""
+        query_drug_fields = getattr(self.backend, "query_drug_fields", None)
+        if query_drug_fields and fields != DRUG_SECTIONS:
+            return query_drug_fields(drug_name, fields), fields
+        return self.backend.query_drug(drug_name), DRUG_SECTIONS
+
+    def _cached(self, drug_name: str, fields: Tuple[str, ...]) -> Optional[Dict[str, Any]]:
+        record, stale = self.cache.lookup(drug_name, fields)
+        if record is None:
+            return None
+        if stale:
+            self._revalidate(drug_name, stale)
+        self._local.backend = "cache"
+        return record
+
+    def _revalidate(self, drug_name: str, fields: Tuple[str, ...]):
+        key = (normalize_name(drug_name), fields)
+        with self._refreshing_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        self._refresher.submit(self._refresh, key, drug_name, fields)
+
+    def _refresh(self, key, drug_name: str, fields: Tuple[str, ...]):
+        try:
+            record, covered = self._fetch(drug_name, fields)
+            if record is not None:
+                self.cache.merge(drug_name, record, covered)
+                self.refreshes += 1
+            else:
+                self.refresh_failures += 1
+        except Exception as e:
+            self.refresh_failures += 1
+            logger.error("Refreshing cached drug info for %s failed: %s", drug_name, e)
+        finally:
+            with self._refreshing_lock:
+                self._refreshing.discard(key)
+
+    def query_drug(self, drug_name: str) -> Optional[Dict[str, Any]]:
+        cached = self._cached(drug_name, DRUG_SECTIONS)
+        if cached is not None:
+            return cached
+        record = self.backend.query_drug(drug_name)
+        self._served_by_backend()
+        if record is None:
+            return record
+        return self.cache.merge(drug_name, record)
+
+    def query_drug_fields(self, drug_name: str, fields: Iterable[str]) -> Optional[Dict[str, Any]]:
+        fields = drug_fields(fields)
+        cached = self._cached(drug_name, fields)
+        if cached is not None:
+            return cached
+        record, covered = self._fetch(drug_name, self.cache.missing(drug_name, fields))
+        self._served_by_backend()
+        if record is None:
+            return None
+        return self.cache.merge(drug_name, record, covered)
+
+    def query(self, prompt: str) -> Optional[str]:
+        text = self.backend.query(prompt)
+        self._served_by_backend()
+        return text
+
+    def last_backend(self) -> Optional[str]:
+        """Backend that answered the last call on this thread ("cache" for a cache hit), or None."""
+        return getattr(self._local, "backend", None)
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.cache.stats(), refreshes=self.refreshes, refresh_failures=self.refresh_failures,
+                    refreshing=len(self._refreshing))
@@ -215,63 +215,129 @@ _drug_db = {
     }
 }
 
+# Brand and regional names mapped to the generic name used in _drug_db
+DRUG_ALIASES = {
+    "acetaminophen": "paracetamol", "tylenol": "paracetamol", "panadol": "paracetamol", "calpol": "paracetamol",
+    "advil": "ibuprofen", "motrin": "ibuprofen", "nurofen": "ibuprofen",
+    "amoxil": "amoxicillin", "zithromax": "azithromycin", "cipro": "ciprofloxacin",
+    "glucophage": "metformin", "glyburide": "glibenclamide",
+    "cozaar": "losartan", "norvasc": "amlodipine", "zestril": "lisinopril",
+    "lipitor": "atorvastatin", "zocor": "simvastatin",
+    "prilosec": "omeprazole", "protonix": "pantoprazole", "zantac": "ranitidine",
+    "lasix": "furosemide", "aldactone": "spironolactone",
+    "albuterol": "salbutamol", "ventolin": "salbutamol",
+    "synthroid": "levothyroxine", "coumadin": "warfarin", "eliquis": "apixaban", "plavix": "clopidogrel",
+    "lopressor": "metoprolol", "zoloft": "sertraline", "prozac": "fluoxetine", "valium": "diazepam",
+    "ultram": "tramadol", "zyrtec": "cetirizine",
+}
 
 
 def normalize_name(name: str) -> str:
     return re.sub(r'[^a-z0-9]', '', name.lower())
 
+def canonical_drug(name: str) -> Optional[str]:
+    """Generic _drug_db name for a drug or one of its brand names, or None if it is not known."""
+    key = normalize_name(name)
+    key = DRUG_ALIASES.get(key, key)
+    return key if key in _drug_db else None
+
+def local_drug_info(drug: str) -> Optional[Dict]:
+    """
+    Return a local _drug_db record in the same shape as GeminiAPI.query_drug, or None.
+    """
+    info = _drug_db.get(normalize_name(drug))
+    if not info:
+        return None
+    return {
+        "name": drug,
+        "dosage": info["dosage"].get("adult", next(iter(info["dosage"].values()))),
+        "frequency": "",
+        "interactions": list(info["interactions"]),
+        "alternatives": list(info["alternatives"]),
+        "is_recognized": True
+    }
+
+def interactions_for(drug: str, res: Optional[Dict], drugs: List[str]) -> List[str]:
+    """
+    Interactions of one drug with the other provided drugs, given its query_drug result.
+
+    Args:
+        drug: The drug to report on.
+        res: Its query_drug result (Gemini or local_drug_info), or None if the lookup failed.
+        drugs: All drugs in the check, including `drug`.
+    """
+    d = normalize_name(drug)
+    found = []
+    if res and isinstance(res, dict):
+        if res.get("is_recognized") is False:
+            return [f"'{drug}' is not a recognized medication"]
+        if res.get("interactions"):
+            for other_drug in drugs:
+                other = normalize_name(other_drug)
+                if other == d:
+                    continue
+                for inter in res["interactions"]:
+                    if inter and normalize_name(inter) in other:
+                        found.append(other_drug)
+            if not found and res["interactions"]:
+                found = [f"May interact with: {', '.join(res['interactions'][:5])}"]
+                if len(res['interactions']) > 5:
+                    found[0] += " and others"
+    else:
+        found = ["Unable to fetch interaction data from Gemini API"]
+    return found or ["No known interactions with the provided drugs"]
+
+def _query_fields(gemini, drug: str, fields: List[str]) -> Optional[Dict]:
+    """Ask for just `fields` when the backend supports field queries, else for the full record."""
+    query_drug_fields = getattr(gemini, "query_drug_fields", None)
+    if query_drug_fields:
+        return query_drug_fields(drug, fields)
+    return gemini.query_drug(drug)
+
+def drug_record(drug: str, fields: List[str], gemini=None) -> Optional[Dict]:
+    """
+    The local_drug_info record for a _drug_db drug, else the backend's answer for `fields`.
+
+    Every endpoint, streaming or not, answers local drugs from _drug_db
+    without asking the LLM, so they all give the same alternatives and
+    interactions for them. None when the drug is not local and there is no backend.
+    """
+    local = local_drug_info(drug)
+    if local or not gemini:
+        return local
+    return _query_fields(gemini, drug, fields)
+
 def check_interactions(drugs: List[str], gemini=None) -> Dict[str, List[str]]:
     """
     Return a dict mapping each drug to a list of potential interactions with the other provided drugs.
-    Uses Gemini API directly for fetching interactions.
+    Local drugs are answered from _drug_db, the others from Gemini (see drug_record).
     """
-    normalized = [normalize_name(d) for d in drugs]
     original_drugs = {normalize_name(d): d for d in drugs}  # Keep original drug names for better output
     interactions = {}
-    unrecognized_drugs = []
 
-    for d in normalized:
-        interactions[d] = []
-        if gemini:
-            res = gemini.query_drug(original_drugs.get(d, d))
-            if res and isinstance(res, dict):
-                if res.get("is_recognized") is False:
-                    unrecognized_drugs.append(original_drugs.get(d, d))
-                    interactions[d] = [f"'{original_drugs.get(d, d)}' is not a recognized medication"]
-                    continue
-                if res.get("interactions"):
-                    for other in normalized:
-                        if other == d:
-                            continue
-                        for inter in res["interactions"]:
-                            if inter and normalize_name(inter) in other:
-                                interactions[d].append(original_drugs.get(other, other))
-                    if not interactions[d] and res["interactions"]:
-                        interactions[d] = [f"May interact with: {', '.join(res['interactions'][:5])}"]
-                        if len(res['interactions']) > 5:
-                            interactions[d][0] += " and others"
-            else:
-                interactions[d] = ["Unable to fetch interaction data from Gemini API"]
+    for d, drug in original_drugs.items():
+        res = drug_record(drug, ["interactions"], gemini)
+        if res or gemini:
+            interactions[d] = interactions_for(drug, res, list(original_drugs.values()))
         else:
             interactions[d] = ["Gemini API not available for interaction check"]
 
-    # Add note for unrecognized drugs or no interactions
-    for d in normalized:
-        if not interactions[d]:
-            interactions[d] = ["No known interactions with the provided drugs"]
-
     return interactions
 
+def dosage_for_age(dosages: Dict[str, str], age: Optional[int]) -> str:
+    """The child or adult entry of a _drug_db dosage dict for a patient of this age."""
+    if age and age < 18 and "child" in dosages:
+        return dosages["child"]
+    return dosages.get("adult", next(iter(dosages.values())))
+
 def get_dosage(drug: str, age: Optional[int]=30, gemini=None) -> str:
     d = normalize_name(drug)
     info = _drug_db.get(d)
     if info:
-        if age and age < 18 and "child" in info["dosage"]:
-            return info["dosage"]["child"]
-        return info["dosage"].get("adult", next(iter(info["dosage"].values())))
+        return dosage_for_age(info["dosage"], age)
     else:
         if gemini:
-            res = gemini.query_drug(d)
+            res = _query_fields(gemini, d, ["dosage"])
             if res:
                 if isinstance(res, dict) and res.get("is_recognized") is False:
                     return f"'{drug}' is not a recognized medication. Please consult a healthcare professional."
@@ -288,19 +354,20 @@ def get_dosage(drug: str, age: Optional[int]=30, gemini=None) -> str:
 
 def suggest_alternatives(drug: str, age: Optional[int]=30, gemini=None) -> List[str]:
     """
-    Always respond directly from Gemini API for alternatives.
+    Alternatives from _drug_db for local drugs, else from Gemini (see drug_record).
     """
+    res = drug_record(drug, ["alternatives"], gemini)
+    if res and isinstance(res, dict):
+        if res.get("is_recognized") is False:
+            return [f"'{drug}' is not a recognized medication. Please consult a healthcare professional."]
+        return res.get("alternatives", ["No specific alternatives found. Please consult a healthcare professional."])
     if gemini:
-        res = gemini.query_drug(drug)
-        if res and isinstance(res, dict):
-            if res.get("is_recognized") is False:
-                return [f"'{drug}' is not a recognized medication. Please consult a healthcare professional."]
-            return res.get("alternatives", ["No specific alternatives found. Please consult a healthcare professional."])
         return ["Unable to fetch alternatives from Gemini API. Please consult a healthcare professional."]
     return ["Gemini API not available. Please consult a healthcare professional for alternatives."]
 def get_alternatives_and_interactions_via_gemini(drug: str, gemini=None) -> Dict[str, List[str]]:
     """
-    Fetch alternatives and interactions for a specific drug using Gemini API directly.
+    Fetch alternatives and interactions for a specific drug: from _drug_db for
+    local drugs, else using Gemini API directly.
 
     Args:
         drug: Name of the drug to query.
@@ -310,13 +377,13 @@ def get_alternatives_and_interactions_via_gemini(drug: str, gemini=None) -> Dict
         Dict with 'alternatives' and 'interactions' lists.
         If Gemini is not available or drug not recognized, returns empty lists with message.
     """
-    if not gemini:
+    res = drug_record(drug, ["alternatives", "interactions"], gemini)
+    if res is None and not gemini:
         return {
             "alternatives": ["Gemini API not available. Please consult a healthcare professional."],
             "interactions": ["Gemini API not available. Please consult a healthcare professional."]
         }
 
-    res = gemini.query_drug(drug)
     if res and isinstance(res, dict):
         if res.get("is_recognized") is False:
             message = f"'{drug}' is not a recognized medication. Please consult a healthcare professional."
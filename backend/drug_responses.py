@@ -0,0 +1,60 @@
+"""
+Response bodies for the local drug database, rendered once at startup.
+
+Every _drug_db record is encoded as the body of GET /drugs/{name}, and its
+dosage as the body /get_dosage returns for adults and for children. Serving
+a local drug then skips validating and encoding the response altogether.
+The ETags include the DB version (a hash of the whole database), so they
+change whenever any record does.
+"""
+import hashlib
+import os
+from typing import Dict, Optional, Tuple
+
+from . import logs
+from .drug_logic import _drug_db, dosage_for_age, normalize_name
+from .responses import Rendered, json_bytes, render
+
+# How long clients and proxies may reuse a local drug response without asking again
+DRUG_RESPONSE_MAX_AGE = int(os.environ.get("DRUG_RESPONSE_MAX_AGE", "3600"))
+
+# Ages that select the adult and the child dosage
+_ADULT, _CHILD = 30, 10
+
+
+def db_version(db: Dict) -> str:
+    return hashlib.blake2b(json_bytes({k: db[k] for k in sorted(db)}), digest_size=6).hexdigest()
+
+
+class LocalDrugResponses:
+    """Pre-rendered record and dosage bodies for every drug in `db`."""
+
+    def __init__(self, db: Dict = _drug_db, max_age: int = DRUG_RESPONSE_MAX_AGE):
+        self.version = db_version(db)
+        self.cache_control = f"public, max-age={max_age}"
+        self._records: Dict[str, Rendered] = {}
+        self._dosages: Dict[Tuple[str, str], Rendered] = {}
+        for name, info in db.items():
+            self._records[name] = render(dict(info, name=name, source="local", version=self.version), self.version)
+            for age in (_ADULT, _CHILD):
+                self._dosages[name, dosage_for_age(info["dosage"], age)] = render(
+                    {"dosage": dosage_for_age(info["dosage"], age)}, self.version)
+        self._db = db
+
+    def record(self, drug_name: str) -> Optional[Rendered]:
+        """GET /drugs/{name} body for a local drug, or None."""
+        rendered = self._records.get(normalize_name(drug_name))
+        logs.cache("local_drugs", "miss" if rendered is None else "hit")
+        return rendered
+
+    def dosage(self, drug_name: str, age: Optional[int]) -> Optional[Rendered]:
+        """/get_dosage body for a local drug at this age, or None."""
+        name = normalize_name(drug_name)
+        info = self._db.get(name)
+        logs.cache("local_drugs", "miss" if info is None else "hit")
+        if info is None:
+            return None
+        return self._dosages[name, dosage_for_age(info["dosage"], age)]
+
+    def __len__(self) -> int:
+        return len(self._records)
@@ -1,10 +1,20 @@
 import os
+import threading
 import requests
 import logging
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterable, Tuple
+
+from . import deadline
+from .metrics import upstream_call, count_tokens
+from .prompts import drug_fields, drug_fields_prompt, drug_fields_budget
+from .section_parser import SectionParser, parse_sections, DRUG_SECTIONS
+from .timing import span
 
 logger = logging.getLogger(__name__)
 
+# Seconds to wait for Gemini; a request deadline (see deadline.py) can shorten it.
+GEMINI_TIMEOUT = float(os.environ.get("GEMINI_TIMEOUT", "10"))
+
 class GeminiAPI:
     """
     Enhanced Gemini API wrapper for pharmaceutical information queries.
@@ -27,9 +37,17 @@ class GeminiAPI:
         self.model = model or os.environ.get("GEMINI_MODEL") or "gemini-2.0-flash"
         self.base_url = endpoint or os.environ.get("GEMINI_ENDPOINT") or f"https://generativelanguage.googleapis.com/v1beta/models/{self.model}:generateContent"
 
+        # Token counts reported in usageMetadata, summed over all requests
+        self.usage = {"requests": 0, "prompt_tokens": 0, "output_tokens": 0}
+        self._usage_lock = threading.Lock()
+
         if not self.api_key or not self.base_url:
             logger.warning("Gemini API key or endpoint not set. MediBot functionality may be limited. Please set GEMINI_API_KEY and GEMINI_ENDPOINT or GEMINI_MODEL in your environment.")
 
+    def is_ready(self) -> bool:
+        """True if credentials and an endpoint are configured."""
+        return bool(self.api_key and self.base_url)
+
     def _build_prompt(self, drug_name: str) -> str:
         """
         Build the prompt for drug information queries.
@@ -53,12 +71,40 @@ class GeminiAPI:
             f"\nFormat as plain text with clear section headers."
         )
 
-    def _make_api_request(self, prompt: str) -> Optional[Dict[str, Any]]:
+    def _generation_config(self, max_output_tokens: int) -> Dict[str, Any]:
+        """
+        generationConfig capping the answer at `max_output_tokens`.
+
+        2.5 Flash models think by default and count thinking against the
+        limit, so thinking is switched off for them.
+        """
+        config: Dict[str, Any] = {"maxOutputTokens": max_output_tokens}
+        if "2.5" in self.base_url and "flash" in self.base_url:
+            config["thinkingConfig"] = {"thinkingBudget": 0}
+        return config
+
+    def _record_usage(self, response_json: Dict[str, Any]):
+        metadata = response_json.get("usageMetadata", {})
+        prompt_tokens = metadata.get("promptTokenCount", 0)
+        output_tokens = metadata.get("candidatesTokenCount", 0)
+        with self._usage_lock:
+            self.usage["requests"] += 1
+            self.usage["prompt_tokens"] += prompt_tokens
+            self.usage["output_tokens"] += output_tokens
+        count_tokens("gemini", prompt_tokens, output_tokens)
+
+    def usage_stats(self) -> Dict[str, int]:
+        """Copy of the token usage counters."""
+        with self._usage_lock:
+            return dict(self.usage)
+
+    def _make_api_request(self, prompt: str, generation_config: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
         """
         Make the API request to Gemini.
 
         Args:
             prompt: The prompt to send to the API.
+            generation_config: Optional generationConfig (e.g. maxOutputTokens).
 
         Returns:
             Parsed JSON response from the API, or None if request fails.
@@ -77,18 +123,58 @@ class GeminiAPI:
                 }
             ]
         }
+        if generation_config:
+            data["generationConfig"] = generation_config
         params = {"key": self.api_key}
+        timeout = deadline.timeout(GEMINI_TIMEOUT)
+        if not timeout:
+            logger.warning("Skipping Gemini request: the request deadline has passed")
+            return None
 
-        try:
-            resp = requests.post(self.base_url, json=data, params=params, timeout=10)
-            if resp.status_code == 200:
-                return resp.json()
-            else:
-                logger.error(f"Gemini API error: {resp.status_code} {resp.text}")
+        with upstream_call("gemini", "generate") as call:
+            try:
+                resp = requests.post(self.base_url, json=data, params=params, timeout=timeout)
+                if resp.status_code == 200:
+                    response_json = resp.json()
+                    self._record_usage(response_json)
+                    return response_json
+                else:
+                    call.ok = False
+                    logger.error(f"Gemini API error: {resp.status_code} {resp.text}")
+                    return None
+            except Exception as e:
+                call.ok = False
+                logger.error(f"Error querying Gemini API: {e}")
                 return None
-        except Exception as e:
-            logger.error(f"Error querying Gemini API: {e}")
-            return None
+
+    @staticmethod
+    def _response_text(response_json: Dict[str, Any]) -> str:
+        return response_json.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "")
+
+    def _result_from(self, parser: SectionParser, drug_name: str,
+                     fields: Tuple[str, ...] = DRUG_SECTIONS) -> Dict[str, Any]:
+        """Structured drug information from a (possibly partial) parsed answer, limited to `fields`."""
+        if parser.unknown:
+            result = {
+                "name": drug_name,
+                "dosage": "Unknown - not a recognized medication",
+                "frequency": "Unknown - consult a healthcare professional",
+                "interactions": [],
+                "alternatives": [],
+                "is_recognized": False
+            }
+        else:
+            result = {
+                "name": drug_name,
+                "dosage": "",
+                "frequency": "",
+                "interactions": [],
+                "alternatives": [],
+                "is_recognized": True
+            }
+            result.update(parser.values)
+        return {key: value for key, value in result.items()
+                if key in fields or key in ("name", "is_recognized")}
 
     def _parse_response(self, response_json: Dict[str, Any], drug_name: str) -> Optional[Dict[str, Any]]:
         """
@@ -102,81 +188,11 @@ class GeminiAPI:
             Structured drug information dictionary, or None if parsing fails.
         """
         try:
-            text = response_json.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "")
+            text = self._response_text(response_json)
             if not text:
                 return None
-
-            # Check if the medication is unknown
-            if text.strip().startswith("UNKNOWN_MEDICATION"):
-                return {
-                    "name": drug_name,
-                    "dosage": "Unknown - not a recognized medication",
-                    "frequency": "Unknown - consult a healthcare professional",
-                    "interactions": [],
-                    "alternatives": [],
-                    "is_recognized": False
-                }
-
-            # Parse the text into structured dict for recognized medications
-            result = {
-                "name": drug_name,
-                "dosage": "",
-                "frequency": "",
-                "interactions": [],
-                "alternatives": [],
-                "is_recognized": True
-            }
-
-            lines = text.split('\n')
-            current_section = None
-            section_content = ""
-
-            for line in lines:
-                line = line.strip()
-                if not line:
-                    continue
-
-                # Check for section headers
-                if line.lower().startswith("name:"):
-                    current_section = "name"
-                    section_content = line.split(":", 1)[1].strip()
-                    if section_content:
-                        result["name"] = section_content
-                elif line.lower().startswith("dosage:"):
-                    current_section = "dosage"
-                    section_content = line.split(":", 1)[1].strip()
-                    if section_content:
-                        result["dosage"] = section_content
-                elif line.lower().startswith("frequency:"):
-                    current_section = "frequency"
-                    section_content = line.split(":", 1)[1].strip()
-                    if section_content:
-                        result["frequency"] = section_content
-                elif line.lower().startswith("interactions:"):
-                    current_section = "interactions"
-                    section_content = line.split(":", 1)[1].strip()
-                    if section_content:
-                        result["interactions"] = [i.strip() for i in section_content.split(',') if i.strip()]
-                elif line.lower().startswith("alternatives:"):
-                    current_section = "alternatives"
-                    section_content = line.split(":", 1)[1].strip()
-                    if section_content:
-                        result["alternatives"] = [a.strip() for a in section_content.split(',') if a.strip()]
-                # Handle continuation lines for the current section
-                elif current_section:
-                    if current_section == "interactions":
-                        additional_items = [i.strip() for i in line.split(',') if i.strip()]
-                        result["interactions"].extend(additional_items)
-                    elif current_section == "alternatives":
-                        additional_items = [a.strip() for a in line.split(',') if a.strip()]
-                        result["alternatives"].extend(additional_items)
-                    elif current_section in ["dosage", "frequency"]:
-                        if result[current_section]:
-                            result[current_section] += " " + line
-                        else:
-                            result[current_section] = line
-
-            return result
+            with span("parse"):
+                return self._result_from(parse_sections(text, unknown_on_first_line=True), drug_name)
 
         except Exception as e:
             logger.error(f"Error parsing Gemini response: {e}")
@@ -205,6 +221,43 @@ class GeminiAPI:
 
         return None
 
+    def query_drug_fields(self, drug_name: str, fields: Iterable[str],
+                          max_output_tokens: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """
+        Query only some sections of the drug information.
+
+        The prompt asks for just those sections and maxOutputTokens is capped
+        at drug_fields_budget(fields), so e.g. a dosage lookup does not pay
+        for interactions and alternatives.
+
+        Args:
+            drug_name: Name of the drug to query.
+            fields: Sections needed, e.g. ["dosage"] (see DRUG_SECTIONS).
+            max_output_tokens: Override for the output-token limit.
+
+        Returns:
+            Dict with "name", "is_recognized" and the requested sections,
+            or None if API is not available or request fails.
+        """
+        fields = drug_fields(fields)
+        if not self.api_key or not self.base_url:
+            logger.warning("Gemini API not configured. Skipping query for drug: %s", drug_name)
+            return None
+
+        config = self._generation_config(max_output_tokens or drug_fields_budget(fields))
+        response_json = self._make_api_request(drug_fields_prompt(drug_name, fields), config)
+        if not response_json:
+            return None
+        try:
+            text = self._response_text(response_json)
+            if not text:
+                return None
+            with span("parse"):
+                return self._result_from(parse_sections(text, unknown_on_first_line=True), drug_name, fields)
+        except Exception as e:
+            logger.error(f"Error parsing Gemini response: {e}")
+            return None
+
     def query(self, prompt: str) -> Optional[str]:
         """
         Make a general query to the Gemini API.
@@ -222,7 +275,7 @@ class GeminiAPI:
         response_json = self._make_api_request(prompt)
         if response_json:
             try:
-                text = response_json.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "")
+                text = self._response_text(response_json)
                 return text if text else None
             except Exception as e:
                 logger.error(f"Error extracting text from Gemini response: {e}")
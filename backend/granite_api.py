@@ -1,124 +1,396 @@
+import logging
 import os
-import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
-from typing import Optional, Dict
+import re
+import threading
+import time
+from functools import partial
+from typing import Optional, Dict, Iterator, Iterable, Tuple
+
+from . import deadline
+from .metrics import upstream_call, count_tokens
+from .prompts import MEDIBOT_SYSTEM_PROMPT, drug_fields, drug_fields_prefix, drug_fields_prompt, drug_fields_budget
+from .section_parser import SectionParser, DRUG_SECTIONS, parse_sections
+from .timing import span
+
+logger = logging.getLogger(__name__)
+
+# Model states reported by GraniteAPI.status()
+COLD, LOADING, READY, FAILED = "cold", "loading", "ready", "failed"
+
+# How generate() calls are executed: "inline" runs each prompt on the calling
+# thread, "batched" queues prompts into a GraniteBatcher, "pool" sends them to
+# worker processes sharing one copy of the weights (GranitePool).
+GRANITE_EXECUTION = os.environ.get("GRANITE_EXECUTION", "inline")
+GRANITE_BATCH_SIZE = int(os.environ.get("GRANITE_BATCH_SIZE", "8"))
+GRANITE_BATCH_TOKENS = int(os.environ.get("GRANITE_BATCH_TOKENS", "8192"))
+GRANITE_BATCH_WAIT_MS = float(os.environ.get("GRANITE_BATCH_WAIT_MS", "20"))
+GRANITE_POOL_WORKERS = int(os.environ.get("GRANITE_POOL_WORKERS", "2"))
+# Intra-op threads per worker; 0 splits the CPUs evenly between workers.
+GRANITE_POOL_THREADS = int(os.environ.get("GRANITE_POOL_THREADS", "0"))
+# Requests queued or running before new ones are rejected with PoolBusy.
+GRANITE_POOL_QUEUE = int(os.environ.get("GRANITE_POOL_QUEUE", "32"))
+GRANITE_POOL_TIMEOUT = float(os.environ.get("GRANITE_POOL_TIMEOUT", "120"))
+
+# Weight precision on CPU: "fp32" (default), "bf16", or "int8" (dynamic
+# quantization of the linear layers).
+GRANITE_PRECISION = os.environ.get("GRANITE_PRECISION", "fp32")
+PRECISIONS = ("fp32", "bf16", "int8")
+
+# Reuse the encoded key/values of fixed prompt prefixes (the drug template and
+# the MediBot system prompt) so each call only runs its own suffix. Applies to
+# inline execution; batched prompts are always encoded in full.
+GRANITE_PREFIX_CACHE = os.environ.get("GRANITE_PREFIX_CACHE", "1") == "1"
+
+# Fixed part of the drug information prompt. The drug name comes last so that
+# everything before it is identical across calls and can be cached.
+DRUG_PROMPT_PREFIX = drug_fields_prefix(DRUG_SECTIONS)
+
+# Upper bounds on new tokens per call. Generation usually ends earlier: drug
+# lookups stop once every section is written (see drug_info_complete).
+GRANITE_DRUG_MAX_TOKENS = int(os.environ.get("GRANITE_DRUG_MAX_TOKENS", "512"))
+GRANITE_CHAT_MAX_TOKENS = int(os.environ.get("GRANITE_CHAT_MAX_TOKENS", "256"))
+
+# Same header rule as SectionParser: the name and a colon at the start of a line.
+_SECTION_HEADER_RE = re.compile(r"^[ \t]*(name|dosage|frequency|interactions|alternatives):", re.IGNORECASE | re.MULTILINE)
+_UNKNOWN_LINE_RE = re.compile(r"^[ \t]*unknown_medication[^\n]*\n", re.IGNORECASE | re.MULTILINE)
+
+def drug_info_complete(text: str, sections: Tuple[str, ...] = DRUG_SECTIONS) -> bool:
+    """
+    True once a drug-information answer has nothing left that query_drug would parse.
+
+    That is when an UNKNOWN_MEDICATION line has been finished, or when all
+    requested sections are present and the last one has content followed by
+    a blank line (its continuation lines are over).
+    """
+    if _UNKNOWN_LINE_RE.search(text):
+        return True
+    headers = list(_SECTION_HEADER_RE.finditer(text))
+    if not set(sections) <= {m.group(1).lower() for m in headers}:
+        return False
+    tail = text[headers[-1].end():]
+    end = tail.find("\n\n")
+    return end != -1 and bool(tail[:end].strip())
+
+def drug_prompt(drug_name: str) -> str:
+    """The drug information prompt sent to Granite."""
+    return drug_fields_prompt(drug_name)
 
 class GraniteAPI:
     """
     Local Granite model wrapper for drug information.
     Loads the IBM Granite model locally.
+
+    Nothing heavy happens at construction: torch/transformers are imported and
+    the weights loaded either by warm_up() in a background thread or on the
+    first query. Queries that arrive before the model is ready return None
+    immediately (and start the warm-up), so callers can fall back to Gemini
+    instead of blocking for the load.
     """
-    def __init__(self, model_name: Optional[str] = None):
-        self.model_name = model_name or "ibm-granite/granite-3.3-2b-instruct"
+    def __init__(self, model_name: Optional[str] = None, warm_up: bool = False, execution: Optional[str] = None,
+                 precision: Optional[str] = None, prefix_cache: Optional[bool] = None):
+        self.model_name = model_name or os.environ.get("GRANITE_MODEL") or "ibm-granite/granite-3.3-2b-instruct"
+        self.execution = execution or GRANITE_EXECUTION
+        self.precision = precision or GRANITE_PRECISION
         self.tokenizer = None
         self.model = None
-        self._load_model()
+        self.batcher = None
+        self.pool = None
+        self.use_prefix_cache = GRANITE_PREFIX_CACHE if prefix_cache is None else prefix_cache
+        self.prefix_cache = None
+        self.state = COLD
+        self.error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+        self._lock = threading.Lock()
+        self._loaded = threading.Event()
+        if warm_up:
+            self.warm_up()
+
+    def warm_up(self) -> Optional[threading.Thread]:
+        """
+        Start loading the model in a background thread.
+
+        Returns the loader thread, or None if loading already started.
+        """
+        with self._lock:
+            if self.state != COLD:
+                return None
+            self.state = LOADING
+        thread = threading.Thread(target=self._load_model, name="granite-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def load(self, timeout: Optional[float] = None) -> bool:
+        """Load the model synchronously (or wait for a running warm-up). Returns True if ready."""
+        with self._lock:
+            start_here = self.state == COLD
+            if start_here:
+                self.state = LOADING
+        if start_here:
+            self._load_model()
+        else:
+            self._loaded.wait(timeout)
+        return self.state == READY
+
+    def is_ready(self) -> bool:
+        return self.state == READY
+
+    def status(self) -> Dict:
+        """Readiness and cold-start timing, for health checks."""
+        return {"model": self.model_name, "state": self.state, "precision": self.precision,
+                "load_seconds": self.load_seconds, "error": self.error,
+                "prefix_cache": self.prefix_cache.stats() if self.prefix_cache else None,
+                "pool": self.pool.stats() if self.pool else None}
+
+    def _ensure_ready(self) -> bool:
+        """True if the model can serve now; otherwise kicks off the warm-up and returns False."""
+        if self.state == READY:
+            return True
+        self.warm_up()
+        return False
 
     def _load_model(self):
+        started = time.perf_counter()
         try:
-            self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
-            self.model = AutoModelForCausalLM.from_pretrained(self.model_name)
-            print("✅ Granite model and tokenizer loaded successfully.")
+            if self.precision not in PRECISIONS:
+                raise ValueError(f"Unknown GRANITE_PRECISION '{self.precision}', expected one of {PRECISIONS}")
+            if self.execution == "pool":
+                self._start_pool()
+            else:
+                self._attach(*self._load_weights())
+            self.load_seconds = round(time.perf_counter() - started, 2)
+            self.state = READY
+            logger.info("Granite model and tokenizer loaded in %ss (%s)", self.load_seconds, self.precision)
         except Exception as e:
-            print(f"❌ Failed to load Granite model: {e}")
+            logger.error("Failed to load Granite model: %s", e)
             self.model = None
+            self.error = str(e)
+            self.state = FAILED
+        finally:
+            self._loaded.set()
+
+    def _load_weights(self):
+        """Load tokenizer and model in the configured precision. Returns (tokenizer, model)."""
+        # Imported here so that importing this module stays cheap.
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        if self.precision == "bf16":
+            model = AutoModelForCausalLM.from_pretrained(self.model_name, torch_dtype=torch.bfloat16)
+        else:
+            model = AutoModelForCausalLM.from_pretrained(self.model_name)
+        if self.precision == "int8":
+            # int8 weights for every nn.Linear, activations quantized on the fly.
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        model.eval()
+        return tokenizer, model
+
+    def _attach(self, tokenizer, model):
+        """Serve from an already loaded model (also used by pool workers with shared weights)."""
+        self.tokenizer = tokenizer
+        self.model = model
+        if self.execution == "batched":
+            from .granite_batching import GraniteBatcher
+            self.batcher = GraniteBatcher(self.model, self.tokenizer, max_batch_size=GRANITE_BATCH_SIZE,
+                                          max_batch_tokens=GRANITE_BATCH_TOKENS,
+                                          max_wait_ms=GRANITE_BATCH_WAIT_MS)
+        elif self.use_prefix_cache:
+            from .granite_prefix_cache import PrefixCache
+            self.prefix_cache = PrefixCache(self.model, self.tokenizer)
+            self.prefix_cache.register(DRUG_PROMPT_PREFIX)
+            self.prefix_cache.register(MEDIBOT_SYSTEM_PROMPT)
+
+    def _start_pool(self):
+        """Load the weights once and share them with the worker processes; none of the inference runs here."""
+        from .granite_pool import GranitePool
+        tokenizer, model = (None, None) if self.precision == "int8" else self._load_weights()
+        self.pool = GranitePool(self.model_name, model, tokenizer, workers=GRANITE_POOL_WORKERS,
+                                threads=GRANITE_POOL_THREADS, max_pending=GRANITE_POOL_QUEUE,
+                                precision=self.precision, prefix_cache=self.use_prefix_cache)
+        self.pool.wait_ready()
+
+    def _inputs(self, prompt: str) -> Dict:
+        """generate() inputs for a prompt, with the cached prefix key/values when it has one."""
+        if self.prefix_cache:
+            return self.prefix_cache.inputs(prompt)
+        return self.tokenizer(prompt, return_tensors="pt")
+
+    def _generate(self, prompt: str, max_new_tokens: int, stop=None) -> str:
+        """
+        Run one generation and return the decoded completion (without the prompt).
+
+        Args:
+            prompt: Full prompt text.
+            max_new_tokens: Token budget for the completion.
+            stop: Optional predicate over the completion so far; generation
+                ends at the first line break after which it returns True.
 
-    def query_drug(self, drug_name: str) -> Optional[Dict]:
+        Under a request deadline (deadline.py) generation is cut off when it
+        passes, and TimeoutError is raised if it already has.
+        """
+        left = deadline.remaining()
+        if left is not None and left < deadline.MIN_UPSTREAM_SECONDS:
+            raise TimeoutError("the request deadline has passed")
+        with upstream_call("granite", "generate"):
+            if self.pool:
+                return self.pool.generate(prompt, max_new_tokens, stop,
+                                          timeout=deadline.timeout(GRANITE_POOL_TIMEOUT))
+            if self.batcher:
+                return self.batcher.generate(prompt, max_new_tokens, timeout=left, stop=stop, temperature=0.7)
+            import torch
+            inputs = self._inputs(prompt)
+            prompt_length = inputs["input_ids"].shape[1]
+            # max_time ends generation at the request deadline, keeping what was generated.
+            kwargs = {} if left is None else {"max_time": left}
+            if stop:
+                from transformers import StoppingCriteriaList
+                from .granite_stopping import TextStop
+                kwargs["stopping_criteria"] = StoppingCriteriaList(
+                    [TextStop(self.tokenizer, prompt_length, [stop], [max_new_tokens])])
+            with torch.no_grad():
+                outputs = self.model.generate(**inputs, max_new_tokens=max_new_tokens, temperature=0.7, **kwargs)
+            count_tokens("granite", prompt_length, outputs.shape[1] - prompt_length)
+            return self.tokenizer.decode(outputs[0, prompt_length:], skip_special_tokens=True)
+
+    def query_drug(self, drug_name: str, max_new_tokens: Optional[int] = None) -> Optional[Dict]:
         """
         Query the Granite model for drug information.
         Returns a dict like: {"name":..., "dosage":..., "frequency":..., "interactions":[...], "alternatives":[...]}
-        If model not loaded, returns None.
+        If the model is not loaded yet, returns None without waiting for it.
+        Generation stops as soon as the answer is complete, or after
+        max_new_tokens (default GRANITE_DRUG_MAX_TOKENS).
         """
-        if not self.model or not self.tokenizer:
-            print("Warning: Granite model not loaded. MediBot functionality may be limited.")
+        if not self._ensure_ready():
+            logger.warning("Granite model not loaded yet. MediBot functionality may be limited.")
             return None
         try:
-            # Enhanced prompt with more specific instructions for better results
-            prompt = (
-                f"Provide detailed pharmaceutical information for the drug '{drug_name}'."
-                f"\n\nIf '{drug_name}' is not a recognized medication, please respond with 'UNKNOWN_MEDICATION' at the beginning of your response, "
-                f"followed by your best guess about what this might be, if possible."
-                f"\n\nFor recognized medications, include the following sections:\n"
-                f"Name: (standard name)\n"
-                f"Dosage: (typical dosage ranges for adults and children if applicable)\n"
-                f"Frequency: (how often it should be taken)\n"
-                f"Interactions: (list major drug interactions, separated by commas)\n"
-                f"Alternatives: (list alternative medications, separated by commas)\n"
-                f"\nFormat as plain text with clear section headers."
-            )
-
-            inputs = self.tokenizer(prompt, return_tensors="pt")
-            with torch.no_grad():
-                outputs = self.model.generate(**inputs, max_new_tokens=512, temperature=0.7)
-            response = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-
-            # Parse the response
-            result = {"name": drug_name, "is_recognized": True}
-            lines = response.split('\n')
-            current_section = None
-            for line in lines:
-                line = line.strip()
-                if not line:
-                    continue
-                if line.lower().startswith("unknown_medication"):
-                    result["is_recognized"] = False
-                    result["raw_text"] = response
-                    return result
-                if line.lower().startswith("name:"):
-                    current_section = "name"
-                    section_content = line.split(":", 1)[1].strip()
-                    if section_content:
-                        result["name"] = section_content
-                elif line.lower().startswith("dosage:"):
-                    current_section = "dosage"
-                    section_content = line.split(":", 1)[1].strip()
-                    if section_content:
-                        result["dosage"] = section_content
-                elif line.lower().startswith("frequency:"):
-                    current_section = "frequency"
-                    section_content = line.split(":", 1)[1].strip()
-                    if section_content:
-                        result["frequency"] = section_content
-                elif line.lower().startswith("interactions:"):
-                    current_section = "interactions"
-                    section_content = line.split(":", 1)[1].strip()
-                    if section_content:
-                        result["interactions"] = [i.strip() for i in section_content.split(',') if i.strip()]
-                elif line.lower().startswith("alternatives:"):
-                    current_section = "alternatives"
-                    section_content = line.split(":", 1)[1].strip()
-                    if section_content:
-                        result["alternatives"] = [a.strip() for a in section_content.split(',') if a.strip()]
-                # Handle continuation lines for the current section
-                elif current_section:
-                    if current_section == "interactions":
-                        additional_items = [i.strip() for i in line.split(',') if i.strip()]
-                        result["interactions"].extend(additional_items)
-                    elif current_section == "alternatives":
-                        additional_items = [a.strip() for a in line.split(',') if a.strip()]
-                        result["alternatives"].extend(additional_items)
-                    elif current_section in ["dosage", "frequency"]:
-                        if result[current_section]:
-                            result[current_section] += " " + line
-                        else:
-                            result[current_section] = line
-            return result
+            prompt = drug_prompt(drug_name)
+            response = self._generate(prompt, max_new_tokens or GRANITE_DRUG_MAX_TOKENS, stop=drug_info_complete)
+            with span("parse"):
+                return self._result_from(parse_sections(response), drug_name)
+        except Exception as e:
+            logger.error("Error querying Granite: %s", e)
+            return None
+
+    def query_drug_fields(self, drug_name: str, fields: Iterable[str],
+                          max_new_tokens: Optional[int] = None) -> Optional[Dict]:
+        """
+        Query only some sections of the drug information (e.g. ["dosage"]).
+
+        The prompt lists just those sections, generation stops once they are
+        complete, and the token budget defaults to drug_fields_budget(fields).
+        Returns the same shape as query_drug, with only the requested sections.
+        """
+        if not self._ensure_ready():
+            return None
+        try:
+            fields = drug_fields(fields)
+            if self.prefix_cache:
+                self.prefix_cache.register(drug_fields_prefix(fields))
+            budget = max_new_tokens or min(GRANITE_DRUG_MAX_TOKENS, drug_fields_budget(fields))
+            # partial() of a module-level function, so the pool can pickle it.
+            stop = partial(drug_info_complete, sections=fields)
+            response = self._generate(drug_fields_prompt(drug_name, fields), budget, stop=stop)
+            with span("parse"):
+                return self._result_from(parse_sections(response), drug_name, fields)
         except Exception as e:
-            print(f"Error querying Granite: {e}")
+            logger.error("Error querying Granite: %s", e)
             return None
 
-    def query(self, message: str) -> Optional[str]:
+    @staticmethod
+    def _result_from(parser: SectionParser, drug_name: str, fields: Tuple[str, ...] = DRUG_SECTIONS) -> Dict:
+        result = {"name": drug_name, "is_recognized": True}
+        result.update((f, v) for f, v in parser.values.items() if f in fields)
+        if parser.unknown:
+            result["is_recognized"] = False
+            result["raw_text"] = parser.text
+        return result
+
+    def query(self, message: str, system_prompt: Optional[str] = None,
+              max_new_tokens: Optional[int] = None) -> Optional[str]:
         """
         General query method for chat-like responses.
+        Returns only the generated reply, up to max_new_tokens (default GRANITE_CHAT_MAX_TOKENS).
+
+        A fixed system_prompt is put in front of the message and, like
+        MEDIBOT_SYSTEM_PROMPT, only encoded once.
         """
-        if not self.model or not self.tokenizer:
+        if not self._ensure_ready():
             return None
         try:
-            inputs = self.tokenizer(message, return_tensors="pt")
-            with torch.no_grad():
-                outputs = self.model.generate(**inputs, max_new_tokens=256, temperature=0.7)
-            response = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-            return response
+            if system_prompt:
+                if self.prefix_cache:
+                    self.prefix_cache.register(system_prompt)
+                message = system_prompt + message
+            return self._generate(message, max_new_tokens or GRANITE_CHAT_MAX_TOKENS)
         except Exception as e:
-            print(f"Error in Granite query: {e}")
+            logger.error("Error in Granite query: %s", e)
             return None
+
+    def stream_query(self, message: str, system_prompt: Optional[str] = None,
+                     max_new_tokens: Optional[int] = None,
+                     cancel: Optional[threading.Event] = None) -> Iterator[str]:
+        """
+        Streaming form of query(): yields pieces of the reply as they are decoded.
+
+        Generation stops after the next token once `cancel` is set or this
+        generator is closed, so an abandoned stream does not keep the CPU busy.
+        In pool mode the reply is produced by a worker process and yielded in
+        one piece. Yields nothing if the model is not loaded yet.
+        """
+        if not self._ensure_ready():
+            return
+        if system_prompt:
+            if self.prefix_cache:
+                self.prefix_cache.register(system_prompt)
+            message = system_prompt + message
+        max_new_tokens = max_new_tokens or GRANITE_CHAT_MAX_TOKENS
+        if self.pool:
+            try:
+                yield self._generate(message, max_new_tokens)
+            except Exception as e:
+                logger.error("Error in Granite query: %s", e)
+            return
+        yield from self._stream(message, max_new_tokens, cancel)
+
+    def _stream(self, prompt: str, max_new_tokens: int, cancel: Optional[threading.Event] = None,
+                stop=None) -> Iterator[str]:
+        """
+        Generate in a background thread feeding a TextIteratorStreamer and yield the decoded text.
+
+        Closing the generator (or setting `cancel`) stops generation after the
+        next token. `stop` works as in _generate().
+        """
+        from transformers import StoppingCriteriaList, TextIteratorStreamer
+        from .granite_stopping import CancelStop, TextStop
+        cancel = cancel or threading.Event()
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        inputs = self._inputs(prompt)
+        criteria = [CancelStop(cancel)]
+        if stop:
+            criteria.append(TextStop(self.tokenizer, inputs["input_ids"].shape[1], [stop], [max_new_tokens]))
+        kwargs = dict(inputs, max_new_tokens=max_new_tokens, temperature=0.7, streamer=streamer,
+                      stopping_criteria=StoppingCriteriaList(criteria))
+
+        prompt_length = inputs["input_ids"].shape[1]
+
+        def run():
+            import torch
+            try:
+                with torch.no_grad():
+                    outputs = self.model.generate(**kwargs)
+                count_tokens("granite", prompt_length, outputs.shape[1] - prompt_length)
+            except Exception as e:
+                call.ok = False
+                logger.error("Error in Granite query: %s", e)
+            finally:
+                # Unblocks the reader even if generate() failed before finishing the stream.
+                streamer.end()
+
+        with upstream_call("granite", "stream") as call:
+            threading.Thread(target=run, name="granite-stream", daemon=True).start()
+            try:
+                for text in streamer:
+                    if text:
+                        yield text
+            finally:
+                cancel.set()
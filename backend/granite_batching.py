@@ -0,0 +1,174 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Optional, Dict, List, Callable
+
+from .metrics import count_tokens
+
+
+class _Request:
+    __slots__ = ("prompt", "input_ids", "max_new_tokens", "stop", "kwargs_key", "kwargs", "future")
+
+    def __init__(self, prompt: str, max_new_tokens: int, stop: Optional[Callable[[str], bool]], kwargs: Dict):
+        self.prompt = prompt
+        self.input_ids: List[int] = []
+        self.max_new_tokens = max_new_tokens
+        self.stop = stop
+        self.kwargs = kwargs
+        self.kwargs_key = tuple(sorted(kwargs.items()))
+        self.future: Future = Future()
+
+
+class GraniteBatcher:
+    """
+    Dynamic micro-batching scheduler in front of a causal LM.
+
+    Callers submit prompts from any thread. A single scheduler thread collects
+    them for up to `max_wait_ms` (or until `max_batch_size` prompts or
+    `max_batch_tokens` padded tokens are queued), left-pads them into one
+    batch, runs a single `generate` call and resolves each caller's future
+    with its own decoded completion. On CPU this turns N concurrent
+    single-prompt generations into one batched one, which is where aggregate
+    tokens/sec comes from. Each row stops on its own budget or `stop`
+    predicate, and the batch ends once every row has.
+
+    The tokenizer is only used on the scheduler thread: Hugging Face fast
+    tokenizers fail ("Already borrowed") when called from several threads.
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size: int = 8, max_batch_tokens: int = 8192,
+                 max_wait_ms: float = 20.0):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_wait = max_wait_ms / 1000.0
+        self.pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+        self._queue: "queue.Queue[_Request]" = queue.Queue()
+        self._carry: Optional[_Request] = None
+        self._stats_lock = threading.Lock()
+        self._stats = {"batches": 0, "requests": 0, "generated_tokens": 0, "busy_seconds": 0.0}
+        self._thread = threading.Thread(target=self._run, name="granite-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, prompt: str, max_new_tokens: int, stop: Optional[Callable[[str], bool]] = None,
+               **generate_kwargs) -> Future:
+        """
+        Queue a prompt for generation.
+
+        Args:
+            stop: Optional predicate over the generated text; the row stops at
+                the first line break after which it returns True.
+
+        Returns:
+            Future resolving to the decoded generation (without the prompt).
+        """
+        request = _Request(prompt, max_new_tokens, stop, generate_kwargs)
+        self._queue.put(request)
+        return request.future
+
+    def generate(self, prompt: str, max_new_tokens: int, timeout: Optional[float] = None,
+                 stop: Optional[Callable[[str], bool]] = None, **generate_kwargs) -> str:
+        """Blocking form of submit()."""
+        return self.submit(prompt, max_new_tokens, stop, **generate_kwargs).result(timeout)
+
+    def stats(self) -> Dict:
+        """Counters since start, including aggregate generated tokens per busy second."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["tokens_per_sec"] = round(stats["generated_tokens"] / stats["busy_seconds"], 2) if stats["busy_seconds"] else 0.0
+        return stats
+
+    def _padded_cost(self, batch: List[_Request], extra: Optional[_Request] = None) -> int:
+        rows = batch + ([extra] if extra else [])
+        width = max(len(r.input_ids) for r in rows) + max(r.max_new_tokens for r in rows)
+        return width * len(rows)
+
+    def _next(self, timeout: Optional[float] = None) -> _Request:
+        """Take the next queued request and tokenize it; raises queue.Empty after `timeout`."""
+        while True:
+            request = self._queue.get(timeout=timeout)
+            try:
+                request.input_ids = self.tokenizer(request.prompt)["input_ids"]
+                return request
+            except Exception as e:
+                request.future.set_exception(e)
+
+    def _collect(self) -> List[_Request]:
+        first = self._carry or self._next()
+        self._carry = None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._next(remaining)
+            except queue.Empty:
+                break
+            # Requests with other sampling settings, or that would blow the
+            # token budget, start the next batch instead.
+            if request.kwargs_key != first.kwargs_key or self._padded_cost(batch, request) > self.max_batch_tokens:
+                self._carry = request
+                break
+            batch.append(request)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._run_batch(batch)
+            except Exception as e:
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+
+    def _run_batch(self, batch: List[_Request]):
+        import torch
+        from transformers import StoppingCriteriaList
+        from .granite_stopping import TextStop
+
+        started = time.perf_counter()
+        width = max(len(r.input_ids) for r in batch)
+        max_new_tokens = max(r.max_new_tokens for r in batch)
+        input_ids = torch.full((len(batch), width), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(batch), width), dtype=torch.long)
+        for i, r in enumerate(batch):
+            # Left padding, so every row's generation starts at the same position.
+            input_ids[i, width - len(r.input_ids):] = torch.tensor(r.input_ids, dtype=torch.long)
+            attention_mask[i, width - len(r.input_ids):] = 1
+
+        stopping = TextStop(self.tokenizer, width, [r.stop for r in batch], [r.max_new_tokens for r in batch])
+
+        with torch.no_grad():
+            outputs = self.model.generate(input_ids=input_ids, attention_mask=attention_mask,
+                                          max_new_tokens=max_new_tokens, pad_token_id=self.pad_token_id,
+                                          stopping_criteria=StoppingCriteriaList([stopping]), **batch[0].kwargs)
+
+        generated = 0
+        for i, r in enumerate(batch):
+            new_tokens = outputs[i, width:width + r.max_new_tokens]
+            generated += self._count_generated(new_tokens)
+            r.future.set_result(self.tokenizer.decode(new_tokens, skip_special_tokens=True))
+
+        count_tokens("granite", sum(len(r.input_ids) for r in batch), generated)
+        with self._stats_lock:
+            self._stats["batches"] += 1
+            self._stats["requests"] += len(batch)
+            self._stats["generated_tokens"] += generated
+            self._stats["busy_seconds"] += time.perf_counter() - started
+
+    def _count_generated(self, new_tokens) -> int:
+        """Generated tokens up to and including EOS, ignoring the padding after it or after an early stop."""
+        eos = self.tokenizer.eos_token_id
+        count = 0
+        for token in new_tokens.tolist():
+            if token == self.pad_token_id and token != eos:
+                break
+            count += 1
+            if token == eos:
+                break
+        return count
@@ -0,0 +1,259 @@
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future
+from multiprocessing.connection import wait
+from typing import Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class PoolBusy(RuntimeError):
+    """Raised when the worker pool already has its maximum number of requests pending."""
+
+
+def _worker_main(model_name: str, precision: str, prefix_cache: bool, threads: int,
+                 model, tokenizer, conn):
+    """
+    Worker process loop.
+
+    Receives (request_id, prompt, max_new_tokens, stop) tuples on `conn` and
+    answers with (request_id, ok, text_or_error). It first sends (None, ready,
+    pid_or_error), and exits if the model did not load. A None request shuts
+    the worker down.
+    """
+    import torch
+    from .granite_api import GraniteAPI, READY
+
+    torch.set_num_threads(threads)
+    api = GraniteAPI(model_name, execution="inline", precision=precision, prefix_cache=prefix_cache)
+    if model is None:
+        # Weights that cannot be shared (int8) are loaded by each worker.
+        api.load()
+    else:
+        api._attach(tokenizer, model)
+        api.state = READY
+    conn.send((None, api.is_ready(), os.getpid() if api.is_ready() else api.error))
+    if not api.is_ready():
+        return
+
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        request_id, prompt, max_new_tokens, stop = request
+        try:
+            conn.send((request_id, True, api._generate(prompt, max_new_tokens, stop)))
+        except Exception as e:
+            conn.send((request_id, False, f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    """One worker process, its end of the pipe and the requests it holds."""
+
+    def __init__(self, index: int, process, conn):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.ready = False
+        self.pending: Set[int] = set()
+        self.send_lock = threading.Lock()
+
+
+class GranitePool:
+    """
+    Granite inference in dedicated worker processes.
+
+    The model is loaded once in the parent, moved to shared memory and handed
+    to spawned workers, so every worker maps the same read-only weights
+    instead of holding its own copy. Generation then never runs in the API process. Each worker uses
+    `threads` intra-op threads.
+
+    Each worker has its own pipe. submit() sends a request to the worker
+    with the fewest in flight, and a dispatcher thread matches replies to
+    futures by id. At most `max_pending` requests may be in flight; beyond
+    that submit() raises PoolBusy straight away, so callers can fall back
+    instead of piling up behind the workers.
+
+    The dispatcher also watches the worker processes. When one dies (killed
+    for memory, a crash in native code), the requests it held fail with
+    RuntimeError, their slots are freed and a new worker is started with
+    the same shared weights, which the pool keeps a reference to for that.
+    """
+
+    def __init__(self, model_name: str, model=None, tokenizer=None, workers: int = 2,
+                 threads: Optional[int] = None, max_pending: int = 32, precision: str = "fp32",
+                 prefix_cache: bool = True):
+        self.model_name = model_name
+        self.workers = workers
+        self.threads = threads or max(1, (os.cpu_count() or 1) // workers)
+        self.max_pending = max_pending
+        self._ctx = multiprocessing.get_context("spawn")
+        self._args = (model_name, precision, prefix_cache, self.threads, model, tokenizer)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._futures: Dict[int, Future] = {}
+        self._futures_lock = threading.Lock()
+        self._ids = itertools.count()
+        self._stats_lock = threading.Lock()
+        self._stats = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0, "restarted": 0}
+        self._closing = False
+        if model is not None:
+            model.share_memory()
+        self._workers: List[_Worker] = [self._spawn(i) for i in range(workers)]
+        self._dispatcher = None
+
+    def _spawn(self, index: int) -> _Worker:
+        conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(target=_worker_main, name=f"granite-worker-{index}", daemon=True,
+                                    args=self._args + (child_conn,))
+        process.start()
+        child_conn.close()
+        return _Worker(index, process, conn)
+
+    def wait_ready(self, timeout: Optional[float] = None):
+        """Block until every worker has its model; raises RuntimeError if one failed to load."""
+        for worker in self._workers:
+            ok, detail = False, "timed out"
+            try:
+                if worker.conn.poll(timeout):
+                    _, ok, detail = worker.conn.recv()
+            except (EOFError, OSError):
+                worker.process.join(1)
+                detail = f"exited with code {worker.process.exitcode}"
+            if not ok:
+                self.close()
+                raise RuntimeError(f"Granite worker failed to load: {detail}")
+            worker.ready = True
+        self._dispatcher = threading.Thread(target=self._dispatch, name="granite-pool-dispatch", daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, prompt: str, max_new_tokens: int, stop: Optional[Callable[[str], bool]] = None) -> Future:
+        """
+        Send a prompt to a worker.
+
+        `stop` is sent to the worker, so it must be a picklable module-level
+        function (e.g. granite_api.drug_info_complete).
+
+        Raises:
+            PoolBusy: max_pending requests are already in flight.
+        """
+        if not self._slots.acquire(blocking=False):
+            self._count("rejected")
+            raise PoolBusy(f"Granite pool has {self.max_pending} requests pending")
+        request_id = next(self._ids)
+        future: Future = Future()
+        with self._futures_lock:
+            if not self._workers:
+                self._slots.release()
+                raise RuntimeError("No Granite workers are running")
+            # A worker being restarted takes requests too; they wait in its pipe until it is ready.
+            worker = min(self._workers, key=lambda w: len(w.pending))
+            self._futures[request_id] = future
+            worker.pending.add(request_id)
+        self._count("submitted")
+        try:
+            with worker.send_lock:
+                worker.conn.send((request_id, prompt, max_new_tokens, stop))
+        except (OSError, ValueError) as e:
+            # The worker died; the dispatcher restarts it.
+            self._resolve(worker, request_id, False, f"Granite worker is not running: {e}")
+        return future
+
+    def generate(self, prompt: str, max_new_tokens: int, stop: Optional[Callable[[str], bool]] = None,
+                 timeout: Optional[float] = None) -> str:
+        """Blocking form of submit()."""
+        return self.submit(prompt, max_new_tokens, stop).result(timeout)
+
+    def _count(self, key: str):
+        # Request threads and the dispatcher both count.
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def _resolve(self, worker: _Worker, request_id: int, ok: bool, payload):
+        with self._futures_lock:
+            future = self._futures.pop(request_id, None)
+            worker.pending.discard(request_id)
+        if future is None:
+            return
+        self._slots.release()
+        if ok:
+            self._count("completed")
+            future.set_result(payload)
+        else:
+            self._count("failed")
+            future.set_exception(RuntimeError(payload))
+
+    def _dispatch(self):
+        while not self._closing:
+            by_handle = {}
+            for worker in self._workers:
+                by_handle[worker.conn] = worker
+                by_handle[worker.process.sentinel] = worker
+            for handle in wait(list(by_handle), timeout=1.0):
+                worker = by_handle[handle]
+                if self._closing or worker not in self._workers:
+                    continue
+                if handle is worker.conn:
+                    try:
+                        request_id, ok, payload = worker.conn.recv()
+                    except (EOFError, OSError):
+                        self._replace(worker)
+                        continue
+                    if request_id is None:
+                        worker.ready = ok
+                        if not ok:
+                            logger.error("Restarted Granite worker failed to load: %s", payload)
+                    else:
+                        self._resolve(worker, request_id, ok, payload)
+                elif not worker.conn.poll():
+                    # Exited, with no replies left to read.
+                    self._replace(worker)
+
+    def _replace(self, worker: _Worker):
+        """Start another worker in place of a dead one, then fail the requests the dead one held."""
+        worker.process.join(1)
+        code = worker.process.exitcode
+        if worker.ready:
+            logger.warning("Granite worker %s exited with code %s; starting a new one", worker.index, code)
+            self._count("restarted")
+            replacements = [self._spawn(worker.index)]
+        else:
+            # It never loaded the model; starting it again would fail the same way.
+            logger.error("Granite worker %s exited before it was ready; not restarting it", worker.index)
+            replacements = []
+        with self._futures_lock:
+            # Swapped first, so a caller retrying after the failure below reaches a live worker.
+            self._workers = [r for w in self._workers for r in (replacements if w is worker else [w])]
+            lost = list(worker.pending)
+        for request_id in lost:
+            self._resolve(worker, request_id, False, f"Granite worker exited with code {code}")
+        worker.conn.close()
+
+    def stats(self) -> Dict:
+        with self._futures_lock:
+            pending = len(self._futures)
+        with self._stats_lock:
+            stats = dict(self._stats)
+        return dict(stats, workers=self.workers, alive=sum(w.process.is_alive() for w in self._workers),
+                    threads_per_worker=self.threads, pending=pending, max_pending=self.max_pending)
+
+    def close(self, timeout: float = 5.0):
+        """Stop the workers after the requests already sent to them."""
+        self._closing = True
+        for worker in self._workers:
+            try:
+                with worker.send_lock:
+                    worker.conn.send(None)
+            except (OSError, ValueError):
+                pass
+        for worker in self._workers:
+            worker.process.join(timeout)
+            if worker.process.is_alive():
+                worker.process.terminate()
+        if self._dispatcher:
+            self._dispatcher.join(timeout)
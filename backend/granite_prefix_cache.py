@@ -0,0 +1,77 @@
+import copy
+import threading
+from typing import Dict, Optional, Tuple
+
+
+class PrefixCache:
+    """
+    Past key/values for a fixed prompt prefix, computed once per model.
+
+    Prompts that start with a registered prefix (the drug-information
+    template, the MediBot system prompt) only need their suffix run through
+    the model: the prefix's attention keys/values are encoded once and a
+    copy is handed to every generate() call. The prefix and suffix are
+    tokenized separately, so prefixes should end on a natural token boundary
+    such as a newline.
+    """
+
+    def __init__(self, model, tokenizer):
+        self.model = model
+        self.tokenizer = tokenizer
+        self._entries: Dict[str, Tuple[object, object]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def register(self, prefix: str):
+        """Encode a prefix now instead of on its first use."""
+        self._entry(prefix)
+
+    def match(self, prompt: str) -> Optional[str]:
+        """The longest registered prefix the prompt starts with, or None."""
+        best = None
+        for prefix in list(self._entries):
+            if prompt.startswith(prefix) and (best is None or len(prefix) > len(best)):
+                best = prefix
+        return best
+
+    def _entry(self, prefix: str):
+        entry = self._entries.get(prefix)
+        if entry is not None:
+            return entry
+        import torch
+        with self._lock:
+            entry = self._entries.get(prefix)
+            if entry is None:
+                input_ids = self.tokenizer(prefix, return_tensors="pt")["input_ids"]
+                with torch.no_grad():
+                    past = self.model(input_ids=input_ids, use_cache=True).past_key_values
+                entry = self._entries[prefix] = (input_ids, past)
+        return entry
+
+    def inputs(self, prompt: str) -> Dict:
+        """
+        generate() kwargs for a prompt, reusing the encoded prefix when it has one.
+
+        Returns:
+            Dict with input_ids and attention_mask, plus past_key_values (a
+            private copy, since generate() appends to the cache it is given)
+            when the prompt starts with a registered prefix.
+        """
+        import torch
+        prefix = self.match(prompt)
+        if prefix is None:
+            self.misses += 1
+            return dict(self.tokenizer(prompt, return_tensors="pt"))
+        self.hits += 1
+        prefix_ids, past = self._entry(prefix)
+        suffix_ids = self.tokenizer(prompt[len(prefix):], add_special_tokens=False, return_tensors="pt")["input_ids"]
+        input_ids = torch.cat([prefix_ids, suffix_ids], dim=1)
+        return {
+            "input_ids": input_ids,
+            "attention_mask": torch.ones_like(input_ids),
+            "past_key_values": copy.deepcopy(past),
+        }
+
+    def stats(self) -> Dict:
+        return {"prefixes": len(self._entries), "hits": self.hits, "misses": self.misses}
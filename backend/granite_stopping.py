@@ -0,0 +1,53 @@
+import threading
+from typing import Callable, List, Optional
+
+import torch
+from transformers import StoppingCriteria
+
+
+class TextStop(StoppingCriteria):
+    """
+    Per-row stopping criterion driven by a predicate over the generated text.
+
+    Each row stops when its own predicate returns True for the text generated
+    so far, or when it has produced its own max_new_tokens, so a batch ends as
+    soon as every row is done rather than after the longest budget. Both
+    predicates used here fire at the end of a line, so the generated text is
+    only decoded when the newest token contains a newline.
+
+    Args:
+        tokenizer: Tokenizer used to decode generated tokens.
+        prompt_length: Width of the (left-padded) prompt; generated tokens start here.
+        predicates: One text predicate per row, or None for rows that only stop on budget/EOS.
+        budgets: Max new tokens per row.
+    """
+
+    def __init__(self, tokenizer, prompt_length: int, predicates: List[Optional[Callable[[str], bool]]],
+                 budgets: List[int]):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.predicates = predicates
+        self.budgets = budgets
+        self.done = [False] * len(predicates)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        generated = input_ids.shape[1] - self.prompt_length
+        for i, predicate in enumerate(self.predicates):
+            if self.done[i]:
+                continue
+            if generated >= self.budgets[i]:
+                self.done[i] = True
+            elif predicate and "\n" in self.tokenizer.decode(input_ids[i, -1:]):
+                self.done[i] = predicate(self.tokenizer.decode(input_ids[i, self.prompt_length:],
+                                                               skip_special_tokens=True))
+        return torch.tensor(self.done, dtype=torch.bool, device=input_ids.device)
+
+
+class CancelStop(StoppingCriteria):
+    """Stops every row once `event` is set, e.g. when the client reading a stream has gone away."""
+
+    def __init__(self, event: threading.Event):
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
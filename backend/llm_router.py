@@ -0,0 +1,199 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Dict, Iterable, List, Optional
+
+from . import deadline, timing
+
+logger = logging.getLogger(__name__)
+
+# Hedge a slow call to the next backend once it has run longer than this
+# percentile of the primary's recent latencies.
+LLM_HEDGE = os.environ.get("LLM_HEDGE", "1") == "1"
+LLM_HEDGE_PERCENTILE = float(os.environ.get("LLM_HEDGE_PERCENTILE", "95"))
+# Below this many samples the hedge delay is LLM_HEDGE_DEFAULT_MS.
+LLM_HEDGE_MIN_SAMPLES = int(os.environ.get("LLM_HEDGE_MIN_SAMPLES", "10"))
+LLM_HEDGE_DEFAULT_MS = float(os.environ.get("LLM_HEDGE_DEFAULT_MS", "3000"))
+# A backend whose recent error rate reaches this is skipped while others are healthy.
+LLM_MAX_ERROR_RATE = float(os.environ.get("LLM_MAX_ERROR_RATE", "0.5"))
+LLM_ROUTER_WINDOW = int(os.environ.get("LLM_ROUTER_WINDOW", "50"))
+LLM_ROUTER_WORKERS = int(os.environ.get("LLM_ROUTER_WORKERS", "16"))
+
+
+class BackendStats:
+    """Rolling latency and error window plus in-flight count for one backend."""
+
+    def __init__(self, window: int = LLM_ROUTER_WINDOW):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.in_flight = 0
+        self.served = 0
+        self.errors = 0
+        self.hedges = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def finish(self, seconds: float, ok: bool):
+        with self.lock:
+            self.in_flight -= 1
+            self.outcomes.append(ok)
+            if ok:
+                self.latencies.append(seconds)
+            else:
+                self.errors += 1
+
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+
+    def expected_latency(self) -> float:
+        """Median latency scaled by the calls already queued on this backend; 0 until measured."""
+        median = self.percentile(50)
+        return 0.0 if median is None else median * (1 + self.in_flight)
+
+    def snapshot(self) -> Dict[str, Any]:
+        p50, p95 = self.percentile(50), self.percentile(95)
+        return {
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "error_rate": round(self.error_rate(), 3),
+            "in_flight": self.in_flight,
+            "served": self.served,
+            "errors": self.errors,
+            "hedges": self.hedges,
+        }
+
+
+class LLMRouter:
+    """
+    Routes query_drug/query calls across interchangeable LLM backends.
+
+    Exposes the same interface as GeminiAPI, so drug_logic, models and the
+    pipeline can take a router wherever they took the gemini object. Each
+    call goes to the healthy backend with the lowest expected latency
+    (rolling median times queue depth; unmeasured backends are tried first).
+    A backend is unhealthy while its is_ready() is False or its recent error
+    rate is at least `max_error_rate`; None counts as an error, since both
+    wrappers return None on failure.
+
+    With hedging on, a call still running after the primary's
+    `hedge_percentile` latency is also sent to the next backend, and the
+    first good answer wins. A failed primary fails over to the next backend
+    at once. Under a request deadline (deadline.py) the router stops
+    waiting and returns None once it passes. The backend that served the last call on this thread is
+    available from last_backend().
+
+    Args:
+        backends: Name to backend, in order of preference for ties.
+        hedge: Enable hedged requests.
+        hedge_percentile: Latency percentile of the primary after which to hedge.
+        max_error_rate: Error rate at which a backend stops being picked.
+    """
+
+    def __init__(self, backends: Dict[str, Any], hedge: bool = LLM_HEDGE,
+                 hedge_percentile: float = LLM_HEDGE_PERCENTILE, max_error_rate: float = LLM_MAX_ERROR_RATE):
+        self.backends = dict(backends)
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.max_error_rate = max_error_rate
+        self.stats_by_backend = {name: BackendStats() for name in self.backends}
+        self._executor = ThreadPoolExecutor(max_workers=LLM_ROUTER_WORKERS, thread_name_prefix="llm-router")
+        self._local = threading.local()
+
+    def query_drug(self, drug_name: str) -> Optional[Dict[str, Any]]:
+        return self._call("query_drug", drug_name)
+
+    def query_drug_fields(self, drug_name: str, fields: Iterable[str], **kwargs) -> Optional[Dict[str, Any]]:
+        return self._call("query_drug_fields", drug_name, fields=tuple(fields), **kwargs)
+
+    def query(self, prompt: str) -> Optional[str]:
+        return self._call("query", prompt)
+
+    def is_ready(self) -> bool:
+        return any(self._is_ready(backend) for backend in self.backends.values())
+
+    def last_backend(self) -> Optional[str]:
+        """Name of the backend that answered the last call made on this thread, or None."""
+        return getattr(self._local, "backend", None)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: dict(s.snapshot(), ready=self._is_ready(self.backends[name]))
+                for name, s in self.stats_by_backend.items()}
+
+    @staticmethod
+    def _is_ready(backend) -> bool:
+        is_ready = getattr(backend, "is_ready", None)
+        return is_ready() if is_ready else True
+
+    def ranked(self) -> List[str]:
+        """Ready backends, healthy ones first, each group fastest first."""
+        ready = [name for name, backend in self.backends.items() if self._is_ready(backend)]
+        order = {name: i for i, name in enumerate(self.backends)}
+        return sorted(ready, key=lambda name: (self.stats_by_backend[name].error_rate() >= self.max_error_rate,
+                                               self.stats_by_backend[name].expected_latency(), order[name]))
+
+    def hedge_delay(self, name: str) -> float:
+        stats = self.stats_by_backend[name]
+        if len(stats.latencies) < LLM_HEDGE_MIN_SAMPLES:
+            return LLM_HEDGE_DEFAULT_MS / 1000.0
+        return stats.percentile(self.hedge_percentile)
+
+    def _timed(self, name: str, method: str, arg, kwargs: Dict[str, Any]):
+        stats = self.stats_by_backend[name]
+        stats.start()
+        started = time.perf_counter()
+        result = None
+        try:
+            result = getattr(self.backends[name], method)(arg, **kwargs)
+        except Exception as e:
+            logger.error("LLM backend %s failed in %s: %s", name, method, e)
+        stats.finish(time.perf_counter() - started, result is not None)
+        return result
+
+    def _call(self, method: str, arg, **kwargs):
+        self._local.backend = None
+        candidates = self.ranked()
+        running = {}  # future -> backend name
+        while candidates or running:
+            if candidates and not running:
+                name = candidates.pop(0)
+                running[timing.submit(self._executor, self._timed, name, method, arg, kwargs)] = name
+            primary = next(iter(running.values()))
+            hedge_after = self.hedge_delay(primary) if self.hedge and candidates and len(running) == 1 else None
+            left = deadline.remaining()
+            if left is not None and left <= 0:
+                # Too late for any answer to be used; the calls still running finish on their own.
+                return None
+            timeout = hedge_after if left is None else min(left, hedge_after if hedge_after is not None else left)
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                if hedge_after is None or timeout < hedge_after:
+                    continue
+                # The primary is slow: race it against the next backend.
+                name = candidates.pop(0)
+                stats = self.stats_by_backend[name]
+                with stats.lock:
+                    stats.hedges += 1
+                running[timing.submit(self._executor, self._timed, name, method, arg, kwargs)] = name
+                continue
+            for future in done:
+                name = running.pop(future)
+                result = future.result()
+                if result is not None:
+                    stats = self.stats_by_backend[name]
+                    with stats.lock:
+                        stats.served += 1
+                    self._local.backend = name
+                    return result
+        return None
@@ -0,0 +1,258 @@
+"""
+Structured JSON logging written by a background thread, and one audit record per request.
+
+configure() puts a QueueLogHandler on the root logger: logging a record
+only builds its message and puts it on a bounded queue, and a background
+thread formats it as one JSON object per line and writes it to stderr. A
+request thread never waits on the terminal or a log collector; when the
+queue is full the record is dropped and counted instead.
+
+AuditMiddleware writes one record per request to the "backend.audit"
+logger with the route template (not the path, which may name a patient's
+drugs), status, latency, response size, the cache outcomes and the LLM
+or peer calls made for it. Like timing spans, the outcomes are collected
+through a context variable: `cache()` and `upstream()` are no-ops outside
+a request, and executor threads need timing.submit() to report them.
+"""
+import contextvars
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+# "json" for one object per line, "text" for plain lines while developing
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# Records waiting for the writer thread; more are dropped (and counted)
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+# Write an audit record for every request
+AUDIT_LOG = os.environ.get("AUDIT_LOG", "1") == "1"
+
+audit_logger = logging.getLogger("backend.audit")
+
+# Attributes every LogRecord has; anything else was passed in `extra`.
+_RECORD_ATTRS = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime"}
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message, pid, the `extra` fields and any traceback."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "pid": record.process,
+        }
+        entry.update((k, v) for k, v in record.__dict__.items() if k not in _RECORD_ATTRS)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class QueueLogHandler(logging.Handler):
+    """
+    Passes records to `target` on a background thread, through a queue of at most `size` records.
+
+    emit() never blocks: a record that does not fit is dropped and counted
+    in `dropped`. The writer thread is started again in forked children
+    (threads do not survive a fork), with a queue of their own.
+    """
+
+    def __init__(self, target: logging.Handler, size: int = LOG_QUEUE_SIZE):
+        super().__init__()
+        self.target = target
+        self.size = size
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+        self._closed = False
+        self._start()
+        os.register_at_fork(after_in_child=self._start)
+
+    def _start(self):
+        if self._closed:
+            return
+        self.queue: queue.Queue = queue.Queue(self.size)
+        self._writer = threading.Thread(target=self._write, args=(self.queue,), name="log-writer", daemon=True)
+        self._writer.start()
+
+    def _write(self, records: queue.Queue):
+        while True:
+            record = records.get()
+            try:
+                if record is None:
+                    return
+                self.target.handle(record)
+            except Exception:
+                # A failing target must not stop the writer, or the queue would only fill up.
+                self.handleError(record)
+            finally:
+                records.task_done()
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            # The message is built now, from the arguments as they are when logged.
+            record.msg, record.args = record.getMessage(), None
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        """Wait until the records queued so far are written."""
+        if self._writer.is_alive():
+            self.queue.join()
+        self.target.flush()
+
+    def close(self):
+        self._closed = True
+        if self._writer.is_alive():
+            self.queue.put(None)
+            self._writer.join(timeout=5)
+        self.target.close()
+        super().close()
+
+    def stats(self) -> Dict[str, int]:
+        return {"queued": self.queue.qsize(), "capacity": self.size, "dropped": self.dropped}
+
+
+class _StderrHandler(logging.StreamHandler):
+    """StreamHandler writing to whatever sys.stderr is when the record is written."""
+
+    def __init__(self):
+        super().__init__(sys.stderr)
+
+    @property
+    def stream(self):
+        return sys.stderr
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+def configure(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT, size: int = LOG_QUEUE_SIZE) -> QueueLogHandler:
+    """Route the root logger through a QueueLogHandler writing to stderr; returns the handler (the same one on later calls)."""
+    root = logging.getLogger()
+    for handler in root.handlers:
+        if isinstance(handler, QueueLogHandler):
+            return handler
+    target = _StderrHandler()
+    if fmt == "json":
+        target.setFormatter(JSONFormatter())
+    else:
+        target.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    handler = QueueLogHandler(target, size)
+    root.addHandler(handler)
+    root.setLevel(level)
+    # Audit records are kept whatever the level of the other logs (AUDIT_LOG turns them off).
+    audit_logger.setLevel(logging.INFO)
+    return handler
+
+
+class RequestAudit:
+    """What one request did, collected while it runs. list.append is atomic, so threads need no lock."""
+
+    __slots__ = ("caches", "calls")
+
+    def __init__(self):
+        self.caches: List[Tuple[str, str]] = []
+        self.calls: List[Tuple[str, str, float, bool]] = []
+
+    def cache_outcomes(self) -> Dict[str, Dict[str, int]]:
+        """Cache name to outcome ("hit", "miss", ...) to count."""
+        outcomes: Dict[str, Dict[str, int]] = {}
+        for name, outcome in list(self.caches):
+            counts = outcomes.setdefault(name, {})
+            counts[outcome] = counts.get(outcome, 0) + 1
+        return outcomes
+
+    def upstream_calls(self) -> List[Dict[str, Any]]:
+        return [{"backend": backend, "operation": operation, "ms": round(seconds * 1000, 1), "ok": ok}
+                for backend, operation, seconds, ok in list(self.calls)]
+
+
+_current: contextvars.ContextVar[Optional[RequestAudit]] = contextvars.ContextVar("request_audit", default=None)
+
+
+def current() -> Optional[RequestAudit]:
+    return _current.get()
+
+
+def cache(name: str, outcome: str):
+    """Note a lookup in cache `name` ("hit", "miss", "stale", ...) on the current request, if any."""
+    audit = _current.get()
+    if audit is not None:
+        audit.caches.append((name, outcome))
+
+
+def upstream(backend: str, operation: str, seconds: float, ok: bool):
+    """Note a call to an LLM backend or peer on the current request, if any."""
+    audit = _current.get()
+    if audit is not None:
+        audit.calls.append((backend, operation, seconds, ok))
+
+
+class AuditMiddleware:
+    """
+    ASGI middleware writing one audit record per request to the "backend.audit" logger.
+
+    The record is written after the last body chunk, so latency and size
+    cover a streamed response in full. Paths in `skip` are not audited.
+    """
+
+    def __init__(self, app, skip=("/metrics",)):
+        self.app = app
+        self.skip = set(skip)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("path") in self.skip:
+            await self.app(scope, receive, send)
+            return
+        audit = RequestAudit()
+        token = _current.set(audit)
+        started = time.perf_counter()
+        status = [500]
+        size = [0]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            elif message["type"] == "http.response.body":
+                size[0] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            route = scope.get("route")
+            audit_logger.info("request", extra={
+                "method": scope.get("method", ""),
+                "route": getattr(route, "path", "unmatched"),
+                "status": status[0],
+                "latency_ms": round((time.perf_counter() - started) * 1000, 2),
+                "bytes": size[0],
+                "cache": audit.cache_outcomes(),
+                "upstream": audit.upstream_calls(),
+            })
+
+
+def metric_samples(handler: QueueLogHandler):
+    """Collector for metrics.REGISTRY: records dropped and waiting in `handler`."""
+    def collect():
+        stats = handler.stats()
+        return [
+            ("log_records_dropped_total", "counter", "Log records dropped because the log queue was full.",
+             [({}, stats["dropped"])]),
+            ("log_queue_depth", "gauge", "Log records waiting to be written.", [({}, stats["queued"])]),
+        ]
+    return collect
@@ -0,0 +1,333 @@
+"""
+Prometheus text-format metrics without extra dependencies.
+
+Counters, gauges and histograms keep one shard per thread: the hot path
+only touches a dict owned by the calling thread, with no lock, and a
+scrape sums the shards. When a thread exits its shard is folded into the
+metric's base, so recycled worker threads do not pile up shards. Values
+that already live elsewhere (cache hit counts, pool stats) are exported
+by collector callbacks at scrape time.
+"""
+import bisect
+import threading
+import time
+import weakref
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+
+from . import logs, timing
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; spans cached lookups to slow Gemini/Granite generations
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# (labels, value) pairs of one metric family, as returned by collectors
+Samples = List[Tuple[Dict[str, str], float]]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    """A metric family whose values are sharded per thread, keyed by label values."""
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        # Live threads' shards by id, and the totals of threads that have exited
+        self._shards: Dict[int, Dict[Tuple[str, ...], Any]] = {}
+        self._base: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _shard(self) -> Dict[Tuple[str, ...], Any]:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            # Thread-local values are dropped when their thread exits, which runs the finalizer.
+            self._local.owner = owner = _ShardOwner()
+            weakref.finalize(owner, self._retire, shard)
+            with self._lock:
+                self._shards[id(shard)] = shard
+            return shard
+
+    def _retire(self, shard: Dict[Tuple[str, ...], Any]):
+        with self._lock:
+            self._shards.pop(id(shard), None)
+            for key, value in shard.items():
+                self._base[key] = self._fold(self._base.get(key), value)
+
+    @staticmethod
+    def _fold(total: Any, value: Any) -> Any:
+        """`total` plus one shard's `value` for the same labels, as a new value."""
+        return value if total is None else total + value
+
+    def _snapshots(self) -> List[Dict[Tuple[str, ...], Any]]:
+        with self._lock:
+            shards = list(self._shards.values())
+            base = self._base.copy()
+        # dict.copy() runs under the GIL, so a shard is never seen mid-resize.
+        return [base] + [shard.copy() for shard in shards]
+
+    def _labels(self, values: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.labelnames, values))
+
+
+class _ShardOwner:
+    """Held in a thread's local storage; its finalizer retires the thread's shards."""
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, *labels: str, amount: float = 1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def samples(self) -> Samples:
+        totals: Dict[Tuple[str, ...], float] = {}
+        for shard in self._snapshots():
+            for key, value in shard.items():
+                totals[key] = totals.get(key, 0) + value
+        if not totals and not self.labelnames:
+            totals[()] = 0
+        return [(self._labels(key), value) for key, value in sorted(totals.items())]
+
+    def value(self, *labels: str) -> float:
+        return sum(shard.get(labels, 0) for shard in self._snapshots())
+
+
+class Gauge(Counter):
+    """Up/down counter, e.g. requests in flight (inc on one thread, dec on another still sums right)."""
+
+    type = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: str):
+        shard = self._shard()
+        counts = shard.get(labels)
+        if counts is None:
+            # One count per bucket plus +Inf, then the running sum.
+            counts = shard[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    @staticmethod
+    def _fold(total, counts):
+        counts = list(counts)
+        return counts if total is None else [a + b for a, b in zip(total, counts)]
+
+    def samples(self) -> Samples:
+        totals: Dict[Tuple[str, ...], List[float]] = {}
+        for shard in self._snapshots():
+            for key, counts in shard.items():
+                total = totals.setdefault(key, [0] * len(counts))
+                for i, c in enumerate(list(counts)):
+                    total[i] += c
+        samples = []
+        for key, counts in sorted(totals.items()):
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                samples.append((dict(labels, le=_format_value(bound)), cumulative))
+            samples.append(({"__suffix": "_sum", **labels}, counts[-1]))
+            samples.append(({"__suffix": "_count", **labels}, cumulative))
+        return samples
+
+
+class Registry:
+    """Metric families plus collector callbacks, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, Samples]]]] = []
+        self._lock = threading.Lock()
+
+    def _add(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def collector(self, collect: Callable[[], Iterable[Tuple[str, str, str, Samples]]]):
+        """Register a callback returning (name, type, help, samples) families at scrape time."""
+        with self._lock:
+            self._collectors.append(collect)
+        return collect
+
+    def render(self) -> str:
+        with self._lock:
+            metrics, collectors = list(self._metrics.values()), list(self._collectors)
+        families: Dict[str, Tuple[str, str, Samples]] = {}
+        for metric in metrics:
+            families[metric.name] = (metric.type, metric.help, metric.samples())
+        for collect in collectors:
+            try:
+                for name, type_, help, samples in collect():
+                    families.setdefault(name, (type_, help, []))[2].extend(samples)
+            except Exception:
+                # A broken collector must not take the whole scrape down.
+                continue
+        lines = []
+        for name, (type_, help, samples) in families.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {type_}")
+            for labels, value in samples:
+                labels = dict(labels)
+                suffix = labels.pop("__suffix", "_bucket" if "le" in labels and type_ == "histogram" else "")
+                lines.append(f"{name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_LATENCY = REGISTRY.histogram(
+    "http_request_duration_seconds", "Time from request start to the last response byte.",
+    ("route", "method", "status"))
+HTTP_IN_FLIGHT = REGISTRY.gauge("http_requests_in_flight", "Requests currently being served.")
+UPSTREAM_CALLS = REGISTRY.counter(
+    "llm_upstream_calls_total", "Calls to LLM backends by outcome (ok or error).",
+    ("backend", "operation", "outcome"))
+UPSTREAM_LATENCY = REGISTRY.histogram(
+    "llm_upstream_duration_seconds", "Latency of LLM backend calls.", ("backend", "operation"))
+UPSTREAM_IN_FLIGHT = REGISTRY.gauge("llm_upstream_in_flight", "LLM backend calls in progress.", ("backend",))
+UPSTREAM_TOKENS = REGISTRY.counter(
+    "llm_tokens_total", "Tokens sent to (prompt) and generated by (output) LLM backends.", ("backend", "kind"))
+
+
+class upstream_call:
+    """
+    Context manager timing one LLM backend call into the upstream metrics
+    (and into the current request's Server-Timing spans and audit record).
+
+    The call counts as an error if it raises or if `ok` is set to False
+    inside the block (the wrappers return None instead of raising).
+    """
+
+    __slots__ = ("backend", "operation", "ok", "started")
+
+    def __init__(self, backend: str, operation: str):
+        self.backend = backend
+        self.operation = operation
+        self.ok = True
+
+    def __enter__(self) -> "upstream_call":
+        UPSTREAM_IN_FLIGHT.inc(self.backend)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.started
+        UPSTREAM_LATENCY.observe(seconds, self.backend, self.operation)
+        timing.record(self.backend, seconds)
+        UPSTREAM_IN_FLIGHT.dec(self.backend)
+        ok = self.ok and exc_type is None
+        logs.upstream(self.backend, self.operation, seconds, ok)
+        UPSTREAM_CALLS.inc(self.backend, self.operation, "ok" if ok else "error")
+        return False
+
+
+def count_tokens(backend: str, prompt: int = 0, output: int = 0):
+    if prompt:
+        UPSTREAM_TOKENS.inc(backend, "prompt", amount=prompt)
+    if output:
+        UPSTREAM_TOKENS.inc(backend, "output", amount=output)
+
+
+def cache_collector(name: str, stats: Callable[[], Dict[str, Any]]):
+    """
+    Export hits, misses and hit ratio of a cache whose stats() has "hits" and "misses".
+
+    Registered once per cache; all caches share the cache_* families, told
+    apart by the `cache` label. `stats` may return None while the cache
+    does not exist yet (e.g. Granite still loading).
+    """
+    def collect():
+        s = stats()
+        if not s:
+            return []
+        hits, misses = s.get("hits", 0), s.get("misses", 0)
+        labels = {"cache": name}
+        return [
+            ("cache_hits_total", "counter", "Cache lookups answered from the cache.", [(labels, hits)]),
+            ("cache_misses_total", "counter", "Cache lookups that missed.", [(labels, misses)]),
+            ("cache_hit_ratio", "gauge", "Hits over all lookups since start.",
+             [(labels, hits / (hits + misses) if hits + misses else 0.0)]),
+        ]
+    return REGISTRY.collector(collect)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording latency per route template, method and status, and requests in flight.
+
+    Latency runs until the last body chunk is sent, so streamed responses
+    count their whole duration. Requests that match no route are labelled
+    "unmatched" to keep the label set bounded.
+    """
+
+    def __init__(self, app, skip: Iterable[str] = ("/metrics",)):
+        self.app = app
+        self.skip = set(skip)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("path") in self.skip:
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = scope.get("route")
+            HTTP_LATENCY.observe(time.perf_counter() - started, getattr(route, "path", "unmatched"),
+                                 scope.get("method", ""), str(status[0]))
+
+
+def render() -> str:
+    return REGISTRY.render()
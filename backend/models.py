@@ -1,5 +1,8 @@
 import re
-from typing import List, Dict
+from functools import lru_cache
+from typing import List, Dict, Iterable, Iterator, Optional, NamedTuple
+
+from .timing import span
 
 
 
@@ -9,64 +12,23 @@ FREQ_RE = re.compile(r'(once(?:\s+daily)?|twice(?:\s+daily)?|three times(?:\s+da
 DRUG_RE = re.compile(r'\b([A-Z][a-zA-Z0-9\-]{2,})\b')
 SYMPTOM_RE = re.compile(r'([A-Z][a-z]+(?: [a-z]+){0,3})(?:\.|:|,| -)', re.IGNORECASE)
 
-def extract_drug_info(text: str, gemini=None) -> List[Dict]:
-    """
-    Best-effort extractor:
-    - Finds candidate drug names (capitalized tokens)
-    - Finds dosages and frequencies nearby
-    - If drug not in local heuristics, queries Gemini as fallback
-    Returns list of dicts: {name, dosage, frequency}
-    """
-    # Improved sentence-based parsing with symptom extraction
-    text = text.replace('\n', ' ')
-    sentences = re.split(r'(?<=[.!?])\s+', text)
-    results = []
-    symptom = ""
-    # List of common conditions to filter from drugs
-    COMMON_CONDITIONS = set([
-        "fever", "cough", "pain", "reflux", "headache", "cold", "flu", "infection", "asthma", "diabetes", "hypertension", "allergy", "acidity", "acid"
-    ])
-    # Try to extract symptom/condition from first sentence
-    if sentences:
-        match = SYMPTOM_RE.match(sentences[0])
-        if match:
-            symptom = match.group(1).strip()
-    for sent in sentences:
-        drugs = [m.group(1) for m in DRUG_RE.finditer(sent) if m.group(1).lower() not in ('the','and','for','with','prescribe','mild','infection','daily','days')]
-        # If sentence contains a known condition, set as symptom/condition and skip adding as drug
-        sent_lower = sent.lower()
-        for cond in COMMON_CONDITIONS:
-            if cond in sent_lower:
-                symptom = cond if not symptom else symptom
-        for drug in drugs:
-            # Filter out common conditions from drug list
-            if drug.lower() in COMMON_CONDITIONS:
-                continue
-            dosage = None
-            freq = None
-            # Find dosage near drug name
-            pattern = re.compile(re.escape(drug) + r'.{0,40}?' + DOSAGE_RE.pattern, re.IGNORECASE)
-            m = pattern.search(sent)
-            if m:
-                dosage = m.group(1)
-            else:
-                # fallback: any dosage in sentence
-                m2 = DOSAGE_RE.search(sent)
-                if m2:
-                    dosage = m2.group(1)
-            # Find frequency near drug name (including duration)
-            freq_pat = re.compile(re.escape(drug) + r'.{0,40}?' + FREQ_RE.pattern, re.IGNORECASE)
-            fm = freq_pat.search(sent)
-            if fm:
-                freq = fm.group(1)
-            else:
-                fm2 = FREQ_RE.search(sent)
-                if fm2:
-                    freq = fm2.group(1)
-            # fallback to Gemini for missing info
-            if gemini and not (dosage or freq):
-                # Strict prompt for Gemini extraction
-                strict_prompt = f"""
+SENTENCE_BOUNDARY_RE = re.compile(r'(?<=[.!?])\s+')
+
+# List of common conditions to filter from drugs
+COMMON_CONDITIONS = set([
+    "fever", "cough", "pain", "reflux", "headache", "cold", "flu", "infection", "asthma", "diabetes", "hypertension", "allergy", "acidity", "acid"
+])
+# Leftmost (longest) condition keyword in a sentence
+CONDITION_RE = re.compile('|'.join(re.escape(c) for c in sorted(COMMON_CONDITIONS, key=len, reverse=True)), re.IGNORECASE)
+# Capitalized words that DRUG_RE picks up but are never drugs
+NON_DRUG_WORDS = ('the', 'and', 'for', 'with', 'prescribe', 'mild', 'infection', 'daily', 'days')
+
+# Number of leading characters sent to Gemini when nothing was found locally
+GEMINI_FALLBACK_CHARS = 60
+
+
+def _strict_prompt(input_text: str) -> str:
+    return f"""
 You are a medical text extractor. 
 Task: Parse prescriptions into structured data. 
 Rules:
@@ -76,7 +38,7 @@ Rules:
 - Ignore non-drug terms like 'acid', 'fever', 'pain', etc. 
 - Always include 'Duration' if mentioned.
 
-Input: '{sent.strip()}'
+Input: '{input_text}'
 Output format:
 Condition: ...
 Drug: ...
@@ -84,32 +46,295 @@ Dosage: ...
 Frequency: ...
 Duration: ...
 """
-                gem = gemini.query(strict_prompt)
+
+
+class SentenceSplitter:
+    """
+    Incremental sentence splitter.
+
+    Feeding a text in any number of chunks yields the same sentences as
+    re.split on the whole text, but only the current, unfinished sentence is
+    buffered. If a single sentence grows beyond `window` characters it is cut
+    at the last space so memory stays bounded by the window size.
+    """
+
+    def __init__(self, window: Optional[int] = None):
+        self.window = window
+        self.head = ""  # first GEMINI_FALLBACK_CHARS characters, for the Gemini fallback
+        self._buffer = ""
+        # True when the last chunk ended inside a sentence boundary, whose
+        # whitespace may continue at the start of the next chunk.
+        self._at_boundary = False
+
+    def feed(self, chunk: str) -> List[str]:
+        chunk = chunk.replace('\n', ' ')
+        if len(self.head) < GEMINI_FALLBACK_CHARS:
+            self.head += chunk[:GEMINI_FALLBACK_CHARS - len(self.head)]
+        if self._at_boundary:
+            chunk = chunk.lstrip()
+            if not chunk:
+                return []
+            self._at_boundary = False
+        sentences = SENTENCE_BOUNDARY_RE.split(self._buffer + chunk)
+        # The last piece may still grow with the next chunk.
+        self._buffer = sentences.pop()
+        if not self._buffer and sentences:
+            self._at_boundary = True
+        while self.window and len(self._buffer) > self.window:
+            cut = self._buffer.rfind(' ', 0, self.window)
+            if cut <= 0:
+                cut = self.window
+            sentences.append(self._buffer[:cut])
+            self._buffer = self._buffer[cut:].lstrip(' ')
+        return sentences
+
+    def close(self, chunk: str = "") -> List[str]:
+        sentences = self.feed(chunk) if chunk else []
+        sentences.extend(SENTENCE_BOUNDARY_RE.split(self._buffer))
+        self._buffer = ""
+        self._at_boundary = False
+        return sentences
+
+
+class Span(NamedTuple):
+    """Offsets of a piece of text in the document it was found in."""
+    start: int
+    end: int
+
+
+@lru_cache(maxsize=1024)
+def _near_pattern(drug: str, target: str) -> "re.Pattern":
+    """Pattern for `target` (a regex) within 40 characters after `drug`, compiled once per drug."""
+    return re.compile(re.escape(drug) + r'.{0,40}?' + target, re.IGNORECASE | re.DOTALL)
+
+
+def _iter_sentence_spans(text: str) -> Iterator[Span]:
+    """Sentence offsets in `text`; the same pieces re.split would produce, without copying them."""
+    # One search per boundary rather than finditer(), whose scanner would hold
+    # its matching state for the whole document while the sentences are scanned.
+    start = 0
+    boundary = SENTENCE_BOUNDARY_RE.search(text)
+    while boundary is not None:
+        yield Span(start, boundary.start())
+        start = boundary.end()
+        boundary = SENTENCE_BOUNDARY_RE.search(text, start)
+    yield Span(start, len(text))
+
+
+class DrugMention:
+    """
+    A drug found in a document, kept as offsets into the text it came from.
+
+    Strings are only materialized on request, so highlighting and dedup can
+    work on the integer spans. `provenance` records how each field was found:
+    'near' (right after the drug name), 'sentence' (elsewhere in the sentence),
+    'heading'/'keyword' for the condition, or 'gemini' for values that did not
+    come from the text (those are held in `values`).
+    """
+    __slots__ = ("source", "sentence", "name", "dosage", "frequency",
+                 "condition", "condition_source", "provenance", "values")
+
+    def __init__(self, source: str, sentence: Span, name: Span):
+        self.source = source
+        self.sentence = sentence
+        self.name = name
+        self.dosage: Optional[Span] = None
+        self.frequency: Optional[Span] = None
+        self.condition: Optional[Span] = None
+        self.condition_source = source
+        self.provenance: Dict[str, str] = {"name": "regex"}
+        self.values: Dict[str, str] = {}
+
+    def text(self, field: str) -> str:
+        """Materialize one field as a string ('' if it was not found)."""
+        if field in self.values:
+            return self.values[field]
+        span = getattr(self, field)
+        if span is None:
+            return ""
+        if field == "condition":
+            value = self.condition_source[span.start:span.end]
+            return value.lower() if self.provenance.get("condition") == "keyword" else value
+        return self.source[span.start:span.end]
+
+    def to_dict(self) -> Dict:
+        """The record extract_drug_info returns: {name, dosage, frequency, symptom}."""
+        return {"name": self.text("name"), "dosage": self.text("dosage"),
+                "frequency": self.text("frequency"), "symptom": self.text("condition")}
+
+    def offsets(self) -> Dict:
+        """Field spans as [start, end] lists (None when absent or not from the text), plus provenance."""
+        spans = {"sentence": list(self.sentence)}
+        for field in ("name", "dosage", "frequency", "condition"):
+            span = getattr(self, field)
+            spans[field] = list(span) if span is not None and field not in self.values else None
+        spans["provenance"] = dict(self.provenance)
+        return spans
+
+
+class DrugExtractor:
+    """
+    Sentence-at-a-time form of extract_drug_info.
+
+    Carries the detected symptom/condition from one sentence to the next, so
+    a document can be processed as a stream of sentences without keeping the
+    earlier ones around.
+    """
+
+    def __init__(self, gemini=None):
+        self.gemini = gemini
+        self.found = 0
+        self._first = True
+        self._condition: Optional[Span] = None
+        self._condition_source = ""
+        self._condition_provenance = ""
+
+    @property
+    def symptom(self) -> str:
+        if self._condition is None:
+            return ""
+        value = self._condition_source[self._condition.start:self._condition.end]
+        return value.lower() if self._condition_provenance == "keyword" else value
+
+    def process(self, sent: str) -> List[Dict]:
+        """Extract the drugs mentioned in one sentence."""
+        return [m.to_dict() for m in self.process_span(sent, Span(0, len(sent)))]
+
+    def process_span(self, text: str, sentence: Span) -> List[DrugMention]:
+        """
+        Extract the drugs mentioned in text[sentence.start:sentence.end] without slicing it.
+
+        Args:
+            text: Text to scan, with newlines already replaced by spaces.
+            sentence: Offsets of the sentence within `text`.
+        """
+        pos, endpos = sentence
+        results = []
+        # Try to extract symptom/condition from first sentence
+        if self._first:
+            self._first = False
+            match = SYMPTOM_RE.match(text, pos, endpos)
+            if match:
+                self._set_condition(Span(*match.span(1)), text, "heading")
+        # If sentence contains a known condition, set as symptom/condition and skip adding as drug
+        if self._condition is None:
+            cm = CONDITION_RE.search(text, pos, endpos)
+            if cm:
+                self._set_condition(Span(*cm.span()), text, "keyword")
+        # Collected first so the scanner is freed before the per-drug searches.
+        names = [Span(*dm.span(1)) for dm in DRUG_RE.finditer(text, pos, endpos)]
+        for name in names:
+            drug = text[name.start:name.end]
+            drug_lower = drug.lower()
+            # Filter out common conditions from drug list
+            if drug_lower in NON_DRUG_WORDS or drug_lower in COMMON_CONDITIONS:
+                continue
+            mention = DrugMention(text, sentence, name)
+            # Find dosage near drug name
+            m = _near_pattern(drug, DOSAGE_RE.pattern).search(text, pos, endpos)
+            if m:
+                mention.dosage, mention.provenance["dosage"] = Span(*m.span(1)), "near"
+            else:
+                # fallback: any dosage in sentence
+                m2 = DOSAGE_RE.search(text, pos, endpos)
+                if m2:
+                    mention.dosage, mention.provenance["dosage"] = Span(*m2.span(1)), "sentence"
+            # Find frequency near drug name (including duration)
+            fm = _near_pattern(drug, FREQ_RE.pattern).search(text, pos, endpos)
+            if fm:
+                mention.frequency, mention.provenance["frequency"] = Span(*fm.span(1)), "near"
+            else:
+                fm2 = FREQ_RE.search(text, pos, endpos)
+                if fm2:
+                    mention.frequency, mention.provenance["frequency"] = Span(*fm2.span(1)), "sentence"
+            # fallback to Gemini for missing info
+            if self.gemini and not (mention.dosage or mention.frequency):
+                # Strict prompt for Gemini extraction
+                gem = self.gemini.query(_strict_prompt(text[pos:endpos].strip()))
                 if gem and isinstance(gem, dict):
-                    dosage = dosage or gem.get("dosage")
-                    freq = freq or gem.get("frequency")
-            results.append({"name": drug, "dosage": dosage or "", "frequency": freq or "", "symptom": symptom})
-    # if nothing found, try full-text Gemini parse with strict prompt
-    if gemini and not results:
-        strict_prompt = f"""
-You are a medical text extractor. 
-Task: Parse prescriptions into structured data. 
-Rules:
-- Only list actual drugs, not symptoms or conditions. 
-- If a condition is mentioned (e.g., 'Acid reflux'), place it under 'Condition'. 
-- Extract: Condition, Drug name, Dosage, Frequency, Duration. 
-- Ignore non-drug terms like 'acid', 'fever', 'pain', etc. 
-- Always include 'Duration' if mentioned.
+                    for field in ("dosage", "frequency"):
+                        if gem.get(field):
+                            mention.values[field] = gem[field]
+                            mention.provenance[field] = "gemini"
+            if self._condition is not None:
+                mention.condition = self._condition
+                mention.condition_source = self._condition_source
+                mention.provenance["condition"] = self._condition_provenance
+            results.append(mention)
+        self.found += len(results)
+        return results
 
-Input: '{text[:60]}'
-Output format:
-Condition: ...
-Drug: ...
-Dosage: ...
-Frequency: ...
-Duration: ...
-"""
-        gem = gemini.query(strict_prompt)
-        if gem and isinstance(gem, dict):
-            return [{"name": gem.get("name",""), "dosage": gem.get("dosage",""), "frequency": gem.get("frequency",""), "symptom": symptom, "duration": gem.get("duration","") }]
-    return results
\ No newline at end of file
+    def _set_condition(self, span: Span, source: str, provenance: str):
+        self._condition = span
+        self._condition_source = source
+        self._condition_provenance = provenance
+
+    def finish(self, head: str) -> List[Dict]:
+        """
+        Full-text Gemini fallback, used only when no sentence yielded a drug.
+
+        Args:
+            head: The first GEMINI_FALLBACK_CHARS characters of the document.
+        """
+        # if nothing found, try full-text Gemini parse with strict prompt
+        if self.gemini and not self.found:
+            gem = self.gemini.query(_strict_prompt(head))
+            if gem and isinstance(gem, dict):
+                return [{"name": gem.get("name",""), "dosage": gem.get("dosage",""), "frequency": gem.get("frequency",""), "symptom": self.symptom, "duration": gem.get("duration","") }]
+        return []
+
+
+def iter_drug_info(chunks: Iterable[str], gemini=None, window: Optional[int] = None) -> Iterator[Dict]:
+    """
+    Streaming extractor: yields each drug record as soon as its sentence is complete.
+
+    Args:
+        chunks: The document text, in chunks of any size.
+        gemini: Optional GeminiAPI used as a fallback for missing information.
+        window: Maximum sentence length kept in memory; None for unbounded.
+    """
+    splitter = SentenceSplitter(window)
+    extractor = DrugExtractor(gemini)
+    for chunk in chunks:
+        for sent in splitter.feed(chunk):
+            yield from extractor.process(sent)
+    for sent in splitter.close():
+        yield from extractor.process(sent)
+    yield from extractor.finish(splitter.head)
+
+
+def _iter_mentions(text: str, extractor: DrugExtractor) -> Iterator[DrugMention]:
+    for sentence in _iter_sentence_spans(text):
+        yield from extractor.process_span(text, sentence)
+
+
+def extract_drug_spans(text: str, gemini=None) -> List[DrugMention]:
+    """
+    Span-offset form of extract_drug_info.
+
+    Returns DrugMention objects whose fields are (start, end) offsets into
+    `text` itself, so callers can highlight or dedup on integers and only
+    materialize the strings they need. Materialized values read as in
+    extract_drug_info, with newlines as spaces. The Gemini full-text fallback
+    is not applied, since its answers have no position in the text; callers
+    fall back to extract_drug_info when nothing is found.
+    """
+    # Newlines become spaces, which leaves every offset where it was in `text`.
+    scan = text.replace('\n', ' ') if '\n' in text else text
+    with span("extract"):
+        return list(_iter_mentions(scan, DrugExtractor(gemini)))
+
+
+def extract_drug_info(text: str, gemini=None) -> List[Dict]:
+    """
+    Best-effort extractor:
+    - Finds candidate drug names (capitalized tokens)
+    - Finds dosages and frequencies nearby
+    - If drug not in local heuristics, queries Gemini as fallback
+    Returns list of dicts: {name, dosage, frequency}
+    """
+    text = text.replace('\n', ' ')
+    extractor = DrugExtractor(gemini)
+    with span("extract"):
+        results = [m.to_dict() for m in _iter_mentions(text, extractor)]
+    return results or extractor.finish(text[:GEMINI_FALLBACK_CHARS])
@@ -0,0 +1,277 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, TimeoutError as FuturesTimeout
+from typing import Dict, List, Optional, Any, Iterator, Tuple
+
+from . import timing
+from .deadline import clamp as clamp_deadline
+from .models import extract_drug_info, extract_drug_spans
+from .drug_logic import (normalize_name, check_interactions, get_dosage, suggest_alternatives,
+                         local_drug_info, interactions_for)
+
+logger = logging.getLogger(__name__)
+
+# Shared pool for upstream drug lookups made by the pipeline
+PIPELINE_WORKERS = int(os.environ.get("PIPELINE_WORKERS", "8"))
+# Default overall deadline for one /analyze_prescription call
+PIPELINE_DEADLINE_MS = int(os.environ.get("PIPELINE_DEADLINE_MS", "8000"))
+
+_executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="pipeline")
+
+TIMEOUT_MESSAGE = "Lookup did not finish before the deadline. Please try again."
+
+
+class _ResolvedLookups:
+    """
+    Read-only stand-in for GeminiAPI backed by lookups that already finished.
+
+    drug_logic functions call query_drug once per drug and endpoint; routing
+    them through this object means every drug is fetched from Gemini at most
+    once per prescription, whichever endpoints need it.
+    """
+
+    def __init__(self, gemini, results: Dict[str, Optional[Dict[str, Any]]]):
+        self._gemini = gemini
+        self._results = results
+
+    def query_drug(self, drug_name: str) -> Optional[Dict[str, Any]]:
+        return self._results.get(normalize_name(drug_name))
+
+    def query(self, prompt: str) -> Optional[str]:
+        return self._gemini.query(prompt)
+
+
+def _lookup(gemini, name: str) -> Tuple[Optional[Dict[str, Any]], str]:
+    """query_drug plus the backend that answered it (an LLMRouter records it per thread)."""
+    record = gemini.query_drug(name)
+    last_backend = getattr(gemini, "last_backend", None)
+    return record, (last_backend() if last_backend else None) or "gemini"
+
+
+def extract_stage(text: str, gemini=None):
+    """
+    Extract drugs with their span offsets.
+
+    Returns:
+        (records, spans) where records are extract_drug_info dicts and spans
+        the matching DrugMention.offsets(); spans is empty when the result came
+        from the Gemini full-text fallback.
+    """
+    mentions = extract_drug_spans(text, gemini)
+    if mentions:
+        return [m.to_dict() for m in mentions], [m.offsets() for m in mentions]
+    return extract_drug_info(text, gemini), []
+
+
+def unique_drugs(names: List[str]) -> Dict[str, str]:
+    """Map normalized name to the first spelling seen, preserving order."""
+    unique = {}
+    for name in names:
+        key = normalize_name(name)
+        if key and key not in unique:
+            unique[key] = name
+    return unique
+
+
+def analyze_prescription(text: str, age: int = 30, gemini=None, deadline_ms: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Extract drugs from a prescription and resolve dosage, alternatives and interactions for all of them.
+
+    Each distinct drug outside _drug_db is looked up once, concurrently;
+    local drugs are answered from _drug_db, as in the streaming form (see
+    drug_logic.drug_record). Lookups still running when the deadline passes
+    are reported with status 'timeout' and the rest of the document is
+    returned as is.
+
+    Args:
+        text: Prescription text.
+        age: Patient age, used to pick child or adult dosages.
+        gemini: GeminiAPI instance (or anything with query_drug/query).
+        deadline_ms: Overall time budget; defaults to PIPELINE_DEADLINE_MS.
+
+    Returns:
+        Dict with 'drugs', 'interactions', 'spans', 'timings' (ms per stage)
+        and 'complete' (False if any lookup timed out).
+    """
+    started = time.perf_counter()
+    deadline = clamp_deadline(started + (deadline_ms if deadline_ms is not None else PIPELINE_DEADLINE_MS) / 1000.0)
+    timings = {}
+
+    t0 = time.perf_counter()
+    records, spans = extract_stage(text, gemini)
+    timings["extract_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+
+    drugs = unique_drugs([r.get("name", "") for r in records])
+
+    t0 = time.perf_counter()
+    results: Dict[str, Optional[Dict[str, Any]]] = {}
+    timed_out = set()
+    if gemini and drugs:
+        futures = {key: timing.submit(_executor, gemini.query_drug, name)
+                   for key, name in drugs.items() if not local_drug_info(name)}
+        done, _ = wait(futures.values(), timeout=max(0.0, deadline - time.perf_counter()))
+        for key, future in futures.items():
+            if future in done:
+                try:
+                    results[key] = future.result()
+                except Exception as e:
+                    logger.error("Error looking up %s: %s", drugs[key], e)
+                    results[key] = None
+            else:
+                future.cancel()
+                timed_out.add(key)
+    timings["lookup_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+
+    t0 = time.perf_counter()
+    resolved = _ResolvedLookups(gemini, results) if gemini else None
+    per_drug = {}
+    for key, name in drugs.items():
+        if key in timed_out:
+            # The local database still answers dosage without Gemini.
+            dosage = get_dosage(name, age, None)
+            per_drug[key] = {"recommended_dosage": dosage, "alternatives": [TIMEOUT_MESSAGE], "status": "timeout"}
+        else:
+            per_drug[key] = {
+                "recommended_dosage": get_dosage(name, age, resolved),
+                "alternatives": suggest_alternatives(name, age, resolved),
+                "status": "ok",
+            }
+    interactions = check_interactions(list(drugs.values()), resolved) if drugs else {}
+    for key in timed_out:
+        interactions[key] = [TIMEOUT_MESSAGE]
+
+    out_drugs = []
+    for r in records:
+        entry = {
+            "name": r.get("name", ""),
+            "dosage": r.get("dosage", ""),
+            "frequency": r.get("frequency", ""),
+            "symptom": r.get("symptom", ""),
+        }
+        entry.update(per_drug.get(normalize_name(entry["name"]), {}))
+        out_drugs.append(entry)
+    timings["assemble_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+    timings["total_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    return {
+        "drugs": out_drugs,
+        "interactions": interactions,
+        "spans": spans,
+        "timings": timings,
+        "complete": not timed_out,
+    }
+
+
+def iter_lookups(drugs: Dict[str, str], gemini=None, deadline: Optional[float] = None
+                 ) -> Iterator[Tuple[str, str, str, Optional[Dict[str, Any]]]]:
+    """
+    Resolve drug records, yielding each one as soon as it is available.
+
+    Local _drug_db hits are yielded immediately; Gemini lookups run
+    concurrently and follow in completion order. Lookups still running at
+    `deadline` (a time.perf_counter() value) are yielded with source 'timeout'.
+
+    Args:
+        drugs: Normalized name to display name, as from unique_drugs.
+        gemini: GeminiAPI instance, or None to use the local database only.
+        deadline: Absolute perf_counter deadline, or None to wait indefinitely.
+
+    Yields:
+        (key, name, source, record) with source 'local', 'timeout' or the LLM
+        backend that answered ('gemini' unless a router chose another).
+    """
+    futures = {}
+    ready = []
+    for key, name in drugs.items():
+        local = local_drug_info(name)
+        if local:
+            ready.append((key, name, "local", local))
+        elif gemini:
+            futures[timing.submit(_executor, _lookup, gemini, name)] = key
+        else:
+            ready.append((key, name, "gemini", None))
+    # Gemini lookups are already running while the local hits go out.
+    yield from ready
+
+    pending = set(futures)
+    timeout = None if deadline is None else max(0.0, deadline - time.perf_counter())
+    try:
+        for future in as_completed(futures, timeout=timeout):
+            pending.discard(future)
+            key = futures[future]
+            try:
+                record, source = future.result()
+            except Exception as e:
+                logger.error("Error looking up %s: %s", drugs[key], e)
+                record, source = None, "gemini"
+            yield key, drugs[key], source, record
+    except FuturesTimeout:
+        for future in pending:
+            future.cancel()
+            yield futures[future], drugs[futures[future]], "timeout", None
+
+
+def _drug_event(name: str, source: str, record: Optional[Dict[str, Any]], all_drugs: List[str],
+                age: int = 30) -> Dict[str, Any]:
+    """One per-drug event for the streaming endpoints."""
+    if source == "timeout":
+        return {"event": "drug", "drug": name, "source": source, "status": "timeout",
+                "dosage": get_dosage(name, age, None), "alternatives": [TIMEOUT_MESSAGE],
+                "interactions": [TIMEOUT_MESSAGE]}
+    lookup = _ResolvedLookups(None, {normalize_name(name): record})
+    return {
+        "event": "drug",
+        "drug": name,
+        "source": source,
+        "status": "ok",
+        "dosage": get_dosage(name, age, lookup),
+        "alternatives": suggest_alternatives(name, age, lookup),
+        "interactions": interactions_for(name, record, all_drugs),
+    }
+
+
+def iter_drug_events(drug_names: List[str], gemini=None, age: int = 30,
+                     deadline_ms: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Stream dosage, alternatives and interactions per drug as each lookup resolves.
+
+    Each 'drug' event carries the drug's `key` (normalize_name), under which
+    all its spellings were deduplicated. Ends with a 'done' event carrying
+    the total time and whether every lookup finished before the deadline.
+    """
+    started = time.perf_counter()
+    deadline = clamp_deadline(started + (deadline_ms if deadline_ms is not None else PIPELINE_DEADLINE_MS) / 1000.0)
+    drugs = unique_drugs(drug_names)
+    all_drugs = list(drugs.values())
+    complete = True
+    for key, name, source, record in iter_lookups(drugs, gemini, deadline):
+        complete = complete and source != "timeout"
+        event = _drug_event(name, source, record, all_drugs, age)
+        event["key"] = key
+        event["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        yield event
+    yield {"event": "done", "complete": complete, "total_ms": round((time.perf_counter() - started) * 1000, 2)}
+
+
+def iter_analysis_events(text: str, age: int = 30, gemini=None,
+                         deadline_ms: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Streaming form of analyze_prescription.
+
+    Emits an 'extracted' event with the drugs and spans found in the text,
+    then one 'drug' event per distinct drug as its lookup resolves, then 'done'.
+    Extracted drugs and 'drug' events share the `key` that matches them up.
+    """
+    started = time.perf_counter()
+    records, spans = extract_stage(text, gemini)
+    yield {
+        "event": "extracted",
+        "drugs": [{"name": r.get("name", ""), "key": normalize_name(r.get("name", "")),
+                   "dosage": r.get("dosage", ""), "frequency": r.get("frequency", ""),
+                   "symptom": r.get("symptom", "")} for r in records],
+        "spans": spans,
+        "extract_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
+    remaining = None if deadline_ms is None else max(0, deadline_ms - int((time.perf_counter() - started) * 1000))
+    yield from iter_drug_events([r.get("name", "") for r in records], gemini, age, remaining)
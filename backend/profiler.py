@@ -0,0 +1,82 @@
+"""
+Sampling profiler for live traffic.
+
+Every `interval` seconds it reads the current stack of every thread from
+sys._current_frames() and counts identical stacks. Nothing is traced
+between samples, so the overhead is one stack walk per thread per sample.
+The result is in the folded format ("thread;outer;inner count" per line)
+read by flamegraph.pl, speedscope and similar tools.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict
+
+# Upper bound for one profiling run
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", "60"))
+
+# Innermost frames of threads that are waiting, not working
+_IDLE_FILES = {"threading.py", "queue.py", "selectors.py", "thread.py"}
+
+_running = threading.Lock()
+
+
+class ProfilerBusy(RuntimeError):
+    """Another profiling run is in progress."""
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+
+def sample(seconds: float, interval: float = 0.01, include_idle: bool = False) -> Dict[str, int]:
+    """
+    Sample all threads but the calling one for `seconds`.
+
+    Args:
+        seconds: Duration, capped at PROFILE_MAX_SECONDS.
+        interval: Seconds between samples.
+        include_idle: Keep stacks of threads blocked waiting for work
+            (innermost frame in threading/queue/selectors), which otherwise
+            dominate the profile of a mostly idle server.
+
+    Returns:
+        Folded stack to number of samples. Raises ProfilerBusy if a run is already going.
+    """
+    if not _running.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already being recorded")
+    try:
+        names = {}
+        counts: Counter = Counter()
+        me = threading.get_ident()
+        deadline = time.monotonic() + min(seconds, PROFILE_MAX_SECONDS)
+        while time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                if not include_idle and os.path.basename(frame.f_code.co_filename) in _IDLE_FILES:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                if ident not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack.append(names.get(ident, f"thread-{ident}"))
+                counts[";".join(reversed(stack))] += 1
+            time.sleep(interval)
+        return dict(counts)
+    finally:
+        _running.release()
+
+
+def folded(counts: Dict[str, int]) -> str:
+    """Folded-stack text, heaviest stacks first."""
+    return "".join(f"{stack} {n}\n" for stack, n in sorted(counts.items(), key=lambda item: -item[1]))
+
+
+def profile(seconds: float, interval: float = 0.01, include_idle: bool = False) -> str:
+    return folded(sample(seconds, interval, include_idle))
@@ -0,0 +1,82 @@
+from typing import Iterable, Tuple
+
+from .section_parser import DRUG_SECTIONS
+
+# Fixed MediBot instructions. Kept separate from the per-message part so the
+# local Granite model can reuse the encoded prefix across chat turns.
+MEDIBOT_SYSTEM_PROMPT = """
+You are MediBot, a helpful medical assistant chatbot.
+Provide accurate, helpful information about medications, health conditions, and general medical advice.
+
+Always include appropriate disclaimers when providing medical information.
+If you're unsure about something, acknowledge your limitations and suggest consulting a healthcare professional.
+
+"""
+
+
+def medibot_prompt(message: str, context: str = "") -> str:
+    """The full chat prompt: system instructions, previous context, then the user's question."""
+    return (
+        f"{MEDIBOT_SYSTEM_PROMPT}"
+        f"Previous context (if any):\n{context}\n\n"
+        f"User's question: {message}\n"
+    )
+
+
+# One line per section of the drug information prompt
+DRUG_FIELD_TEMPLATES = {
+    "name": "Name: (standard name)",
+    "dosage": "Dosage: (typical dosage ranges for adults and children if applicable)",
+    "frequency": "Frequency: (how often it should be taken)",
+    "interactions": "Interactions: (list major drug interactions, separated by commas)",
+    "alternatives": "Alternatives: (list alternative medications, separated by commas)",
+}
+# Output-token allowance per requested section, on top of DRUG_FIELDS_BASE_TOKENS
+# for an UNKNOWN_MEDICATION answer.
+DRUG_FIELD_TOKENS = {"name": 16, "dosage": 96, "frequency": 48, "interactions": 128, "alternatives": 96}
+DRUG_FIELDS_BASE_TOKENS = 48
+
+
+def drug_fields(fields: Iterable[str]) -> Tuple[str, ...]:
+    """Requested sections in prompt order, without duplicates. Raises ValueError for unknown names."""
+    fields = set(fields)
+    unknown = fields.difference(DRUG_SECTIONS)
+    if unknown:
+        raise ValueError(f"Unknown drug fields {sorted(unknown)}, expected some of {DRUG_SECTIONS}")
+    return tuple(f for f in DRUG_SECTIONS if f in fields)
+
+
+def drug_fields_prefix(fields: Iterable[str] = DRUG_SECTIONS) -> str:
+    """Fixed instructions asking for the given sections; the drug name follows it (see drug_fields_prompt)."""
+    fields = drug_fields(fields)
+    closing = ("\nFormat as plain text with clear section headers.\n" if fields == DRUG_SECTIONS else
+               "\nInclude only these sections, keep them brief, and format as plain text with clear section headers.\n")
+    return (
+        "Provide detailed pharmaceutical information for the drug named at the end of this message."
+        "\n\nIf it is not a recognized medication, please respond with 'UNKNOWN_MEDICATION' at the beginning of your response, "
+        "followed by your best guess about what this might be, if possible."
+        "\n\nFor recognized medications, include the following sections:\n"
+        + "".join(DRUG_FIELD_TEMPLATES[f] + "\n" for f in fields)
+        + closing
+    )
+
+
+def drug_fields_prompt(drug_name: str, fields: Iterable[str] = DRUG_SECTIONS) -> str:
+    """Drug information prompt for only the given sections, drug name last."""
+    return f"{drug_fields_prefix(fields)}\nDrug: '{drug_name}'\n"
+
+
+def drug_fields_budget(fields: Iterable[str]) -> int:
+    """Output-token limit for an answer with the given sections."""
+    return DRUG_FIELDS_BASE_TOKENS + sum(DRUG_FIELD_TOKENS[f] for f in drug_fields(fields))
+
+
+def chat_summary_prompt(summary: str, transcript: str) -> str:
+    """Prompt folding older chat turns into the running conversation summary."""
+    return (
+        "Update the summary of a conversation between a user and MediBot, a medical assistant chatbot.\n"
+        "Keep the medications, doses, conditions, ages and open questions mentioned; drop pleasantries.\n"
+        "Answer with the updated summary only, in at most a few sentences.\n\n"
+        f"Summary so far:\n{summary or '(none)'}\n\n"
+        f"Newer turns:\n{transcript}\n"
+    )
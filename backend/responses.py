@@ -0,0 +1,75 @@
+"""
+JSON encoding for responses, and pre-rendered bodies served with ETags.
+
+orjson is used when it is installed (it is several times faster than the
+json module on the small dicts returned here); it is optional, and the
+output is the same compact JSON either way.
+"""
+import hashlib
+import json
+from typing import Any, Dict, NamedTuple, Optional
+
+from fastapi.responses import JSONResponse, Response
+
+from . import timing
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def json_bytes(content: Any) -> bytes:
+    """Compact UTF-8 JSON, as starlette's JSONResponse renders it."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(content)
+        except TypeError:
+            # Types orjson does not know (e.g. int subclasses as dict keys)
+            pass
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with json_bytes, recording the rendering as a "serialize" span."""
+
+    def render(self, content) -> bytes:
+        with timing.span("serialize"):
+            return json_bytes(content)
+
+
+class Rendered(NamedTuple):
+    """A response body encoded once, with its strong ETag."""
+    body: bytes
+    etag: str
+
+
+def render(content: Any, version: str = "") -> Rendered:
+    """Encode `content` and tag it by its bytes (prefixed with `version`, e.g. the data it came from)."""
+    body = json_bytes(content)
+    digest = hashlib.blake2b(body, digest_size=12).hexdigest()
+    return Rendered(body, f'"{version}-{digest}"' if version else f'"{digest}"')
+
+
+def not_modified(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Whether an If-None-Match header value matches `etag`.
+
+    If-None-Match uses the weak comparison, so W/"x" matches "x".
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def rendered_response(rendered: Rendered, if_none_match: Optional[str] = None,
+                      cache_control: Optional[str] = None) -> Response:
+    """200 with the pre-rendered body, or 304 without one when the client's copy is current."""
+    headers: Dict[str, str] = {"etag": rendered.etag}
+    if cache_control:
+        headers["cache-control"] = cache_control
+    if not_modified(if_none_match, rendered.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(rendered.body, media_type="application/json", headers=headers)
@@ -0,0 +1,108 @@
+from typing import Any, Dict, List, Optional
+
+# Sections of a drug information answer, as requested by the prompts
+DRUG_SECTIONS = ("name", "dosage", "frequency", "interactions", "alternatives")
+# Sections whose values are comma-separated lists
+LIST_SECTIONS = ("interactions", "alternatives")
+# Reported by feed() when the model said it does not know the medication
+UNKNOWN = "unknown_medication"
+
+
+def _split(text: str) -> List[str]:
+    return [item.strip() for item in text.split(',') if item.strip()]
+
+
+class SectionParser:
+    """
+    Incremental parser for 'Header: value' drug information answers.
+
+    Text is fed in chunks as it streams in, from Gemini or Granite. A section
+    is complete once the next section header starts (or the text ends), and
+    feed() returns the sections completed by each chunk, so a caller that
+    only needs the dosage can stop reading, and cancel the generation, as
+    soon as 'dosage' comes back.
+
+    Parsing follows the original line rules: headers are matched
+    case-insensitively at the start of a line, list sections split on commas
+    and continue on the following lines, dosage and frequency continuation
+    lines are joined with spaces. A line starting with UNKNOWN_MEDICATION
+    (any case) ends parsing; with unknown_on_first_line (GeminiAPI's rule)
+    only an answer that opens with the exact marker counts as unknown.
+    """
+
+    def __init__(self, unknown_on_first_line: bool = False):
+        self.unknown_on_first_line = unknown_on_first_line
+        self._first_line = True
+        self.values: Dict[str, Any] = {}
+        self.completed: List[str] = []
+        self.current: Optional[str] = None
+        self.unknown = False
+        self.text = ""
+        self._partial_line = ""
+
+    def feed(self, chunk: str) -> List[str]:
+        """Consume a chunk of text. Returns the sections it completed (or [UNKNOWN])."""
+        self.text += chunk
+        if self.unknown:
+            return []
+        lines = (self._partial_line + chunk).split("\n")
+        self._partial_line = lines.pop()
+        done = []
+        for line in lines:
+            done.extend(self._line(line))
+            if self.unknown:
+                break
+        return done
+
+    def close(self) -> List[str]:
+        """Finish the text; completes the last open section."""
+        done = []
+        if not self.unknown:
+            done.extend(self._line(self._partial_line))
+            if self.current and not self.unknown:
+                done.append(self._complete(self.current))
+            self.current = None
+        self._partial_line = ""
+        return [d for d in done if d]
+
+    def _complete(self, section: str) -> str:
+        if section not in self.completed:
+            self.completed.append(section)
+        return section
+
+    def _line(self, line: str) -> List[str]:
+        line = line.strip()
+        if not line:
+            return []
+        lower = line.lower()
+        first_line, self._first_line = self._first_line, False
+        if self.unknown_on_first_line:
+            unknown = first_line and line.startswith("UNKNOWN_MEDICATION")
+        else:
+            unknown = lower.startswith(UNKNOWN)
+        if unknown:
+            self.unknown = True
+            return [UNKNOWN]
+        for section in DRUG_SECTIONS:
+            if lower.startswith(section + ":"):
+                closed = [self._complete(self.current)] if self.current else []
+                self.current = section
+                content = line.split(":", 1)[1].strip()
+                if content:
+                    self.values[section] = _split(content) if section in LIST_SECTIONS else content
+                return closed
+        # Continuation line for the current section
+        if self.current in LIST_SECTIONS:
+            self.values.setdefault(self.current, []).extend(_split(line))
+        elif self.current in ("dosage", "frequency"):
+            previous = self.values.get(self.current)
+            self.values[self.current] = f"{previous} {line}" if previous else line
+        return []
+
+
+def parse_sections(text: str, unknown_on_first_line: bool = False) -> SectionParser:
+    """Parse a complete answer in one go."""
+    parser = SectionParser(unknown_on_first_line)
+    parser.feed(text)
+    parser.close()
+    return parser
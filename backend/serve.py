@@ -0,0 +1,136 @@
+"""
+Preforking server: the app is loaded once, then forked into worker processes.
+
+Loading backend.app before the fork means the drug data, the pre-rendered
+responses and the imported libraries are in memory once and shared
+copy-on-write by every worker, and a worker restarts without loading them
+again. The workers accept connections on the one listening socket; the
+parent only restarts workers that die and passes on SIGTERM/SIGINT.
+
+The caches are shared through SHARED_CACHE_URL (see shared_cache); with
+several workers and no URL set, a SQLite file in the temp directory is used.
+Each worker loads its own Granite model if GRANITE_ENABLED=1, after the fork.
+Metrics and admission limits are per worker. Uvicorn's own logs go through
+the app's JSON log queue, and its access log is off while the app writes
+audit records (see backend/logs.py).
+
+Usage:
+    python -m backend.serve --workers 4 --port 8000
+"""
+import argparse
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# Worker processes; 1 serves in this process without forking
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", "1"))
+
+
+def _listen(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _serve(app_module, sock: socket.socket, warm_up: bool, log_level: str):
+    import uvicorn
+    if warm_up and app_module.granite_api is not None:
+        # Threads do not survive fork, so the model is loaded in each worker.
+        app_module.granite_api.warm_up()
+    from .logs import AUDIT_LOG
+    config = uvicorn.Config(app_module.app, log_level=log_level, log_config=None, access_log=not AUDIT_LOG,
+                            timeout_graceful_shutdown=10)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Serve the API with preforked worker processes.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=WEB_CONCURRENCY)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args(argv)
+
+    if args.workers > 1 and not os.environ.get("SHARED_CACHE_URL"):
+        os.environ["SHARED_CACHE_URL"] = "sqlite:///" + os.path.join(tempfile.gettempdir(), "cognitivex-cache.sqlite3")
+    # Granite warm-up starts a thread, which would not survive the fork; the workers start it.
+    warm_up = os.environ.get("GRANITE_WARMUP", "1") == "1"
+    os.environ["GRANITE_WARMUP"] = "0"
+    from . import app as app_module
+
+    sock = _listen(args.host, args.port)
+    if args.workers <= 1:
+        _serve(app_module, sock, warm_up, args.log_level)
+        return 0
+
+    children = set()
+    stopping = False
+    # Self-pipe: a signal writes a byte here, which ends the restart back-off at once.
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_w, False)
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.set_wakeup_fd(-1)
+            os.close(wakeup_r)
+            os.close(wakeup_w)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                _serve(app_module, sock, warm_up, args.log_level)
+            except BaseException as e:
+                logger.error("Worker %s failed: %s", os.getpid(), e)
+                code = 1
+            finally:
+                logging.shutdown()
+                os._exit(code)
+        children.add(pid)
+        if stopping:
+            # The signal arrived while forking, before stop() could see this worker.
+            os.kill(pid, signal.SIGTERM)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.set_wakeup_fd(wakeup_w)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(args.workers):
+        spawn()
+    logger.info("Serving on %s:%s with %s workers (parent %s)", args.host, args.port, args.workers, os.getpid())
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            logger.warning("Worker %s exited with status %s; starting a new one", pid, status)
+            # Do not spin if workers die right after starting; a signal ends the wait.
+            select.select([wakeup_r], [], [], 1.0)
+            while select.select([wakeup_r], [], [], 0)[0]:
+                os.read(wakeup_r, 512)
+            if not stopping:
+                spawn()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+"""
+Key-value stores shared by all worker processes.
+
+With several workers (see backend/serve.py) every in-process cache would be
+filled separately, so a drug one worker fetched from Gemini would be fetched
+again by each of the others. The drug-info cache, the chat answer cache and
+the chat sessions therefore keep their in-process copy as a first level and
+read through to one of these stores on a miss, and write through to it on
+every update.
+
+SHARED_CACHE_URL picks the store:
+
+    (unset)                   no shared tier; single-process behaviour
+    sqlite:////var/cache/x.db a SQLite file in WAL mode, for workers on one host
+    redis://host:6379/0       Redis or anything speaking its protocol (needs the redis package)
+
+Values are bytes with a time to live. update() is an atomic
+read-modify-write: a write transaction in SQLite, WATCH/MULTI/EXEC in
+Redis, where it is retried (so fn may run more than once) when another
+client changed the key in between.
+"""
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+import threading
+import time
+from typing import Callable, Optional
+
+SHARED_CACHE_URL = os.environ.get("SHARED_CACHE_URL", "")
+# Remove expired SQLite rows once every this many writes
+SQLITE_PURGE_EVERY = 1000
+
+
+class SharedStore(ABC):
+    """Interface of the shared stores; update() is get then set unless a store can do better."""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        """The value stored under `key`, or None if there is none or it expired."""
+
+    @abstractmethod
+    def set(self, key: str, value: bytes, ttl: float):
+        """Store `value` under `key` for `ttl` seconds."""
+
+    @abstractmethod
+    def delete(self, key: str):
+        """Remove `key`, if it is stored."""
+
+    def update(self, key: str, fn: Callable[[Optional[bytes]], bytes], ttl: float) -> bytes:
+        """Store fn(current value or None) and return it."""
+        value = fn(self.get(key))
+        self.set(key, value, ttl)
+        return value
+
+
+class SQLiteStore(SharedStore):
+    """
+    Store in a SQLite file, shared by processes on the same host.
+
+    Each thread of each process opens its own connection (connections must
+    not cross a fork). WAL mode lets readers proceed while one process writes.
+    """
+
+    def __init__(self, path: str, timeout: float = 5.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._writes = 0
+        # Not kept: the app is usually loaded before the workers are forked.
+        conn = self._connect()
+        conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL)")
+        conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._connect()
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key: str) -> Optional[bytes]:
+        row = self._conn().execute("SELECT value FROM kv WHERE key = ? AND expires > ?", (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def _write(self, conn: sqlite3.Connection, key: str, value: bytes, ttl: float):
+        now = time.time()
+        conn.execute("INSERT OR REPLACE INTO kv (key, value, expires) VALUES (?, ?, ?)", (key, value, now + ttl))
+        self._writes += 1
+        if self._writes % SQLITE_PURGE_EVERY == 0:
+            conn.execute("DELETE FROM kv WHERE expires <= ?", (now,))
+
+    def set(self, key: str, value: bytes, ttl: float):
+        self._write(self._conn(), key, value, ttl)
+
+    def delete(self, key: str):
+        self._conn().execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def update(self, key: str, fn: Callable[[Optional[bytes]], bytes], ttl: float) -> bytes:
+        conn = self._conn()
+        # BEGIN IMMEDIATE takes the write lock first, so no other process can interleave.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            value = fn(self.get(key))
+            self._write(conn, key, value, ttl)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+
+class RedisStore(SharedStore):
+    """
+    Store in Redis (or a server compatible with it).
+
+    Args:
+        client: A redis.Redis-like client with get, set(key, value, px=...),
+            delete and transaction.
+        prefix: Prepended to every key, so several deployments can share a server.
+    """
+
+    def __init__(self, client, prefix: str = "cognitivex:"):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisStore":
+        # Imported here: redis is only needed when a redis:// URL is configured.
+        import redis
+        return cls(redis.Redis.from_url(url))
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(self.prefix + key)
+
+    def set(self, key: str, value: bytes, ttl: float):
+        self.client.set(self.prefix + key, value, px=max(1, int(ttl * 1000)))
+
+    def delete(self, key: str):
+        self.client.delete(self.prefix + key)
+
+    def update(self, key: str, fn: Callable[[Optional[bytes]], bytes], ttl: float) -> bytes:
+        key = self.prefix + key
+
+        def apply(pipe) -> bytes:
+            # Watched: EXEC fails, and transaction() runs this again, if the key changes before it.
+            value = fn(pipe.get(key))
+            pipe.multi()
+            pipe.set(key, value, px=max(1, int(ttl * 1000)))
+            return value
+
+        return self.client.transaction(apply, key, value_from_callable=True)
+
+
+def open_store(url: str = SHARED_CACHE_URL) -> Optional[SharedStore]:
+    """The store for a SHARED_CACHE_URL value, or None when it is empty."""
+    if not url:
+        return None
+    if url.startswith("sqlite:///"):
+        return SQLiteStore(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisStore.from_url(url)
+    raise ValueError(f"Unsupported SHARED_CACHE_URL '{url}', expected sqlite:///path or redis://host")
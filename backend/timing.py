@@ -0,0 +1,132 @@
+"""
+Per-request timing spans, returned in a Server-Timing header.
+
+TimingMiddleware puts a RequestTimings in a context variable for each
+request; `with span("parse"):` anywhere below it adds a span, and is a
+no-op outside a request. Worker threads started through FastAPI's thread
+pool see the same RequestTimings; executors created by the app need
+submit() to carry it over.
+"""
+import contextvars
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Send the Server-Timing header (it shows how long each stage took, which
+# may be more than a public deployment wants to reveal).
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "1") == "1"
+
+_current: contextvars.ContextVar[Optional["RequestTimings"]] = contextvars.ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    """Spans recorded during one request, as (name, seconds) in the order they finished."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: List[Tuple[str, float]] = []
+
+    def add(self, name: str, seconds: float):
+        # list.append is atomic, so spans from worker threads need no lock.
+        self.spans.append((name, seconds))
+
+    def summary(self) -> Dict[str, Tuple[float, int]]:
+        """Name to (total seconds, count), in order of first appearance."""
+        totals: Dict[str, Tuple[float, int]] = {}
+        for name, seconds in list(self.spans):
+            total, count = totals.get(name, (0.0, 0))
+            totals[name] = (total + seconds, count + 1)
+        return totals
+
+    def header(self) -> str:
+        """
+        Server-Timing value, e.g. 'extract;dur=2.1, gemini;dur=812.4;desc="x3", total;dur=830.0'.
+
+        Spans are inclusive and may overlap: an "extract" span contains the
+        Gemini calls made during extraction, which are also listed on their own.
+        """
+        parts = []
+        for name, (seconds, count) in self.summary().items():
+            part = f"{name};dur={seconds * 1000:.1f}"
+            if count > 1:
+                part += f';desc="x{count}"'
+            parts.append(part)
+        parts.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(parts)
+
+
+def current() -> Optional[RequestTimings]:
+    return _current.get()
+
+
+def record(name: str, seconds: float):
+    """Add a span measured elsewhere to the current request, if any."""
+    timings = _current.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+class span:
+    """Context manager timing a block into the current request's spans."""
+
+    __slots__ = ("name", "timings", "started")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self) -> "span":
+        self.timings = _current.get()
+        if self.timings is not None:
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.timings is not None:
+            self.timings.add(self.name, time.perf_counter() - self.started)
+        return False
+
+
+def submit(executor, fn, *args, **kwargs):
+    """executor.submit() running `fn` in a copy of the caller's context, so its spans reach the request."""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+class TimingMiddleware:
+    """
+    ASGI middleware collecting spans per request.
+
+    The Server-Timing header is added when the response starts, so it
+    covers the spans finished by then (for a streamed response, the work
+    before the first byte). The full breakdown is logged at DEBUG level
+    once the response is complete.
+    """
+
+    def __init__(self, app, header: bool = SERVER_TIMING):
+        self.app = app
+        self.header = header
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timings = RequestTimings()
+        token = _current.set(timings)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                if self.header:
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"server-timing", timings.header().encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("%s %s -> %s: %s", scope.get("method"), scope.get("path"), status[0], timings.header())
@@ -0,0 +1,111 @@
+"""
+Tokens and latency per drug endpoint, full drug queries vs field-selective ones.
+
+"full" is the previous behaviour: every endpoint asks Gemini for all five
+sections. "fields" asks only for the sections the endpoint uses, with
+maxOutputTokens capped per section. "fields+cache" runs the endpoints in a
+row through the shared DrugInfoCache, so later endpoints only fetch the
+sections earlier ones did not.
+
+By default Gemini is simulated (benchmarks.stubs.SimulatedGemini) so the run
+is offline and repeatable; --live sends the requests to the real API.
+
+Usage:
+    python -m benchmarks.drug_fields_bench
+    python -m benchmarks.drug_fields_bench --live --drugs rivaroxaban gabapentin
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+from unittest import mock
+
+import backend.gemini_api as gemini_module
+from backend.drug_cache import DrugInfoCache, CachedDrugLookup
+from backend.drug_logic import (check_interactions, get_dosage, suggest_alternatives,
+                                get_alternatives_and_interactions_via_gemini)
+from backend.gemini_api import GeminiAPI
+from benchmarks.stubs import SimulatedGemini
+
+# Not in the local _drug_db, so get_dosage has to ask the LLM
+DRUGS = ["rivaroxaban", "gabapentin", "montelukast", "doxycycline", "pregabalin", "ondansetron"]
+
+ENDPOINTS = {
+    "dosage": lambda api, drug: get_dosage(drug, 30, api),
+    "interactions": lambda api, drug: check_interactions([drug, "aspirin"], api),
+    "alternatives": lambda api, drug: suggest_alternatives(drug, 30, api),
+    "alternatives_and_interactions": lambda api, drug: get_alternatives_and_interactions_via_gemini(drug, api),
+}
+
+
+class FullRecordOnly:
+    """GeminiAPI without query_drug_fields, so drug_logic falls back to full queries."""
+
+    def __init__(self, gemini: GeminiAPI):
+        self.gemini = gemini
+
+    def query_drug(self, drug_name):
+        return self.gemini.query_drug(drug_name)
+
+    def query(self, prompt):
+        return self.gemini.query(prompt)
+
+
+def run(mode: str, drugs, gemini: GeminiAPI):
+    """Per endpoint: median latency and mean prompt/output tokens per call."""
+    if mode == "full":
+        api = FullRecordOnly(gemini)
+    elif mode == "fields":
+        api = gemini
+    else:
+        api = CachedDrugLookup(gemini, DrugInfoCache())
+    report = {}
+    samples = {name: {"ms": [], "prompt_tokens": [], "output_tokens": []} for name in ENDPOINTS}
+    for drug in drugs:
+        for name, call in ENDPOINTS.items():
+            before = gemini.usage_stats()
+            started = time.perf_counter()
+            call(api, drug)
+            samples[name]["ms"].append((time.perf_counter() - started) * 1000)
+            after = gemini.usage_stats()
+            samples[name]["prompt_tokens"].append(after["prompt_tokens"] - before["prompt_tokens"])
+            samples[name]["output_tokens"].append(after["output_tokens"] - before["output_tokens"])
+    for name, s in samples.items():
+        report[name] = {
+            "latency_p50_ms": round(statistics.median(s["ms"]), 1),
+            "prompt_tokens": round(statistics.mean(s["prompt_tokens"]), 1),
+            "output_tokens": round(statistics.mean(s["output_tokens"]), 1),
+        }
+    return report
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compare full and field-selective drug queries per endpoint.")
+    parser.add_argument("--drugs", nargs="+", default=DRUGS)
+    parser.add_argument("--live", action="store_true", help="Query the real Gemini API instead of the simulation")
+    parser.add_argument("--first-token-ms", type=float, default=300.0)
+    parser.add_argument("--ms-per-token", type=float, default=8.0)
+    args = parser.parse_args(argv)
+
+    gemini = GeminiAPI()
+    results = {"gemini": "live" if args.live else "simulated", "drugs": len(args.drugs)}
+    with mock.patch.object(gemini_module.requests, "post",
+                           gemini_module.requests.post if args.live else
+                           SimulatedGemini(args.first_token_ms, args.ms_per_token).post):
+        for mode in ("full", "fields", "fields+cache"):
+            results[mode] = run(mode, args.drugs, gemini)
+
+    json.dump(results, sys.stdout, indent=2)
+    print()
+    print(f"{'endpoint':<32}{'full out tok':>14}{'fields out tok':>16}{'full p50 ms':>13}{'fields p50 ms':>15}"
+          f"{'cached p50 ms':>15}")
+    for name in ENDPOINTS:
+        full, fields, cached = results["full"][name], results["fields"][name], results["fields+cache"][name]
+        print(f"{name:<32}{full['output_tokens']:>14}{fields['output_tokens']:>16}{full['latency_p50_ms']:>13}"
+              f"{fields['latency_p50_ms']:>15}{cached['latency_p50_ms']:>15}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,200 @@
+"""
+Speed and accuracy benchmark for backend.models.extract_drug_info.
+
+Runs the extractor over a synthetic labelled corpus with Gemini stubbed out and
+reports throughput, per-document latency percentiles, allocations and
+precision/recall. Results are compared against a stored baseline and the run
+fails when a metric regresses beyond the threshold.
+
+Usage:
+    python -m benchmarks.extraction_bench                    # compare with baseline
+    python -m benchmarks.extraction_bench --update-baseline  # record a new baseline
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from typing import List, Dict, Tuple
+
+from backend.models import extract_drug_info
+from benchmarks.corpus import generate_corpus
+from benchmarks.stubs import StubGemini
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baselines", "extraction.json")
+
+# Direction of each tracked metric: +1 means higher is better, -1 lower is better.
+# Accuracy metrics are compared with an absolute tolerance, timings and
+# allocations with the relative threshold.
+TIMING_METRICS = {
+    "sentences_per_sec": +1,
+    "latency_p50_ms": -1,
+    "latency_p99_ms": -1,
+    "alloc_peak_kib_mean": -1,
+}
+ACCURACY_METRICS = ("precision", "recall", "dosage_accuracy", "frequency_accuracy")
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def score_document(predicted: List[Dict], labels: List[Dict]) -> Tuple[int, int, int, int, int]:
+    """
+    Match predictions to labelled mentions by drug name.
+
+    Returns:
+        (true_positives, false_positives, false_negatives, dosage_hits, frequency_hits)
+    """
+    unused = list(predicted)
+    tp = dosage_hits = freq_hits = 0
+    for label in labels:
+        for i, pred in enumerate(unused):
+            if pred.get("name", "").lower() == label["name"]:
+                tp += 1
+                if (pred.get("dosage") or "").lower() == label["dosage"].lower():
+                    dosage_hits += 1
+                if (pred.get("frequency") or "").lower() == label["frequency"].lower():
+                    freq_hits += 1
+                del unused[i]
+                break
+    return tp, len(unused), len(labels) - tp, dosage_hits, freq_hits
+
+
+def run_benchmark(corpus: List[Dict], repeat: int = 5) -> Dict:
+    """
+    Run the extractor over the corpus and collect metrics.
+
+    Args:
+        corpus: Documents from benchmarks.corpus.generate_corpus.
+        repeat: Number of timed passes over the corpus; the fastest is reported.
+
+    Returns:
+        Dict of metric name to value.
+    """
+    gemini = StubGemini()
+
+    # Accuracy pass (also warms up regex caches).
+    tp = fp = fn = dosage_hits = freq_hits = 0
+    for doc in corpus:
+        t, f, n, d, q = score_document(extract_drug_info(doc["text"], gemini), doc["drugs"])
+        tp, fp, fn, dosage_hits, freq_hits = tp + t, fp + f, fn + n, dosage_hits + d, freq_hits + q
+    # Counted over this single pass, so the number does not depend on --repeat.
+    gemini_calls = gemini.query_calls + gemini.query_drug_calls
+
+    # Timing passes. Each document keeps the fastest of its runs, and
+    # throughput is derived from those minima, which keeps the numbers stable
+    # enough to gate on despite scheduler noise.
+    per_doc = [float("inf")] * len(corpus)
+    for _ in range(repeat):
+        for i, doc in enumerate(corpus):
+            t0 = time.perf_counter()
+            extract_drug_info(doc["text"], gemini)
+            per_doc[i] = min(per_doc[i], (time.perf_counter() - t0) * 1000)
+    total_sentences = sum(doc["n_sentences"] for doc in corpus)
+
+    # Allocation pass; kept separate because tracing skews timings.
+    peaks = []
+    tracemalloc.start()
+    try:
+        for doc in corpus:
+            tracemalloc.reset_peak()
+            base, _ = tracemalloc.get_traced_memory()
+            extract_drug_info(doc["text"], gemini)
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append((peak - base) / 1024)
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "documents": len(corpus),
+        "sentences_per_sec": round(total_sentences / (sum(per_doc) / 1000), 1),
+        "latency_p50_ms": round(percentile(per_doc, 50), 4),
+        "latency_p99_ms": round(percentile(per_doc, 99), 4),
+        "alloc_peak_kib_mean": round(sum(peaks) / len(peaks), 2),
+        "alloc_peak_kib_max": round(max(peaks), 2),
+        "precision": round(tp / (tp + fp), 4) if tp + fp else 0.0,
+        "recall": round(tp / (tp + fn), 4) if tp + fn else 0.0,
+        "dosage_accuracy": round(dosage_hits / tp, 4) if tp else 0.0,
+        "frequency_accuracy": round(freq_hits / tp, 4) if tp else 0.0,
+        "gemini_calls": gemini_calls,
+    }
+
+
+def compare_to_baseline(results: Dict, baseline: Dict, threshold: float = 0.25,
+                        accuracy_tolerance: float = 0.005) -> List[str]:
+    """
+    Return a list of human readable regressions; empty when the run passes.
+
+    Args:
+        results: Metrics from run_benchmark.
+        baseline: Previously stored metrics.
+        threshold: Allowed relative slowdown for timing and allocation metrics.
+        accuracy_tolerance: Allowed absolute drop for accuracy metrics.
+    """
+    regressions = []
+    for metric, direction in TIMING_METRICS.items():
+        if metric not in baseline:
+            continue
+        old, new = baseline[metric], results[metric]
+        if direction > 0 and new < old * (1 - threshold):
+            regressions.append(f"{metric}: {new} < {old} (-{threshold:.0%} allowed)")
+        elif direction < 0 and new > old * (1 + threshold):
+            regressions.append(f"{metric}: {new} > {old} (+{threshold:.0%} allowed)")
+    for metric in ACCURACY_METRICS:
+        if metric in baseline and results[metric] < baseline[metric] - accuracy_tolerance:
+            regressions.append(f"{metric}: {results[metric]} < {baseline[metric]}")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark extract_drug_info on a synthetic corpus.")
+    parser.add_argument("--docs", type=int, default=200, help="number of documents in the corpus")
+    parser.add_argument("--seed", type=int, default=7, help="corpus seed")
+    parser.add_argument("--repeat", type=int, default=5, help="timed passes over the corpus")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON file")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed relative regression for timing metrics (default 0.25)")
+    parser.add_argument("--update-baseline", action="store_true", help="store this run as the new baseline")
+    args = parser.parse_args(argv)
+
+    corpus = generate_corpus(n_docs=args.docs, seed=args.seed)
+    results = run_benchmark(corpus, repeat=args.repeat)
+    results["config"] = {"docs": args.docs, "seed": args.seed, "repeat": args.repeat,
+                         "python": platform.python_version()}
+    print(json.dumps(results, indent=2))
+
+    if args.update_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --update-baseline first.")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("config", {}).get("docs") != args.docs or baseline.get("config", {}).get("seed") != args.seed:
+        print("Warning: baseline was recorded with a different corpus; accuracy comparison may not be meaningful.")
+    regressions = compare_to_baseline(results, baseline, threshold=args.threshold)
+    if regressions:
+        print("REGRESSIONS:")
+        for r in regressions:
+            print(f"  - {r}")
+        return 1
+    print("OK: no regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
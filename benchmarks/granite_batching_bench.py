@@ -0,0 +1,80 @@
+"""
+Aggregate tokens/sec of the Granite model under concurrency, inline vs. micro-batched.
+
+Usage:
+    python -m benchmarks.granite_batching_bench --concurrency 8 --requests 32
+    GRANITE_MODEL=/path/to/model python -m benchmarks.granite_batching_bench
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from backend.granite_batching import GraniteBatcher
+
+PROMPTS = [
+    "Provide detailed pharmaceutical information for the drug 'paracetamol'.",
+    "Provide detailed pharmaceutical information for the drug 'ibuprofen'.",
+    "What is the usual adult dose of amoxicillin?",
+    "List common interactions of warfarin.",
+    "Suggest alternatives to omeprazole.",
+    "Is metformin safe with alcohol?",
+]
+
+
+def _run(fn, n_requests: int, concurrency: int):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        tokens = sum(pool.map(fn, (PROMPTS[i % len(PROMPTS)] for i in range(n_requests))))
+    elapsed = time.perf_counter() - started
+    return {"requests": n_requests, "generated_tokens": tokens, "seconds": round(elapsed, 3),
+            "tokens_per_sec": round(tokens / elapsed, 2)}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compare inline and micro-batched Granite generation.")
+    parser.add_argument("--model", default=os.environ.get("GRANITE_MODEL", "ibm-granite/granite-3.3-2b-instruct"))
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--wait-ms", type=float, default=20.0)
+    args = parser.parse_args(argv)
+
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModelForCausalLM.from_pretrained(args.model)
+    model.eval()
+    # Greedy and no early EOS, so both modes generate the same number of tokens.
+    gen_kwargs = {"do_sample": False, "min_new_tokens": args.max_new_tokens}
+
+    def inline(prompt):
+        inputs = tokenizer(prompt, return_tensors="pt")
+        with torch.no_grad():
+            out = model.generate(**inputs, max_new_tokens=args.max_new_tokens, **gen_kwargs)
+        return out.shape[1] - inputs["input_ids"].shape[1]
+
+    batcher = GraniteBatcher(model, tokenizer, max_batch_size=args.batch_size, max_wait_ms=args.wait_ms)
+
+    def batched(prompt):
+        batcher.generate(prompt, args.max_new_tokens, **gen_kwargs)
+        return args.max_new_tokens
+
+    inline(PROMPTS[0])  # warm-up
+    results = {
+        "model": args.model,
+        "concurrency": args.concurrency,
+        "inline": _run(inline, args.requests, args.concurrency),
+        "batched": _run(batched, args.requests, args.concurrency),
+    }
+    results["batched"]["batches"] = batcher.stats()["batches"]
+    results["speedup"] = round(results["batched"]["tokens_per_sec"] / results["inline"]["tokens_per_sec"], 2)
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
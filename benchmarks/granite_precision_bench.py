@@ -0,0 +1,96 @@
+"""
+Compare Granite CPU precision modes (fp32, bf16, int8) on a fixed drug prompt set.
+
+Each mode is loaded in a fresh process so load time and RSS are not skewed by
+the others. Reports load time, resident memory, tokens/sec and how closely
+each mode's greedy output agrees with fp32.
+
+Usage:
+    python -m benchmarks.granite_precision_bench
+    python -m benchmarks.granite_precision_bench --model /path/to/model --modes fp32 int8
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from typing import Dict, List
+
+DRUGS = ["paracetamol", "ibuprofen", "amoxicillin", "metformin", "warfarin", "omeprazole", "notadrugxyz"]
+
+
+def _rss_mib() -> float:
+    """Current resident set size of this process in MiB."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    import resource
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _measure(model_name: str, precision: str, max_new_tokens: int) -> Dict:
+    """Load one precision mode and generate for every drug. Runs in a child process."""
+    import torch
+    from backend.granite_api import GraniteAPI, drug_prompt
+
+    rss_before = _rss_mib()
+    api = GraniteAPI(model_name, precision=precision, execution="inline")
+    if not api.load():
+        return {"precision": precision, "error": api.error}
+    result = {"precision": precision, "load_seconds": api.load_seconds,
+              "rss_mib": _rss_mib(), "rss_model_mib": round(_rss_mib() - rss_before, 1)}
+
+    outputs: List[List[int]] = []
+    tokens = 0
+    started = time.perf_counter()
+    for drug in DRUGS:
+        inputs = api.tokenizer(drug_prompt(drug), return_tensors="pt")
+        with torch.no_grad():
+            out = api.model.generate(**inputs, max_new_tokens=max_new_tokens, do_sample=False)
+        new = out[0, inputs["input_ids"].shape[1]:].tolist()
+        tokens += len(new)
+        outputs.append(new)
+    elapsed = time.perf_counter() - started
+    result.update({"generated_tokens": tokens, "tokens_per_sec": round(tokens / elapsed, 2), "outputs": outputs})
+    return result
+
+
+def agreement(reference: List[List[int]], candidate: List[List[int]]) -> Dict:
+    """Exact-match rate and token-level agreement of candidate outputs against the reference."""
+    exact = sum(r == c for r, c in zip(reference, candidate))
+    same = total = 0
+    for r, c in zip(reference, candidate):
+        total += max(len(r), len(c))
+        same += sum(a == b for a, b in zip(r, c))
+    return {"exact_match": round(exact / len(reference), 3), "token_agreement": round(same / total, 3) if total else 1.0}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark Granite precision modes on CPU.")
+    parser.add_argument("--model", default=os.environ.get("GRANITE_MODEL", "ibm-granite/granite-3.3-2b-instruct"))
+    parser.add_argument("--modes", nargs="+", default=["fp32", "bf16", "int8"])
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    args = parser.parse_args(argv)
+
+    ctx = multiprocessing.get_context("spawn")
+    results = {}
+    for mode in args.modes:
+        with ctx.Pool(1) as pool:
+            results[mode] = pool.apply(_measure, (args.model, mode, args.max_new_tokens))
+
+    reference = results.get("fp32", {}).get("outputs")
+    for mode, result in results.items():
+        outputs = result.pop("outputs", None)
+        if reference and outputs:
+            result.update(agreement(reference, outputs))
+    print(json.dumps({"model": args.model, "prompts": len(DRUGS), "results": results}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""
+Prefill time per Granite call with and without the prompt-prefix KV cache.
+
+Prefill is measured as a generate() call with max_new_tokens=1, so it covers
+tokenization, the cache copy and the forward pass over the uncached tokens.
+Reports the median per call for the drug template and the MediBot system
+prompt, and checks that greedy output is unchanged by the cache.
+
+Usage:
+    python -m benchmarks.granite_prefix_bench
+    python -m benchmarks.granite_prefix_bench --model /path/to/model --repeat 20
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+from backend.granite_api import drug_prompt, DRUG_PROMPT_PREFIX
+from backend.granite_prefix_cache import PrefixCache
+from backend.prompts import medibot_prompt, MEDIBOT_SYSTEM_PROMPT
+
+DRUGS = ["paracetamol", "ibuprofen", "amoxicillin", "metformin", "warfarin", "omeprazole"]
+QUESTIONS = ["What is the usual adult dose of amoxicillin?", "Is metformin safe with alcohol?",
+             "List common interactions of warfarin."]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Measure prefill time saved by the Granite prefix cache.")
+    parser.add_argument("--model", default=os.environ.get("GRANITE_MODEL", "ibm-granite/granite-3.3-2b-instruct"))
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--check-tokens", type=int, default=32)
+    args = parser.parse_args(argv)
+
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModelForCausalLM.from_pretrained(args.model)
+    model.eval()
+    cache = PrefixCache(model, tokenizer)
+    cache.register(DRUG_PROMPT_PREFIX)
+    cache.register(MEDIBOT_SYSTEM_PROMPT)
+
+    def full_inputs(prompt):
+        # Same token ids as the cached path, just without the cache.
+        inputs = cache.inputs(prompt)
+        inputs.pop("past_key_values", None)
+        return inputs
+
+    def timed(make_inputs, prompt, max_new_tokens=1):
+        started = time.perf_counter()
+        inputs = make_inputs(prompt)
+        with torch.no_grad():
+            out = model.generate(**inputs, max_new_tokens=max_new_tokens, min_new_tokens=max_new_tokens,
+                                 do_sample=False)
+        return time.perf_counter() - started, out[0, inputs["input_ids"].shape[1]:].tolist()
+
+    results = {"model": args.model, "repeat": args.repeat}
+    for label, prompts in (("drug_template", [drug_prompt(d) for d in DRUGS]),
+                           ("medibot", [medibot_prompt(q) for q in QUESTIONS])):
+        timed(full_inputs, prompts[0])  # warm-up
+        full, cached = [], []
+        for _ in range(args.repeat):
+            for prompt in prompts:
+                full.append(timed(full_inputs, prompt)[0])
+                cached.append(timed(cache.inputs, prompt)[0])
+        same = all(timed(full_inputs, p, args.check_tokens)[1] == timed(cache.inputs, p, args.check_tokens)[1]
+                   for p in prompts)
+        full_ms = statistics.median(full) * 1000
+        cached_ms = statistics.median(cached) * 1000
+        prefix = DRUG_PROMPT_PREFIX if label == "drug_template" else MEDIBOT_SYSTEM_PROMPT
+        results[label] = {
+            "prompt_tokens": full_inputs(prompts[0])["input_ids"].shape[1],
+            "prefix_tokens": len(tokenizer(prefix)["input_ids"]),
+            "prefill_ms_full": round(full_ms, 2),
+            "prefill_ms_cached": round(cached_ms, 2),
+            "saved_ms_per_call": round(full_ms - cached_ms, 2),
+            "speedup": round(full_ms / cached_ms, 2) if cached_ms else None,
+            "outputs_identical": same,
+        }
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
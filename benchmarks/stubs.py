@@ -0,0 +1,91 @@
+"""
+Offline stand-ins for the LLM clients so benchmarks never touch the network.
+"""
+import re
+import time
+from typing import Optional, Dict, Any
+
+
+class StubGemini:
+    """
+    Drop-in replacement for GeminiAPI that answers instantly without a network call.
+
+    It counts calls so a benchmark can report how often the code under test
+    would have gone to Gemini.
+    """
+
+    def __init__(self):
+        self.query_calls = 0
+        self.query_drug_calls = 0
+
+    def query(self, prompt: str) -> Optional[str]:
+        self.query_calls += 1
+        return None
+
+    def query_drug(self, drug_name: str) -> Optional[Dict[str, Any]]:
+        self.query_drug_calls += 1
+        return None
+
+
+# Section bodies of the simulated Gemini answer, about as long as real ones
+_SIMULATED_SECTIONS = {
+    "name": "Name: {drug}",
+    "dosage": ("Dosage: Adults: the usual starting dose is 10 mg once daily, increased gradually "
+               "according to response and tolerability, up to a maximum of 40 mg per day. "
+               "Children: 0.2 mg/kg once daily; not recommended under 6 years of age. "
+               "Reduce the dose in moderate renal or hepatic impairment."),
+    "frequency": "Frequency: Once daily, at the same time each day, with or without food.",
+    "interactions": ("Interactions: warfarin, aspirin, clopidogrel, ibuprofen, naproxen, ketoconazole, "
+                     "itraconazole, clarithromycin, rifampicin, carbamazepine, phenytoin, St John's wort, "
+                     "fluconazole, ritonavir, amiodarone, verapamil, diltiazem, alcohol"),
+    "alternatives": ("Alternatives: apixaban, dabigatran, edoxaban, warfarin, enoxaparin, "
+                     "fondaparinux, heparin, aspirin"),
+}
+
+
+class SimulatedGeminiResponse:
+    def __init__(self, payload: Dict[str, Any]):
+        self.status_code = 200
+        self._payload = payload
+        self.text = ""
+
+    def json(self) -> Dict[str, Any]:
+        return self._payload
+
+
+class SimulatedGemini:
+    """
+    Offline stand-in for the Gemini generateContent endpoint (patch it over requests.post).
+
+    Answers with the sections the prompt asks for, stops at maxOutputTokens,
+    reports usageMetadata, and sleeps like a server that streams
+    `ms_per_token` per output token after `first_token_ms`. Tokens are
+    approximated as four characters.
+    """
+
+    def __init__(self, first_token_ms: float = 300.0, ms_per_token: float = 8.0):
+        self.first_token_ms = first_token_ms
+        self.ms_per_token = ms_per_token
+        self.requests = 0
+
+    @staticmethod
+    def tokens(text: str) -> int:
+        return max(1, (len(text) + 3) // 4)
+
+    def post(self, url, json=None, params=None, timeout=None, **kwargs) -> SimulatedGeminiResponse:
+        self.requests += 1
+        prompt = json["contents"][0]["parts"][0]["text"]
+        match = re.search(r"(?:drug |Drug: )'([^']*)'", prompt)
+        drug = match.group(1) if match else "drug"
+        lines = [_SIMULATED_SECTIONS[section].format(drug=drug) for section in _SIMULATED_SECTIONS
+                 if f"\n{section.capitalize()}: (" in prompt]
+        text = "\n".join(lines) + "\n"
+        limit = json.get("generationConfig", {}).get("maxOutputTokens")
+        if limit:
+            text = text[:limit * 4]
+        output_tokens = self.tokens(text)
+        time.sleep((self.first_token_ms + self.ms_per_token * output_tokens) / 1000.0)
+        return SimulatedGeminiResponse({
+            "candidates": [{"content": {"parts": [{"text": text}]}}],
+            "usageMetadata": {"promptTokenCount": self.tokens(prompt), "candidatesTokenCount": output_tokens},
+        })
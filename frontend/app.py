@@ -2,10 +2,51 @@ import streamlit as st
 import requests
 import os
 import time
+import html
+import json
 from datetime import datetime
 
 BACKEND = os.environ.get("BACKEND_URL","http://localhost:8000")
 
+def highlight_spans(text, spans):
+    """Wrap the drug, dosage and frequency offsets returned by /extract in <mark> tags."""
+    marks = {}
+    for s in spans:
+        for field, color in (("name", "#ffe082"), ("dosage", "#c8e6c9"), ("frequency", "#bbdefb")):
+            if s.get(field):
+                marks[tuple(s[field])] = color
+    out, pos = [], 0
+    for (start, end), color in sorted(marks.items()):
+        if start < pos:
+            continue  # overlapping span, keep the first one
+        out.append(html.escape(text[pos:start]))
+        out.append(f"<mark style='background:{color}'>{html.escape(text[start:end])}</mark>")
+        pos = end
+    out.append(html.escape(text[pos:]))
+    return "".join(out).replace("\n", "<br>")
+
+def stream_events(path, payload):
+    """Yield the NDJSON events of a streaming backend endpoint as they arrive."""
+    with requests.post(f"{BACKEND}{path}", json=payload, stream=True) as resp:
+        resp.raise_for_status()
+        for line in resp.iter_lines():
+            if line:
+                yield json.loads(line)
+
+def render_drug_card(slot, drug_info, i, lookup=None):
+    """Render one parsed drug into its placeholder; `lookup` is its 'drug' event once it has arrived."""
+    lookup = lookup or {}
+    slot.markdown(f"""
+    <div class='card animate-fadeIn' style='animation-delay: {0.1 + i*0.1}s;'>
+        <h3>{drug_info.get('name', 'Unknown Drug')}</h3>
+        <p><strong>Dosage:</strong> <span class='hover-highlight'>{drug_info.get('dosage', 'Not specified')}</span></p>
+        <p><strong>Frequency:</strong> <span class='hover-highlight'>{drug_info.get('frequency', 'Not specified')}</span></p>
+        <p><strong>Symptom:</strong> <span class='hover-highlight'>{drug_info.get('symptom', 'Not specified')}</span></p>
+        <p><strong>Recommended dosage:</strong> <span class='hover-highlight'>{lookup.get('dosage', '⏳ loading...')}</span></p>
+        <p><strong>Alternatives:</strong> <span class='hover-highlight'>{', '.join(lookup.get('alternatives', ['⏳ loading...']))}</span></p>
+    </div>
+    """, unsafe_allow_html=True)
+
 st.set_page_config(page_title="MediScan - Drug Recognition", layout="wide", page_icon="💊")
 
 # Initialize session state for authentication and page navigation
@@ -409,32 +450,41 @@ def show_main_app():
                 if not text.strip():
                     st.warning("Please enter prescription text first.")
                 else:
-                    with st.spinner("Parsing prescription..."):
-                        resp = requests.post(f"{BACKEND}/extract", json={"text": text})
-                    if resp.status_code == 200:
-                        data = resp.json()
+                    try:
+                        events = stream_events("/analyze_prescription/stream", {"text": text})
+                        with st.spinner("Parsing prescription..."):
+                            extracted = next(events)
                         st.success("✅ Parsing complete!")
+                        drugs = extracted.get("drugs", [])
                         st.subheader("📋 Parsed (neat text)")
-                        st.code(data.get("plain_text",""), language=None)
-                        
-                        # Display structured data in a more visual way with hover and animation
+                        st.code("\n\n".join(f"Drug: {d['name']}\nDosage: {d['dosage']}\nFrequency: {d['frequency']}" for d in drugs), language=None)
+                        if extracted.get("spans"):
+                            st.subheader("🖍️ Highlighted prescription")
+                            st.markdown(f"<div class='card'>{highlight_spans(text, extracted['spans'])}</div>", unsafe_allow_html=True)
+
+                        # Display structured data in a more visual way; each card fills in as its lookup arrives
                         st.subheader("Structured Data")
-                        structured = data.get("structured", [])
-                        if structured:
-                            for i, drug_info in enumerate(structured):
-                                with st.container():
-                                    st.markdown(f"""
-                                    <div class='card animate-fadeIn' style='animation-delay: {0.1 + i*0.1}s;'>
-                                        <h3>{drug_info.get('name', 'Unknown Drug')}</h3>
-                                        <p><strong>Dosage:</strong> <span class='hover-highlight'>{drug_info.get('dosage', 'Not specified')}</span></p>
-                                        <p><strong>Frequency:</strong> <span class='hover-highlight'>{drug_info.get('frequency', 'Not specified')}</span></p>
-                                        <p><strong>Symptom:</strong> <span class='hover-highlight'>{drug_info.get('symptom', 'Not specified')}</span></p>
-                                    </div>
-                                    """, unsafe_allow_html=True)
-                        
+                        cards = {}
+                        for i, drug_info in enumerate(drugs):
+                            slot = st.empty()
+                            render_drug_card(slot, drug_info, i)
+                            # The backend sends one event per key, whatever spellings share it.
+                            cards.setdefault(drug_info["key"], []).append((i, slot, drug_info))
+                        st.subheader("⚠️ Interactions")
+                        interactions_box = st.container()
+                        with st.spinner("Looking up dosage, alternatives and interactions..."):
+                            for event in events:
+                                if event["event"] == "drug":
+                                    for i, slot, drug_info in cards.get(event["key"], []):
+                                        render_drug_card(slot, drug_info, i, event)
+                                    with interactions_box:
+                                        st.error(f"{event['drug']}: {', '.join(event.get('interactions', []))}")
+                                elif event["event"] == "done" and not event.get("complete", True):
+                                    st.warning("Some lookups took too long; their results are incomplete.")
+
                         st.markdown('<div class="warning-box">⚠️ This is for informational purposes only. Consult a doctor before taking any medicine.</div>', unsafe_allow_html=True)
-                    else:
-                        st.error("Backend error: " + resp.text)
+                    except requests.RequestException as e:
+                        st.error(f"Backend error: {e}")
         with col_clear:
             if st.button("🗑️ Clear", key="clear_btn"):
                 st.rerun()
@@ -479,20 +529,22 @@ def show_main_app():
                 if not drug_list:
                     st.warning("Please enter drug names.")
                 else:
-                    with st.spinner("Checking interactions..."):
-                        r = requests.post(f"{BACKEND}/check_interactions", json={"drugs": drug_list})
-                    if r.status_code == 200:
-                        st.markdown("**⚠️ Interactions:**")
-                        interactions = r.json().get("interactions", {})
-                        if interactions:
-                            for drug_name, inters in interactions.items():
+                    st.markdown("**⚠️ Interactions:**")
+                    try:
+                        found = False
+                        with st.spinner("Checking interactions..."):
+                            for event in stream_events("/check_interactions/stream", {"drugs": drug_list, "age": age}):
+                                if event["event"] != "drug":
+                                    continue
+                                found = True
+                                inters = event.get("interactions", [])
                                 if inters:
-                                    st.error(f"{drug_name}: {', '.join(inters)}")
+                                    st.error(f"{event['drug']}: {', '.join(inters)}")
                                 else:
-                                    st.success(f"{drug_name}: No known interactions")
-                        else:
+                                    st.success(f"{event['drug']}: No known interactions")
+                        if not found:
                             st.info("No interactions found.")
-                    else:
+                    except requests.RequestException:
                         st.error("Error checking interactions.")
     
         with subtabs[2]:
@@ -522,6 +574,9 @@ def show_main_app():
         # Initialize chat history in session state if it doesn't exist
         if 'chat_history' not in st.session_state:
             st.session_state.chat_history = []
+        # The backend keeps the conversation; "" asks it to start a new session.
+        if 'chat_session_id' not in st.session_state:
+            st.session_state.chat_session_id = ""
         
         # Display chat messages
         for message in st.session_state.chat_history:
@@ -540,30 +595,34 @@ def show_main_app():
                 # Add user message to chat history
                 st.session_state.chat_history.append({"role": "user", "content": user_input})
                 
-                # Get context from previous messages (last 3 exchanges)
-                context = "\n".join([f"{msg['role']}: {msg['content']}" for msg in st.session_state.chat_history[-6:] if msg['role'] == 'bot'])
-                
-                # Call backend API
-                with st.spinner("MediBot is thinking..."):
-                    try:
-                        response = requests.post(f"{BACKEND}/chat", json={"message": user_input, "context": context})
-                        if response.status_code == 200:
-                            bot_response = response.json().get("response", "I'm sorry, I couldn't process your request.")
-                            # Add bot response to chat history
-                            st.session_state.chat_history.append({"role": "bot", "content": bot_response})
-                        else:
-                            st.error(f"Error: {response.status_code}")
-                            st.session_state.chat_history.append({"role": "bot", "content": "I'm having trouble connecting to my knowledge base. Please try again later."})
-                    except Exception as e:
-                        st.error(f"Error: {str(e)}")
-                        st.session_state.chat_history.append({"role": "bot", "content": "I'm having trouble processing your request. Please try again later."})
+                # Stream the reply from the backend as it is generated; only the
+                # new message is sent, the session holds the earlier context.
+                reply_slot = st.empty()
+                bot_response = ""
+                try:
+                    for event in stream_events("/chat/stream", {"message": user_input, "session_id": st.session_state.chat_session_id}):
+                        if event["event"] == "token":
+                            bot_response += event["text"]
+                            reply_slot.markdown(f"<div class='chat-message bot'><p class='message-content'>{bot_response}▌</p></div>", unsafe_allow_html=True)
+                        elif event["event"] == "done":
+                            st.session_state.chat_session_id = event.get("session_id", "")
+                    st.session_state.chat_history.append({"role": "bot", "content": bot_response or "I'm sorry, I couldn't process your request."})
+                except Exception as e:
+                    st.error(f"Error: {str(e)}")
+                    st.session_state.chat_history.append({"role": "bot", "content": "I'm having trouble processing your request. Please try again later."})
                 
                 # Clear input
                 st.rerun()
         
         # Clear chat button
         if st.button("Clear Chat", key="clear_chat"):
+            if st.session_state.chat_session_id:
+                try:
+                    requests.delete(f"{BACKEND}/chat/sessions/{st.session_state.chat_session_id}")
+                except requests.RequestException:
+                    pass  # It expires on its own
             st.session_state.chat_history = []
+            st.session_state.chat_session_id = ""
             st.rerun()
             
         st.markdown("<div class='warning-box'>⚠️ MediBot provides general information only. Always consult a healthcare professional for medical advice.</div>", unsafe_allow_html=True)
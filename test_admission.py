@@ -0,0 +1,93 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+import backend.app as backend_app
+from backend.admission import RouteClass, Rejected
+
+
+def test_route_class_queues_then_sheds():
+    async def scenario():
+        route_class = RouteClass("llm", limit=1, queue=1, queue_timeout=0.05, client_share=1.0)
+        await route_class.acquire("a")
+        waiting = asyncio.ensure_future(route_class.acquire("b"))
+        await asyncio.sleep(0)
+        outcomes = []
+        try:
+            await route_class.acquire("c")
+        except Rejected as e:
+            outcomes.append((e.status, e.reason, e.retry_after >= 1))
+        route_class.release("a", 0.1)
+        await waiting  # the freed slot goes to the oldest waiter
+        try:
+            await route_class.acquire("c")
+        except Rejected as e:
+            outcomes.append((e.status, e.reason))
+        return outcomes, route_class.active, len(route_class.waiters)
+
+    outcomes, active, queued = asyncio.run(scenario())
+    assert outcomes == [(503, "queue_full", True), (503, "queue_timeout")]
+    assert active == 1 and queued == 0
+
+
+def test_client_quota_limits_one_client():
+    async def scenario():
+        route_class = RouteClass("llm", limit=4, queue=4, client_share=0.25)
+        await route_class.acquire("greedy")
+        await route_class.acquire("greedy")
+        try:
+            await route_class.acquire("greedy")
+        except Rejected as e:
+            return e.status, route_class.active
+        await route_class.acquire("other")
+
+    assert asyncio.run(scenario()) == (429, 2)
+
+
+def test_queued_requests_count_against_the_client_quota():
+    async def scenario():
+        route_class = RouteClass("llm", limit=2, queue=8, queue_timeout=0.05, client_share=0.25)
+        greedy = [asyncio.ensure_future(route_class.acquire("greedy")) for _ in range(10)]
+        await asyncio.sleep(0)
+        queued = len(route_class.waiters)
+        other = asyncio.ensure_future(route_class.acquire("other"))
+        await asyncio.sleep(0)
+        queued_with_other = len(route_class.waiters)
+        outcomes = [getattr(r, "reason", "admitted") for r in await asyncio.gather(*greedy, return_exceptions=True)]
+        try:
+            await other
+        except Rejected as e:
+            outcomes.append(("other", e.reason))
+        return queued, queued_with_other, outcomes, dict(route_class.clients)
+
+    queued, queued_with_other, outcomes, clients = asyncio.run(scenario())
+    # The quota is ceil(10 * 0.25) = 3: two slots and one place in the queue.
+    assert queued == 1 and queued_with_other == 2
+    assert sorted(outcomes[:10]) == ["admitted"] * 2 + ["client_quota"] * 7 + ["queue_timeout"]
+    # "other" got into the queue and only timed out because nobody released a slot.
+    assert outcomes[10] == ("other", "queue_timeout")
+    # Timed-out waiters no longer count; the two admitted requests still do.
+    assert clients == {"greedy": 2}
+
+
+def test_llm_routes_shed_while_local_routes_keep_answering(monkeypatch):
+    monkeypatch.setitem(backend_app.route_classes, "llm", RouteClass("llm", limit=0, queue=0))
+    client = TestClient(backend_app.app)
+    shed = client.post("/get_dosage", json={"drug": "paracetamol"})
+    assert shed.status_code == 503 and int(shed.headers["retry-after"]) >= 1
+    assert client.post("/calculate_bmi", json={"weight": 70, "height": 175}).status_code == 200
+    assert client.get("/health").status_code == 200
+
+
+def test_forwarded_lookups_have_their_own_class_without_a_client_quota(monkeypatch):
+    monkeypatch.setitem(backend_app.route_classes, "llm", RouteClass("llm", limit=0, queue=0))
+    peer = backend_app.route_classes["peer"]
+    # All of a node's forwards come from its one address; it may use every slot.
+    assert peer.client_quota == peer.limit + peer.queue
+    # Not shed with the llm routes (and 404 here, since no cluster is configured).
+    assert TestClient(backend_app.app).post("/internal/drug", json={"drug": "x"}).status_code == 404
+
+
+if __name__ == "__main__":
+    import pytest
+    raise SystemExit(pytest.main([__file__, "-q"]))
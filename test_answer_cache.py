@@ -0,0 +1,81 @@
+import time
+
+from fastapi.testclient import TestClient
+
+import backend.app as backend_app
+from backend.answer_cache import AnswerCache, question_terms
+
+
+def test_rephrased_questions_share_an_answer():
+    cache = AnswerCache()
+    cache.put("What is the dosage of paracetamol?", "500-1000 mg every 6-8 hours.")
+    assert question_terms("Tylenol dose") == question_terms("what is the dose of acetaminophen")
+    assert cache.get("paracetamol dose?") == "500-1000 mg every 6-8 hours."
+    assert cache.get("Tylenol dosage please") == "500-1000 mg every 6-8 hours."
+    assert cache.get("paracetamol dose for kids") is None
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 1
+
+
+def test_near_duplicates_above_the_threshold_hit_through_the_index():
+    cache = AnswerCache(threshold=0.8)
+    cache.put("Common side effects of metformin in elderly patients with kidney disease", "answer")
+    assert cache.get("metformin side effects for an elderly patient with kidney disease, common ones?") == "answer"
+    assert cache.get("side effects of metformin in elderly patients with kidney disease") == "answer"
+    assert cache.stats()["near_hits"] == 2
+    assert cache.get("metformin side effects in elderly patients") is None
+
+
+def test_drugs_and_numbers_must_match_exactly():
+    cache = AnswerCache(threshold=0.5)
+    cache.put("paracetamol dose for a 5 year old child weighing 18 kg", "15 mg/kg")
+    assert cache.get("paracetamol dose for a 50 year old child weighing 18 kg") is None
+    assert cache.get("ibuprofen dose for a 5 year old child weighing 18 kg") is None
+    assert cache.get("calpol dose for a 5 year old child weighing 18 kg") == "15 mg/kg"
+
+
+def test_the_patient_and_negations_must_match_exactly():
+    cache = AnswerCache(threshold=0.8)
+    cache.put("maximum daily dose of paracetamol for a child with liver disease, fever, headache and nausea", "child")
+    assert cache.get("max daily dose of paracetamol for an adult with liver disease, fever, headache and nausea") is None
+    assert cache.get("max daily dose of paracetamol for a child without liver disease, fever, headache or nausea") is None
+    assert cache.get("paracetamol maximum dose per day for children with liver disease, fever, headache, nausea") == "child"
+
+
+def test_unknown_drugs_must_match_exactly():
+    cache = AnswerCache(threshold=0.8)
+    cache.put("rivaroxaban dose twice a day for atrial fibrillation in elderly patients with kidney disease", "rivaroxaban")
+    assert cache.get("dabigatran dose twice a day for atrial fibrillation in elderly patients with kidney disease") is None
+    assert cache.get("rivaroxaban dosing twice daily for atrial fibrillation in elderly patient with kidney disease") == "rivaroxaban"
+
+
+def test_answers_expire_and_are_evicted():
+    cache = AnswerCache(ttl=0.05, max_entries=2)
+    cache.put("warfarin interactions", "a")
+    time.sleep(0.1)
+    assert cache.get("warfarin interactions") is None
+    for drug in ("aspirin", "ibuprofen", "metformin"):
+        cache.put(f"{drug} alternatives", drug)
+    assert cache.stats()["entries"] == 2 and cache.get("aspirin alternatives") is None
+
+
+def test_chat_serves_cached_answers_only_without_context(monkeypatch):
+    calls = []
+
+    def query(prompt):
+        calls.append(prompt)
+        return "Up to 4 g a day."
+
+    monkeypatch.setattr(backend_app, "answer_cache", AnswerCache())
+    monkeypatch.setattr(backend_app.llm_api, "query", query)
+    client = TestClient(backend_app.app)
+    assert client.post("/chat", json={"message": "max dose of paracetamol"}).json()["backend"] != "cache"
+    assert client.post("/chat", json={"message": "Panadol maximum dose?"}).json() == {
+        "response": "Up to 4 g a day.", "backend": "cache"}
+    client.post("/chat", json={"message": "Panadol maximum dose?", "cache": False})
+    client.post("/chat", json={"message": "Panadol maximum dose?", "context": "user: I have liver disease"})
+    assert len(calls) == 3
+
+
+if __name__ == "__main__":
+    import pytest
+    raise SystemExit(pytest.main([__file__, "-q"]))
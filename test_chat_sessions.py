@@ -0,0 +1,96 @@
+import json
+import time
+
+from fastapi.testclient import TestClient
+
+import backend.app as backend_app
+from backend.chat_sessions import ChatSessionStore, estimate_tokens
+
+
+def _wait_for(condition, timeout=2.0):
+    stop = time.monotonic() + timeout
+    while not condition() and time.monotonic() < stop:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_context_stays_within_budget_as_the_conversation_grows():
+    prompts = []
+
+    def summarize(prompt):
+        prompts.append(prompt)
+        return "User takes warfarin 5 mg and asked about ibuprofen."
+
+    store = ChatSessionStore(summarize=summarize, context_tokens=200, summary_tokens=50, summary_every=60)
+    session = store.open()
+    sizes = []
+    for turn in range(40):
+        store.record(session, f"Question {turn} about warfarin and ibuprofen doses?", "An answer " * 12)
+        sizes.append(estimate_tokens(store.context(session)))
+    assert max(sizes) <= 200 + 10
+    assert _wait_for(lambda: store.stats()["summaries"] > 0)
+    context = store.context(session)
+    assert context.startswith("Summary of earlier conversation: User takes warfarin")
+    assert "Question 39" in context and "Question 0 " not in context
+    # The summary prompt carries the previous summary forward.
+    assert _wait_for(lambda: any("User takes warfarin" in p for p in prompts[1:]))
+
+
+def test_failed_summaries_fall_back_to_truncation():
+    store = ChatSessionStore(summarize=lambda prompt: None, context_tokens=120, summary_tokens=40, summary_every=30)
+    session = store.open()
+    for turn in range(10):
+        store.record(session, f"message {turn}", "reply " * 10)
+    assert _wait_for(lambda: store.stats()["summary_failures"] > 0)
+    assert _wait_for(lambda: session.summary and not session.summarizing)
+    assert estimate_tokens(session.summary) <= 40 + 1
+
+
+def test_sessions_expire_and_ids_are_issued_by_the_server():
+    store = ChatSessionStore(ttl=0.05, max_sessions=2)
+    first = store.open("chosen-by-client")
+    assert first.id != "chosen-by-client"
+    assert store.open(first.id) is first
+    time.sleep(0.1)
+    assert store.open(first.id) is not first
+    store.open(), store.open()
+    assert store.stats()["sessions"] == 2
+
+
+def test_chat_endpoint_sends_session_context_instead_of_client_history(monkeypatch):
+    prompts = []
+
+    def query(prompt):
+        prompts.append(prompt)
+        return f"Reply {len(prompts)}"
+
+    monkeypatch.setattr(backend_app, "chat_sessions", ChatSessionStore())
+    monkeypatch.setattr(backend_app, "answer_cache", None)
+    monkeypatch.setattr(backend_app.llm_api, "query", query)
+    client = TestClient(backend_app.app)
+    first = client.post("/chat", json={"message": "I take metformin.", "session_id": ""}).json()
+    assert first["response"] == "Reply 1" and first["session_id"]
+    second = client.post("/chat", json={"message": "Can I drink alcohol?", "session_id": first["session_id"]}).json()
+    assert second["session_id"] == first["session_id"]
+    assert "user: I take metformin.\nbot: Reply 1" in prompts[1]
+    assert client.delete(f"/chat/sessions/{first['session_id']}").status_code == 200
+    assert client.delete(f"/chat/sessions/{first['session_id']}").status_code == 404
+    # Without a session_id the client's own context is used, as before.
+    client.post("/chat", json={"message": "hi", "context": "bot: earlier"})
+    assert "bot: earlier" in prompts[-1]
+
+
+def test_chat_stream_records_the_reply_in_the_session(monkeypatch):
+    monkeypatch.setattr(backend_app, "chat_sessions", ChatSessionStore())
+    monkeypatch.setattr(backend_app, "answer_cache", None)
+    monkeypatch.setattr(backend_app, "granite_api", None)
+    monkeypatch.setattr(backend_app, "_query_with_backend", lambda prompt: ("Take it with food.", "gemini"))
+    response = TestClient(backend_app.app).post("/chat/stream", json={"message": "Metformin?", "session_id": ""})
+    done = [json.loads(line) for line in response.text.splitlines() if line][-1]
+    session = backend_app.chat_sessions.open(done["session_id"])
+    assert session.turns == [("user", "Metformin?"), ("bot", "Take it with food.")]
+
+
+if __name__ == "__main__":
+    import pytest
+    raise SystemExit(pytest.main([__file__, "-q"]))
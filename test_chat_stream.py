@@ -0,0 +1,106 @@
+import asyncio
+import json
+
+from fastapi.testclient import TestClient
+
+import backend.app as backend_app
+from backend.answer_cache import AnswerCache
+from backend.chat_sessions import ChatSessionStore
+
+
+class StreamingGranite:
+    def __init__(self):
+        self.cancel = None
+
+    def is_ready(self):
+        return True
+
+    def stream_query(self, prompt, cancel=None):
+        self.cancel = cancel
+        yield "Paracetamol "
+        yield "is safe."
+
+
+def _events(response):
+    return [json.loads(line) for line in response.text.splitlines() if line]
+
+
+def test_chat_stream_yields_granite_tokens():
+    granite = StreamingGranite()
+    original, backend_app.granite_api = backend_app.granite_api, granite
+    try:
+        response = TestClient(backend_app.app).post("/chat/stream", json={"message": "Is paracetamol safe?"})
+    finally:
+        backend_app.granite_api = original
+    events = _events(response)
+    assert [e["text"] for e in events if e["event"] == "token"] == ["Paracetamol ", "is safe."]
+    assert events[-1]["event"] == "done" and events[-1]["backend"] == "granite"
+    assert events[-1]["ttft_ms"] is not None
+    # The generation is told to stop once the response is over.
+    assert granite.cancel.is_set()
+
+
+def test_chat_stream_falls_back_to_router(monkeypatch):
+    monkeypatch.setattr(backend_app, "granite_api", None)
+    monkeypatch.setattr(backend_app, "_query_with_backend", lambda prompt: ("Hello from Gemini.", "gemini"))
+    response = TestClient(backend_app.app).post("/chat/stream", json={"message": "hi"},
+                                                 headers={"accept": "text/event-stream"})
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert 'data: {"event": "token", "text": "Hello from Gemini."}' in response.text
+    assert "event: done" in response.text
+
+
+def _on_event_loop():
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+class LoopCheckingStore(ChatSessionStore):
+    """Records, per call, whether it ran on the event loop thread."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    def open(self, session_id):
+        self.calls.append(("open", _on_event_loop()))
+        return super().open(session_id)
+
+    def record(self, session, message, reply):
+        self.calls.append(("record", _on_event_loop()))
+        return super().record(session, message, reply)
+
+
+class LoopCheckingCache(AnswerCache):
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    def get(self, question):
+        self.calls.append(("get", _on_event_loop()))
+        return super().get(question)
+
+    def put(self, question, answer):
+        self.calls.append(("put", _on_event_loop()))
+        return super().put(question, answer)
+
+
+def test_chat_stream_uses_the_session_store_and_cache_off_the_event_loop(monkeypatch):
+    store, cache = LoopCheckingStore(), LoopCheckingCache()
+    monkeypatch.setattr(backend_app, "chat_sessions", store)
+    monkeypatch.setattr(backend_app, "answer_cache", cache)
+    monkeypatch.setattr(backend_app, "granite_api", None)
+    monkeypatch.setattr(backend_app, "_query_with_backend", lambda prompt: ("Take it with food.", "gemini"))
+    client = TestClient(backend_app.app)
+    client.post("/chat/stream", json={"message": "Metformin?", "session_id": ""})
+    client.post("/chat/stream", json={"message": "Metformin?"})
+    assert store.calls == [("open", False), ("record", False)]
+    assert cache.calls == [("get", False), ("put", False), ("get", False)]
+
+
+if __name__ == "__main__":
+    import pytest
+    raise SystemExit(pytest.main([__file__, "-q"]))
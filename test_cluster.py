@@ -0,0 +1,117 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+
+import pytest
+import requests
+
+from backend import cluster
+from backend.cluster import HashRing
+
+# One node: the real app, with the LLM router swapped for a backend that
+# answers with the port of the node that did the lookup.
+NODE = """
+import os, sys, uvicorn
+import backend.app as app
+
+class Backend:
+    def query_drug_fields(self, drug_name, fields):
+        return dict({f: f"{f} from {os.environ['PORT']}" for f in fields}, name=drug_name, is_recognized=True)
+
+    def query_drug(self, drug_name):
+        return self.query_drug_fields(drug_name, ("name", "dosage", "frequency", "interactions", "alternatives"))
+
+app.drug_lookup.backend = Backend()
+uvicorn.run(app.app, host="127.0.0.1", port=int(os.environ["PORT"]), log_level="warning")
+"""
+
+DRUGS = ["rivaroxaban", "gabapentin", "montelukast", "doxycycline", "pregabalin", "ondansetron", "edoxaban",
+         "tapentadol", "loratadine", "fexofenadine", "naproxen", "diclofenac"]
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start(port, peers):
+    env = dict(os.environ, PORT=str(port), CLUSTER_PEERS=",".join(peers), CLUSTER_SELF=f"http://127.0.0.1:{port}",
+               CLUSTER_TOKEN="secret", CLUSTER_PEER_COOLDOWN="30", GEMINI_API_KEY="", SHARED_CACHE_URL="")
+    return subprocess.Popen([sys.executable, "-c", NODE], env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+def _wait_until_up(url, timeout=30.0):
+    stop = time.monotonic() + timeout
+    while time.monotonic() < stop:
+        try:
+            return requests.get(url + "/health", timeout=1)
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not start")
+
+
+def test_ring_spreads_keys_and_moves_few_when_a_node_leaves():
+    nodes = [f"http://node{i}:8000" for i in range(4)]
+    ring = HashRing(nodes)
+    keys = [f"drug{i}" for i in range(4000)]
+    owners = {k: ring.owner(k) for k in keys}
+    assert min(Counter(owners.values()).values()) > 600
+    smaller = HashRing(nodes[:3])
+    moved = [k for k in keys if smaller.owner(k) != owners[k]]
+    # Only the keys of the node that left move.
+    assert all(owners[k] == nodes[3] for k in moved)
+
+
+def test_peer_routing_stays_off_without_a_token(monkeypatch):
+    monkeypatch.setattr(cluster, "CLUSTER_PEERS", ["http://node0:8000", "http://node1:8000"])
+    monkeypatch.setattr(cluster, "CLUSTER_SELF", "http://node0:8000")
+    monkeypatch.setattr(cluster, "CLUSTER_TOKEN", "")
+    assert cluster.from_env(object()) is None
+    monkeypatch.setattr(cluster, "CLUSTER_TOKEN", "secret")
+    assert cluster.from_env(object()).token == "secret"
+
+
+@pytest.fixture
+def nodes():
+    ports = [_free_port() for _ in range(3)]
+    urls = [f"http://127.0.0.1:{p}" for p in ports]
+    processes = [_start(p, urls) for p in ports]
+    try:
+        for url in urls:
+            _wait_until_up(url)
+        yield urls, processes
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+
+
+def test_lookups_go_to_the_owner_and_fall_back_when_it_is_down(nodes):
+    urls, processes = nodes
+    ring = HashRing(urls)
+    for drug in DRUGS:
+        # Whichever node is asked, the owner does the lookup.
+        for url in urls:
+            dosage = requests.post(url + "/get_dosage", json={"drug": drug, "age": 30}).json()["dosage"]
+            assert dosage == f"dosage from {ring.owner(drug).rsplit(':', 1)[1]}"
+    # Each drug was fetched once in the whole cluster, then served from the owner's cache.
+    health = [requests.get(url + "/health").json() for url in urls]
+    assert sum(h["drug_cache"]["misses"] for h in health) == len(DRUGS)
+    assert sum(p["forwarded"] for h in health for p in h["cluster"]["peers"].values()) == 2 * len(DRUGS)
+    assert requests.post(urls[0] + "/internal/drug", json={"drug": "x"}).status_code == 403
+
+    processes[2].terminate()
+    processes[2].wait(timeout=10)
+    orphan = next(d for d in DRUGS if ring.owner(d) == urls[2])
+    dosage = requests.post(urls[0] + "/get_dosage", json={"drug": orphan, "age": 30}).json()["dosage"]
+    assert dosage == f"dosage from {urls[0].rsplit(':', 1)[1]}"
+    assert requests.get(urls[0] + "/health").json()["cluster"]["peers"][urls[2]]["down"]
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,84 @@
+import time
+
+from fastapi.testclient import TestClient
+
+import backend.app as backend_app
+import backend.gemini_api as gemini_module
+from backend import deadline
+from backend.drug_cache import DrugInfoCache, CachedDrugLookup
+from backend.llm_router import LLMRouter
+
+
+class FakeResponse:
+    status_code = 200
+    text = ""
+
+    def json(self):
+        return {"candidates": [{"content": {"parts": [{"text": "Dosage: 10 mg daily\n"}]}}]}
+
+
+def test_deadline_header_caps_the_gemini_timeout(monkeypatch):
+    timeouts = []
+
+    def fake_post(url, timeout=None, **kwargs):
+        timeouts.append(timeout)
+        return FakeResponse()
+
+    monkeypatch.setattr(gemini_module.requests, "post", fake_post)
+    monkeypatch.setattr(backend_app.gemini_api, "api_key", "key")
+    backend_app.drug_cache.clear()
+    client = TestClient(backend_app.app)
+    response = client.post("/get_dosage", json={"drug": "rivaroxaban"}, headers={"X-Deadline-Ms": "1500"})
+    assert response.json()["dosage"] == "10 mg daily"
+    assert 0 < timeouts[0] <= 1.5
+    # No time left: the upstream call is not made at all.
+    backend_app.drug_cache.clear()
+    client.post("/get_dosage", json={"drug": "rivaroxaban"}, headers={"X-Deadline-Ms": "0"})
+    assert len(timeouts) == 1
+
+
+class SlowBackend:
+    def __init__(self, seconds, answer="fresh"):
+        self.seconds = seconds
+        self.answer = answer
+        self.calls = 0
+
+    def query_drug(self, drug_name):
+        self.calls += 1
+        time.sleep(self.seconds)
+        return {"name": drug_name, "is_recognized": True, "dosage": self.answer}
+
+    def query_drug_fields(self, drug_name, fields):
+        return self.query_drug(drug_name)
+
+
+def test_router_gives_up_at_the_deadline():
+    router = LLMRouter({"slow": SlowBackend(1.0)}, hedge=False)
+    started = time.perf_counter()
+    with deadline.within(0.1):
+        assert router.query_drug("x") is None
+    assert time.perf_counter() - started < 0.5
+
+
+def test_stale_records_are_served_at_once_and_refreshed_in_the_background():
+    cache = DrugInfoCache(ttl=0.05, stale_ttl=60)
+    cache.merge("x", {"name": "x", "is_recognized": True, "dosage": "old"}, ["dosage"])
+    time.sleep(0.06)
+    backend = SlowBackend(0.2)
+    api = CachedDrugLookup(backend, cache)
+    started = time.perf_counter()
+    assert api.query_drug_fields("x", ["dosage"])["dosage"] == "old"
+    assert api.query_drug_fields("x", ["dosage"])["dosage"] == "old"
+    assert time.perf_counter() - started < 0.1
+    assert api.stats()["stale_hits"] == 2
+    give_up = time.time() + 2
+    while api.refreshes == 0 and time.time() < give_up:
+        time.sleep(0.01)
+    # One refresh for both stale hits.
+    assert backend.calls == 1
+    assert cache.lookup("x", ["dosage"])[0]["dosage"] == "fresh"
+
+
+if __name__ == "__main__":
+    import pytest
+    raise SystemExit(pytest.main([__file__, "-q"]))
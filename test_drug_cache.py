@@ -0,0 +1,87 @@
+import backend.gemini_api as gemini_module
+from backend.drug_cache import DrugInfoCache, CachedDrugLookup
+from backend.drug_logic import get_dosage, suggest_alternatives
+from backend.gemini_api import GeminiAPI
+from backend.granite_api import drug_info_complete, DRUG_PROMPT_PREFIX
+from backend.prompts import drug_fields_prefix, drug_fields_prompt
+
+
+class FieldBackend:
+    """Answers field queries from a fixed record and remembers what was asked."""
+
+    def __init__(self):
+        self.asked = []
+
+    def query_drug_fields(self, drug_name, fields):
+        self.asked.append(tuple(fields))
+        record = {"name": drug_name, "is_recognized": True, "dosage": "10 mg daily", "frequency": "daily",
+                  "interactions": ["aspirin"], "alternatives": ["apixaban"]}
+        return {k: v for k, v in record.items() if k in fields or k in ("name", "is_recognized")}
+
+    def query_drug(self, drug_name):
+        self.asked.append("full")
+        return self.query_drug_fields(drug_name, ("name", "dosage", "frequency", "interactions", "alternatives"))
+
+
+def test_partial_records_are_completed_field_by_field():
+    backend = FieldBackend()
+    api = CachedDrugLookup(backend, DrugInfoCache())
+    assert get_dosage("Rivaroxaban", 30, api) == "10 mg daily"
+    assert suggest_alternatives("rivaroxaban", 30, api) == ["apixaban"]
+    assert api.query_drug_fields("RIVAROXABAN", ["dosage", "alternatives"])["alternatives"] == ["apixaban"]
+    assert api.last_backend() == "cache"
+    # The full record only fetches the sections that are still missing.
+    record = api.query_drug_fields("rivaroxaban", ["name", "dosage", "frequency", "interactions", "alternatives"])
+    assert backend.asked == [("dosage",), ("alternatives",), ("name", "frequency", "interactions")]
+    assert record["interactions"] == ["aspirin"] and record["dosage"] == "10 mg daily"
+    assert api.query_drug("rivaroxaban") == record and len(backend.asked) == 3
+
+
+def test_unknown_medication_counts_as_complete_and_sections_expire():
+    cache = DrugInfoCache(ttl=60)
+    cache.merge("xyz", {"name": "xyz", "is_recognized": False}, ["dosage"])
+    assert cache.get("xyz", ["interactions"])["is_recognized"] is False
+    expired = DrugInfoCache(ttl=-1)
+    expired.merge("abc", {"name": "abc", "is_recognized": True, "dosage": "5 mg"}, ["dosage"])
+    assert expired.get("abc", ["dosage"]) is None and expired.missing("abc", ["dosage"]) == ("dosage",)
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, text):
+        self.text = text
+
+    def json(self):
+        return {"candidates": [{"content": {"parts": [{"text": self.text}]}}],
+                "usageMetadata": {"promptTokenCount": 50, "candidatesTokenCount": 12}}
+
+
+def test_gemini_field_query_caps_output_and_returns_only_those_fields(monkeypatch):
+    sent = []
+
+    def fake_post(url, json=None, params=None, timeout=None):
+        sent.append(json)
+        return FakeResponse("Dosage: 10 mg once daily\n")
+
+    monkeypatch.setattr(gemini_module.requests, "post", fake_post)
+    gemini = GeminiAPI(api_key="key", model="gemini-2.5-flash")
+    result = gemini.query_drug_fields("rivaroxaban", ["dosage"])
+    assert result == {"name": "rivaroxaban", "dosage": "10 mg once daily", "is_recognized": True}
+    prompt = sent[0]["contents"][0]["parts"][0]["text"]
+    assert "Dosage: (" in prompt and "Interactions: (" not in prompt
+    assert sent[0]["generationConfig"] == {"maxOutputTokens": 144, "thinkingConfig": {"thinkingBudget": 0}}
+    assert gemini.usage_stats() == {"requests": 1, "prompt_tokens": 50, "output_tokens": 12}
+
+
+def test_field_prompts_and_stopping():
+    assert drug_fields_prefix() == DRUG_PROMPT_PREFIX
+    assert drug_fields_prompt("x", ["alternatives", "dosage"]).index("Dosage") < \
+        drug_fields_prompt("x", ["alternatives", "dosage"]).index("Alternatives")
+    assert drug_info_complete("Dosage: 10 mg\n\n", sections=("dosage",))
+    assert not drug_info_complete("Dosage: 10 mg\n\n")
+
+
+if __name__ == "__main__":
+    import pytest
+    raise SystemExit(pytest.main([__file__, "-q"]))
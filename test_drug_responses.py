@@ -0,0 +1,58 @@
+import json
+
+from fastapi.testclient import TestClient
+
+import backend.app as backend_app
+import backend.responses as responses
+from backend.drug_logic import _drug_db, get_dosage
+from backend.drug_responses import LocalDrugResponses
+from backend.responses import json_bytes, not_modified
+
+
+def test_prerendered_dosages_match_get_dosage():
+    local = LocalDrugResponses()
+    assert len(local) == len(_drug_db)
+    for name in _drug_db:
+        for age in (0, 5, 17, 18, 65):
+            assert json.loads(local.dosage(name.upper(), age).body) == {"dosage": get_dosage(name, age)}
+    assert local.dosage("rivaroxaban", 30) is None
+
+
+def test_etags_change_with_the_database():
+    db = {"aspirin": dict(_drug_db["aspirin"])}
+    before = LocalDrugResponses(db).record("aspirin").etag
+    db["ibuprofen"] = _drug_db["ibuprofen"]
+    assert LocalDrugResponses(db).record("aspirin").etag != before
+
+
+def test_json_bytes_with_and_without_orjson(monkeypatch):
+    content = {"dosage": "10-15 mg/kg", "names": ["café", "β-blocker"], "n": 1.5}
+    fast = json_bytes(content)
+    monkeypatch.setattr(responses, "orjson", None)
+    assert json_bytes(content) == fast == json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
+    assert json_bytes({1: "a"}) == b'{"1":"a"}'
+
+
+def test_if_none_match():
+    assert not_modified('"a", W/"b"', '"b"') and not_modified("*", '"x"')
+    assert not not_modified('"a"', '"b"') and not not_modified(None, '"b"')
+
+
+def test_drug_routes_send_etags_and_304(monkeypatch):
+    client = TestClient(backend_app.app)
+    first = client.get("/drugs/Warfarin")
+    assert first.status_code == 200 and first.json()["name"] == "warfarin"
+    assert first.headers["cache-control"] == "public, max-age=3600"
+    again = client.get("/drugs/warfarin", headers={"if-none-match": first.headers["etag"]})
+    assert again.status_code == 304 and again.content == b""
+    dosage = client.get("/drugs/paracetamol/dosage", params={"age": 8})
+    assert dosage.json() == client.post("/get_dosage", json={"drug": "paracetamol", "age": 8}).json()
+    # Drugs outside the local database come from the LLM and must be revalidated.
+    monkeypatch.setattr(backend_app, "_drug_with_backend", lambda name: ({"name": name, "dosage": "20 mg"}, "gemini"))
+    other = client.get("/drugs/rivaroxaban")
+    assert other.json()["source"] == "gemini" and other.headers["cache-control"] == "no-cache"
+
+
+if __name__ == "__main__":
+    import pytest
+    raise SystemExit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,28 @@
+from benchmarks.corpus import generate_corpus
+from benchmarks.extraction_bench import run_benchmark, compare_to_baseline
+
+
+def test_corpus_labels_match_text():
+    corpus = generate_corpus(n_docs=30, seed=1)
+    assert corpus == generate_corpus(n_docs=30, seed=1)
+    for doc in corpus:
+        for label in doc["drugs"]:
+            assert doc["text"][label["start"]:label["end"]].lower() == label["name"]
+
+
+def test_benchmark_offline_and_gated():
+    results = run_benchmark(generate_corpus(n_docs=20, seed=3), repeat=1)
+    assert 0 < results["recall"] <= 1
+    assert results["sentences_per_sec"] > 0
+
+    assert compare_to_baseline(results, dict(results)) == []
+    slower = dict(results, latency_p99_ms=results["latency_p99_ms"] / 2, recall=results["recall"] + 0.1)
+    regressions = compare_to_baseline(results, slower, threshold=0.25)
+    assert any(r.startswith("latency_p99_ms") for r in regressions)
+    assert any(r.startswith("recall") for r in regressions)
+
+
+if __name__ == "__main__":
+    test_corpus_labels_match_text()
+    test_benchmark_offline_and_gated()
+    print("ok")
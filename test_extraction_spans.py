@@ -0,0 +1,33 @@
+from backend.models import extract_drug_info, extract_drug_spans
+from benchmarks.corpus import generate_corpus
+
+
+def test_spans_materialize_to_extract_drug_info():
+    for doc in generate_corpus(n_docs=50, seed=9):
+        mentions = extract_drug_spans(doc["text"])
+        assert [m.to_dict() for m in mentions] == extract_drug_info(doc["text"])
+
+
+def test_spans_point_into_original_text():
+    text = "Fever.\nTake Paracetamol 500 mg\ntwice daily."
+    mention = [m for m in extract_drug_spans(text) if m.text("name") == "Paracetamol"][0]
+    offsets = mention.offsets()
+    assert text[slice(*offsets["name"])] == "Paracetamol"
+    assert text[slice(*offsets["dosage"])] == "500 mg"
+    assert text[slice(*offsets["frequency"])] == "twice daily"
+    assert text[slice(*offsets["condition"])] == "Fever"
+    assert offsets["provenance"]["dosage"] == "near"
+
+
+def test_values_read_as_extract_drug_info_across_newlines():
+    text = "Take Paracetamol 500\nmg twice\ndaily."
+    (mention,) = [m for m in extract_drug_spans(text) if m.text("name") == "Paracetamol"]
+    assert mention.text("dosage") == "500 mg" and mention.text("frequency") == "twice daily"
+    assert text[slice(*mention.offsets()["dosage"])] == "500\nmg"
+
+
+if __name__ == "__main__":
+    test_spans_materialize_to_extract_drug_info()
+    test_spans_point_into_original_text()
+    test_values_read_as_extract_drug_info_across_newlines()
+    print("ok")
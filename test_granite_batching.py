@@ -0,0 +1,74 @@
+import threading
+
+import torch
+
+from backend.granite_batching import GraniteBatcher
+
+PAD, EOS = 0, 3
+
+
+class CharTokenizer:
+    """One token per character; records the threads it is called from."""
+    pad_token_id = PAD
+    eos_token_id = EOS
+
+    def __init__(self):
+        self.threads = set()
+
+    def __call__(self, text):
+        self.threads.add(threading.current_thread().name)
+        if text == "bad":
+            raise ValueError("cannot tokenize")
+        return {"input_ids": [ord(c) for c in text]}
+
+    def decode(self, ids, skip_special_tokens=False):
+        return "".join(chr(int(i)) for i in ids if not (skip_special_tokens and int(i) in (PAD, EOS)))
+
+
+class RepeatModel:
+    """Stub LM: each row generates its last prompt token over and over."""
+
+    def __init__(self):
+        self.batches = []
+
+    def generate(self, input_ids, attention_mask, max_new_tokens, pad_token_id, stopping_criteria, **kwargs):
+        self.batches.append((input_ids.clone(), attention_mask.clone(), kwargs))
+        new = input_ids[:, -1:].repeat(1, max_new_tokens)
+        return torch.cat([input_ids, new], dim=1)
+
+
+def test_concurrent_prompts_share_one_left_padded_batch():
+    tokenizer, model = CharTokenizer(), RepeatModel()
+    batcher = GraniteBatcher(model, tokenizer, max_batch_size=8, max_wait_ms=200)
+    futures = [batcher.submit(p, n) for p, n in (("ab", 3), ("wxyz", 5), ("q", 1))]
+    assert [f.result(5) for f in futures] == ["bbb", "zzzzz", "q"]
+    (input_ids, attention_mask, _), = model.batches
+    assert input_ids.tolist() == [[PAD, PAD, 97, 98], [119, 120, 121, 122], [PAD, PAD, PAD, 113]]
+    assert attention_mask.tolist() == [[0, 0, 1, 1], [1, 1, 1, 1], [0, 0, 0, 1]]
+    assert batcher.stats()["batches"] == 1 and batcher.stats()["requests"] == 3
+    # Only the scheduler thread tokenizes.
+    assert tokenizer.threads == {"granite-batcher"}
+
+
+def test_other_settings_or_an_over_budget_prompt_carry_over_to_the_next_batch():
+    model = RepeatModel()
+    batcher = GraniteBatcher(model, CharTokenizer(), max_batch_size=8, max_batch_tokens=20, max_wait_ms=200)
+    futures = [batcher.submit("a", 2, temperature=0.7), batcher.submit("b", 2, temperature=0.1),
+               batcher.submit("c", 2, temperature=0.1), batcher.submit("d" * 12, 2, temperature=0.1)]
+    assert [f.result(5) for f in futures] == ["aa", "bb", "cc", "dd"]
+    rows = [(len(ids), kwargs) for ids, _, kwargs in model.batches]
+    assert rows == [(1, {"temperature": 0.7}), (2, {"temperature": 0.1}), (1, {"temperature": 0.1})]
+
+
+def test_a_prompt_that_fails_to_tokenize_only_fails_its_own_future():
+    batcher = GraniteBatcher(RepeatModel(), CharTokenizer(), max_wait_ms=50)
+    bad, good = batcher.submit("bad", 2), batcher.submit("ok", 2)
+    assert good.result(5) == "kk"
+    assert isinstance(bad.exception(5), ValueError)
+
+
+if __name__ == "__main__":
+    test_concurrent_prompts_share_one_left_padded_batch()
+    test_other_settings_or_an_over_budget_prompt_carry_over_to_the_next_batch()
+    test_a_prompt_that_fails_to_tokenize_only_fails_its_own_future()
+    print("ok")
@@ -0,0 +1,81 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import torch
+
+from backend.granite_pool import GranitePool, PoolBusy
+
+
+class CharTokenizer:
+    """One token per character, token id = code point."""
+
+    def __call__(self, text, return_tensors=None):
+        ids = torch.tensor([[ord(c) for c in text]])
+        return {"input_ids": ids, "attention_mask": torch.ones_like(ids)}
+
+    def decode(self, ids, skip_special_tokens=False):
+        return "".join(chr(int(i)) for i in ids)
+
+
+class UpperModel:
+    """Stub model answering with the prompt in upper case; the prompt "crash" kills its process."""
+
+    def share_memory(self):
+        return self
+
+    def generate(self, input_ids, attention_mask=None, max_new_tokens=8, **kwargs):
+        prompt = "".join(chr(int(i)) for i in input_ids[0])
+        if prompt == "crash":
+            os._exit(9)
+        if prompt == "slow":
+            time.sleep(0.5)
+        return torch.cat([input_ids, torch.tensor([[ord(c) for c in prompt.upper()]])], dim=1)
+
+
+@pytest.fixture
+def pool():
+    pool = GranitePool("stub", UpperModel(), CharTokenizer(), workers=1, threads=1, max_pending=2,
+                       prefix_cache=False)
+    pool.wait_ready(timeout=60)
+    yield pool
+    pool.close()
+
+
+def test_requests_are_answered_by_the_workers(pool):
+    assert pool.generate("hello", 8, timeout=10) == "HELLO"
+    assert pool.stats()["completed"] == 1 and pool.stats()["pending"] == 0
+
+
+def test_pending_requests_beyond_the_limit_are_rejected(pool):
+    slow = [pool.submit("slow", 8), pool.submit("slow", 8)]
+    with pytest.raises(PoolBusy):
+        pool.submit("x", 8)
+    assert [f.result(10) for f in slow] == ["SLOW", "SLOW"]
+
+
+def test_counters_add_up_under_concurrent_submits(pool):
+    def submit(i):
+        try:
+            return pool.submit(f"p{i}", 8)
+        except PoolBusy:
+            return None
+
+    with ThreadPoolExecutor(8) as executor:
+        futures = [f for f in executor.map(submit, range(400)) if f is not None]
+    for future in futures:
+        future.result(10)
+    stats = pool.stats()
+    assert stats["submitted"] == len(futures) == stats["completed"]
+    assert stats["submitted"] + stats["rejected"] == 400
+
+
+def test_a_dead_worker_fails_its_requests_and_is_replaced(pool):
+    # More crashes than slots: each one must give its slot back.
+    for _ in range(pool.max_pending + 1):
+        with pytest.raises(RuntimeError, match="exited with code 9"):
+            pool.generate("crash", 8, timeout=60)
+    assert pool.generate("after", 8, timeout=60) == "AFTER"
+    stats = pool.stats()
+    assert stats["restarted"] == pool.max_pending + 1 and stats["pending"] == 0 and stats["alive"] == 1
@@ -0,0 +1,64 @@
+import torch
+import transformers
+
+from backend.granite_api import GraniteAPI, READY, FAILED
+
+
+class TinyModel(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.proj = torch.nn.Linear(4, 4)
+
+
+def stub_from_pretrained(monkeypatch):
+    """Make the transformers loaders return a tiny model and record the kwargs they got."""
+    calls = []
+
+    def load_model(name, **kwargs):
+        calls.append(kwargs)
+        model = TinyModel()
+        return model.to(kwargs["torch_dtype"]) if "torch_dtype" in kwargs else model
+
+    monkeypatch.setattr(transformers.AutoModelForCausalLM, "from_pretrained", staticmethod(load_model))
+    monkeypatch.setattr(transformers.AutoTokenizer, "from_pretrained", staticmethod(lambda name, **kwargs: object()))
+    return calls
+
+
+def test_fp32_loads_the_weights_as_they_are(monkeypatch):
+    calls = stub_from_pretrained(monkeypatch)
+    _, model = GraniteAPI(precision="fp32")._load_weights()
+    assert calls == [{}]
+    assert isinstance(model.proj, torch.nn.Linear) and model.proj.weight.dtype == torch.float32
+    assert not model.training
+
+
+def test_bf16_loads_bfloat16_weights(monkeypatch):
+    calls = stub_from_pretrained(monkeypatch)
+    _, model = GraniteAPI(precision="bf16")._load_weights()
+    assert calls == [{"torch_dtype": torch.bfloat16}]
+    assert model.proj.weight.dtype == torch.bfloat16
+
+
+def test_int8_quantizes_the_linear_layers(monkeypatch):
+    calls = stub_from_pretrained(monkeypatch)
+    _, model = GraniteAPI(precision="int8")._load_weights()
+    assert calls == [{}]
+    assert isinstance(model.proj, torch.ao.nn.quantized.dynamic.Linear)
+    assert model.proj.weight().dtype == torch.qint8
+    assert model.proj(torch.ones(1, 4)).shape == (1, 4)
+
+
+def test_unknown_precision_fails_the_load(monkeypatch):
+    calls = stub_from_pretrained(monkeypatch)
+    granite = GraniteAPI(precision="fp16", execution="inline", prefix_cache=False)
+    assert not granite.load()
+    assert granite.state == FAILED and "fp16" in granite.error and calls == []
+    assert granite.status()["precision"] == "fp16"
+
+
+def test_precision_defaults_to_the_environment(monkeypatch):
+    stub_from_pretrained(monkeypatch)
+    monkeypatch.setattr("backend.granite_api.GRANITE_PRECISION", "bf16")
+    granite = GraniteAPI(execution="inline", prefix_cache=False)
+    assert granite.precision == "bf16" and granite.load() and granite.state == READY
+    assert granite.model.proj.weight.dtype == torch.bfloat16
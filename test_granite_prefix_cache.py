@@ -0,0 +1,74 @@
+import torch
+
+from backend.granite_prefix_cache import PrefixCache
+
+
+class CharTokenizer:
+    """One token per character, token id = code point."""
+
+    def __call__(self, text, return_tensors=None, add_special_tokens=True):
+        ids = torch.tensor([[ord(c) for c in text]])
+        return {"input_ids": ids, "attention_mask": torch.ones_like(ids)}
+
+
+class EchoModel:
+    """Stub model whose cache is one tensor per layer holding the ids it encoded."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, input_ids, use_cache=False):
+        self.calls += 1
+        past = [input_ids.clone().float(), input_ids.clone().float()]
+        return type("Output", (), {"past_key_values": past})
+
+
+def test_longest_registered_prefix_is_matched():
+    cache = PrefixCache(EchoModel(), CharTokenizer())
+    cache.register("You are")
+    cache.register("You are a pharmacist.\n")
+    assert cache.match("You are a pharmacist.\nDrug: x") == "You are a pharmacist.\n"
+    assert cache.match("You are kind") == "You are"
+    assert cache.match("Hello") is None
+
+
+def test_prefix_is_encoded_once_and_only_the_suffix_is_new():
+    model = EchoModel()
+    cache = PrefixCache(model, CharTokenizer())
+    cache.register("SYS\n")
+    cache.inputs("SYS\nabc")
+    inputs = cache.inputs("SYS\nxyz")
+    assert model.calls == 1
+    assert "".join(chr(i) for i in inputs["input_ids"][0].tolist()) == "SYS\nxyz"
+    assert inputs["attention_mask"].shape == inputs["input_ids"].shape
+    assert inputs["past_key_values"][0].tolist() == [[ord(c) for c in "SYS\n"]]
+    assert cache.stats() == {"prefixes": 1, "hits": 2, "misses": 0}
+
+
+def test_miss_tokenizes_the_whole_prompt_without_a_cache():
+    model = EchoModel()
+    cache = PrefixCache(model, CharTokenizer())
+    cache.register("SYS\n")
+    inputs = cache.inputs("Other prompt")
+    assert "past_key_values" not in inputs and inputs["input_ids"].shape == (1, len("Other prompt"))
+    assert cache.stats()["misses"] == 1 and model.calls == 1
+
+
+def test_each_call_gets_a_private_copy_of_the_cache():
+    cache = PrefixCache(EchoModel(), CharTokenizer())
+    cache.register("SYS\n")
+    first = cache.inputs("SYS\na")["past_key_values"]
+    # generate() grows the cache it is handed; that must not reach the stored entry.
+    first[0].add_(1)
+    first.append(torch.zeros(1))
+    second = cache.inputs("SYS\nb")["past_key_values"]
+    assert len(second) == 2 and second[0].tolist() == [[ord(c) for c in "SYS\n"]]
+    assert second[0].data_ptr() != first[0].data_ptr()
+
+
+if __name__ == "__main__":
+    test_longest_registered_prefix_is_matched()
+    test_prefix_is_encoded_once_and_only_the_suffix_is_new()
+    test_miss_tokenizes_the_whole_prompt_without_a_cache()
+    test_each_call_gets_a_private_copy_of_the_cache()
+    print("ok")
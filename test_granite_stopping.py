@@ -0,0 +1,51 @@
+import torch
+
+from backend.granite_api import drug_info_complete
+from backend.granite_stopping import TextStop
+
+COMPLETE = ("Name: Paracetamol\nDosage: 500 mg\nFrequency: every 6 hours\n"
+            "Interactions: warfarin, alcohol\nAlternatives: ibuprofen,\naspirin\n\nNote: consult a doctor.")
+
+
+class CharTokenizer:
+    """One token per character, token id = code point."""
+
+    def decode(self, ids, skip_special_tokens=False):
+        return "".join(chr(int(i)) for i in ids)
+
+
+def test_drug_info_complete_waits_for_every_section():
+    assert not drug_info_complete("Name: Paracetamol\nDosage: 500 mg\n\n")
+    # Alternatives may still have continuation lines until a blank line.
+    assert not drug_info_complete(COMPLETE[:COMPLETE.index("aspirin") + 8])
+    assert drug_info_complete(COMPLETE[:COMPLETE.index("Note")])
+    # Headers echoed inside running text do not count.
+    assert not drug_info_complete("It lists Name: Dosage: Frequency: Interactions: Alternatives: x\n\n")
+
+
+def test_drug_info_complete_on_unknown_medication():
+    assert not drug_info_complete("UNKNOWN_MEDICATION possibly a typo for")
+    assert drug_info_complete("UNKNOWN_MEDICATION possibly a typo for Zyrtec.\n")
+
+
+def test_text_stop_is_per_row():
+    prompt = "PP"
+    rows = [prompt + COMPLETE[:COMPLETE.index("Note")], prompt + "Name: x\nDosage: y\n" + " " * 40]
+    width = max(len(r) for r in rows)
+    rows = [r.ljust(width, "~") for r in rows]
+    stop = TextStop(CharTokenizer(), len(prompt), [drug_info_complete, None], [200, 30])
+
+    flags = None
+    for n in range(len(prompt) + 1, width + 1):
+        ids = torch.tensor([[ord(c) for c in r[:n]] for r in rows])
+        flags = stop(ids, None).tolist()
+        if n - len(prompt) == 30:
+            assert flags == [False, True]
+    assert flags == [True, True]
+
+
+if __name__ == "__main__":
+    test_drug_info_complete_waits_for_every_section()
+    test_drug_info_complete_on_unknown_medication()
+    test_text_stop_is_per_row()
+    print("ok")
@@ -0,0 +1,58 @@
+import threading
+
+from backend.granite_api import GraniteAPI, COLD, LOADING, READY, FAILED
+
+
+class SlowLoadGranite(GraniteAPI):
+    """GraniteAPI whose weights are a stub that loads when `release` is set."""
+
+    def __init__(self, fail=False, **kwargs):
+        self.release = threading.Event()
+        self.loads = 0
+        self.fail = fail
+        super().__init__(execution="inline", prefix_cache=False, **kwargs)
+
+    def _load_weights(self):
+        self.loads += 1
+        self.release.wait(5)
+        if self.fail:
+            raise OSError("no weights")
+        return object(), object()
+
+
+def test_queries_do_not_wait_for_the_warm_up():
+    granite = SlowLoadGranite()
+    assert granite.state == COLD and granite.status()["state"] == COLD
+    # The first query starts loading and returns at once.
+    assert granite.query_drug("paracetamol") is None
+    assert granite.state == LOADING
+    assert not granite._ensure_ready() and granite.warm_up() is None
+    granite.release.set()
+    assert granite.load(timeout=5)
+    assert granite.state == READY and granite._ensure_ready()
+    assert granite.loads == 1 and granite.load_seconds is not None
+
+
+def test_load_runs_inline_when_cold():
+    granite = SlowLoadGranite()
+    granite.release.set()
+    assert granite.load() and granite.state == READY
+    assert granite.warm_up() is None and granite.loads == 1
+
+
+def test_a_failed_load_is_reported_and_not_retried():
+    granite = SlowLoadGranite(fail=True)
+    thread = granite.warm_up()
+    granite.release.set()
+    thread.join(5)
+    assert granite.state == FAILED and granite.error == "no weights" and granite.model is None
+    assert not granite.load(timeout=1)
+    assert not granite._ensure_ready() and granite.loads == 1
+    assert granite.query_drug("paracetamol") is None
+
+
+if __name__ == "__main__":
+    test_queries_do_not_wait_for_the_warm_up()
+    test_load_runs_inline_when_cold()
+    test_a_failed_load_is_reported_and_not_retried()
+    print("ok")
@@ -0,0 +1,73 @@
+import time
+
+from backend.llm_router import LLMRouter
+
+
+class FakeBackend:
+    def __init__(self, delay=0.0, answer="ok", ready=True):
+        self.delay = delay
+        self.answer = answer
+        self.ready = ready
+        self.calls = 0
+
+    def is_ready(self):
+        return self.ready
+
+    def query(self, prompt):
+        self.calls += 1
+        time.sleep(self.delay)
+        return self.answer
+
+    def query_drug(self, drug_name):
+        self.calls += 1
+        time.sleep(self.delay)
+        return {"name": drug_name, "source": self.answer} if self.answer else None
+
+
+def test_routes_to_fastest_backend_once_measured():
+    slow, fast = FakeBackend(0.05, "slow"), FakeBackend(0.0, "fast")
+    router = LLMRouter({"slow": slow, "fast": fast}, hedge=False)
+    for _ in range(5):
+        router.query("hi")
+    assert router.query("hi") == "fast"
+    assert router.last_backend() == "fast"
+    assert slow.calls == 1
+
+
+def test_skips_backends_that_are_not_ready():
+    router = LLMRouter({"granite": FakeBackend(answer="granite", ready=False), "gemini": FakeBackend(answer="gemini")})
+    assert router.query_drug("aspirin")["source"] == "gemini"
+    assert router.stats()["granite"]["ready"] is False
+
+
+def test_fails_over_when_a_backend_returns_nothing():
+    broken = FakeBackend(answer=None)
+    router = LLMRouter({"broken": broken, "gemini": FakeBackend(0.01, answer="gemini")}, hedge=False)
+    assert router.query_drug("aspirin")["source"] == "gemini"
+    assert router.stats()["broken"]["error_rate"] == 1.0
+    # Now unhealthy, so the working backend is tried first.
+    router.query_drug("aspirin")
+    assert broken.calls == 1
+
+
+def test_hedges_slow_primary_and_first_answer_wins():
+    import backend.llm_router as llm_router
+    default_ms, llm_router.LLM_HEDGE_DEFAULT_MS = llm_router.LLM_HEDGE_DEFAULT_MS, 50
+    try:
+        slow, backup = FakeBackend(1.0, "slow"), FakeBackend(0.0, "backup")
+        router = LLMRouter({"slow": slow, "backup": backup}, hedge=True)
+        started = time.perf_counter()
+        assert router.query("hi") == "backup"
+        assert time.perf_counter() - started < 0.5
+        assert router.last_backend() == "backup"
+        assert router.stats()["backup"]["hedges"] == 1
+    finally:
+        llm_router.LLM_HEDGE_DEFAULT_MS = default_ms
+
+
+if __name__ == "__main__":
+    test_routes_to_fastest_backend_once_measured()
+    test_skips_backends_that_are_not_ready()
+    test_fails_over_when_a_backend_returns_nothing()
+    test_hedges_slow_primary_and_first_answer_wins()
+    print("ok")
@@ -0,0 +1,89 @@
+import json
+import logging
+import threading
+import time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend import logs
+from backend.metrics import upstream_call
+
+
+class ListHandler(logging.Handler):
+    def __init__(self, gate=None):
+        super().__init__()
+        self.records = []
+        self.gate = gate
+
+    def emit(self, record):
+        if self.gate is not None:
+            self.gate.wait()
+        self.records.append(record)
+
+
+def test_a_full_queue_drops_records_instead_of_blocking():
+    release = threading.Event()
+    target = ListHandler(release)
+    handler = logs.QueueLogHandler(target, size=5)
+    logger = logging.getLogger("test_logs.blocked")
+    logger.propagate = False
+    logger.addHandler(handler)
+    started = time.perf_counter()
+    for i in range(100):
+        logger.warning("record %d", i)
+    # The writer is stuck on the first record; the logging threads were not.
+    assert time.perf_counter() - started < 0.5
+    assert handler.dropped >= 90 and handler.stats()["queued"] == 5
+    release.set()
+    handler.flush()
+    assert [r.getMessage() for r in target.records][:2] == ["record 0", "record 1"]
+    logger.removeHandler(handler)
+    handler.close()
+
+
+def test_json_lines_carry_extra_fields_and_tracebacks():
+    formatter = logs.JSONFormatter()
+    record = logging.LogRecord("backend.app", logging.ERROR, __file__, 1, "failed for %s", ("warfarin",), None)
+    record.route = "/get_dosage"
+    entry = json.loads(formatter.format(record))
+    assert entry["message"] == "failed for warfarin" and entry["level"] == "ERROR"
+    assert entry["route"] == "/get_dosage" and entry["logger"] == "backend.app"
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record.exc_info = __import__("sys").exc_info()
+    assert "ValueError: boom" in json.loads(formatter.format(record))["exc"]
+
+
+def test_one_audit_record_per_request():
+    app = FastAPI()
+    app.add_middleware(logs.AuditMiddleware)
+
+    @app.get("/drugs/{name}")
+    def drug(name: str):
+        logs.cache("drug_info", "miss")
+        with upstream_call("gemini", "drug"):
+            pass
+        return {"name": name}
+
+    audit = ListHandler()
+    logs.audit_logger.addHandler(audit)
+    logs.audit_logger.setLevel(logging.INFO)
+    try:
+        response = TestClient(app).get("/drugs/warfarin")
+    finally:
+        logs.audit_logger.removeHandler(audit)
+    (record,) = audit.records
+    assert record.route == "/drugs/{name}" and record.status == 200 and record.method == "GET"
+    assert record.bytes == len(response.content)
+    assert record.cache == {"drug_info": {"miss": 1}}
+    assert [(c["backend"], c["ok"]) for c in record.upstream] == [("gemini", True)]
+    # Outside a request nothing is collected.
+    logs.cache("drug_info", "hit")
+    assert logs.current() is None
+
+
+if __name__ == "__main__":
+    import pytest
+    raise SystemExit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,89 @@
+import threading
+
+from fastapi.testclient import TestClient
+
+import backend.app as backend_app
+import backend.gemini_api as gemini_module
+from backend.gemini_api import GeminiAPI
+from backend.metrics import Counter, Registry, UPSTREAM_CALLS, UPSTREAM_TOKENS
+
+
+def test_sharded_counter_sums_all_threads():
+    counter = Counter("test_total", "Test.", ("kind",))
+
+    def work():
+        for _ in range(1000):
+            counter.inc("a")
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert counter.value("a") == 8000
+    assert counter.samples() == [({"kind": "a"}, 8000)]
+
+
+def test_exited_threads_fold_their_shards_into_the_base():
+    registry = Registry()
+    counter = registry.counter("recycled_total", "Test.", ("kind",))
+    histogram = registry.histogram("recycled_seconds", "Test.", buckets=(1.0,))
+
+    def work():
+        counter.inc("a")
+        histogram.observe(0.5)
+
+    for _ in range(50):
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+    assert len(counter._shards) == 0 and len(histogram._shards) == 0
+    assert counter.value("a") == 50
+    assert 'recycled_seconds_bucket{le="1"} 50' in registry.render()
+    # A live thread's shard is still summed with the base.
+    counter.inc("a")
+    assert len(counter._shards) == 1 and counter.samples() == [({"kind": "a"}, 51)]
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    histogram = registry.histogram("latency_seconds", "Latency.", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value, "/x")
+    text = registry.render()
+    assert 'latency_seconds_bucket{route="/x",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{route="/x",le="1"} 2' in text
+    assert 'latency_seconds_bucket{route="/x",le="+Inf"} 3' in text
+    assert 'latency_seconds_count{route="/x"} 3' in text
+    assert 'latency_seconds_sum{route="/x"} 5.55' in text
+
+
+class FakeResponse:
+    status_code = 200
+    text = ""
+
+    def json(self):
+        return {"candidates": [{"content": {"parts": [{"text": "Hello"}]}}],
+                "usageMetadata": {"promptTokenCount": 7, "candidatesTokenCount": 3}}
+
+
+def test_metrics_endpoint_reports_routes_and_upstream_calls(monkeypatch):
+    monkeypatch.setattr(gemini_module.requests, "post", lambda url, **kwargs: FakeResponse())
+    calls = UPSTREAM_CALLS.value("gemini", "generate", "ok")
+    tokens = UPSTREAM_TOKENS.value("gemini", "output")
+    assert GeminiAPI(api_key="key").query("hi") == "Hello"
+    assert UPSTREAM_CALLS.value("gemini", "generate", "ok") == calls + 1
+    assert UPSTREAM_TOKENS.value("gemini", "output") == tokens + 3
+
+    client = TestClient(backend_app.app)
+    client.post("/calculate_bmi", json={"weight": 70, "height": 1.75})
+    response = client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'http_request_duration_seconds_count{route="/calculate_bmi",method="POST",status="200"}' in response.text
+    assert 'cache_hit_ratio{cache="drug_info"}' in response.text
+    assert "http_requests_in_flight 0" in response.text
+
+
+if __name__ == "__main__":
+    import pytest
+    raise SystemExit(pytest.main([__file__, "-q"]))
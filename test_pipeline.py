@@ -0,0 +1,91 @@
+import threading
+import time
+
+from backend.drug_logic import check_interactions, get_dosage, suggest_alternatives
+from backend.pipeline import TIMEOUT_MESSAGE, analyze_prescription, iter_analysis_events, iter_drug_events
+
+
+class SlowGemini:
+    def __init__(self, slow=()):
+        self.calls = []
+        self.slow = slow
+        self.lock = threading.Lock()
+
+    def query(self, prompt):
+        return None
+
+    def query_drug(self, drug_name):
+        with self.lock:
+            self.calls.append(drug_name)
+        time.sleep(1.0 if drug_name.lower() in self.slow else 0.1)
+        return {"name": drug_name, "dosage": "10 mg", "interactions": ["warfarin"],
+                "alternatives": ["placebo"], "is_recognized": True}
+
+
+def test_lookups_are_deduplicated_and_concurrent():
+    gemini = SlowGemini()
+    started = time.perf_counter()
+    result = analyze_prescription("Aspirin 75 mg daily. Zorbex 5 mg bd. Quinex 10 mg od. Zorbex 5 mg bd. "
+                                  "Warfarin 5 mg daily.", 40, gemini, deadline_ms=5000)
+    assert time.perf_counter() - started < 0.5
+    # Local drugs are answered from _drug_db without a lookup.
+    assert sorted(gemini.calls) == ["Quinex", "Zorbex"]
+    assert result["complete"]
+    assert result["interactions"]["aspirin"] == ["Warfarin"]
+    assert [d["alternatives"] for d in result["drugs"]] == [
+        ["clopidogrel", "ibuprofen", "naproxen"], ["placebo"], ["placebo"], ["placebo"], ["apixaban", "rivaroxaban"]]
+    assert set(result["timings"]) == {"extract_ms", "lookup_ms", "assemble_ms", "total_ms"}
+
+
+def test_deadline_returns_partial_results():
+    result = analyze_prescription("Zorbex 5 mg bd. Quinex 10 mg od. Warfarin 5 mg daily.", 40,
+                                  SlowGemini(slow=("quinex",)), deadline_ms=300)
+    assert not result["complete"]
+    status = {d["name"]: d["status"] for d in result["drugs"]}
+    assert status == {"Zorbex": "ok", "Quinex": "timeout", "Warfarin": "ok"}
+    assert result["drugs"][1]["alternatives"] == [TIMEOUT_MESSAGE]
+    # A local drug never waits for the LLM.
+    assert result["drugs"][2]["recommended_dosage"] == "2-10 mg OD (INR-guided)"
+
+
+def test_stream_sends_local_hits_before_gemini():
+    events = list(iter_drug_events(["Zorbex", "Warfarin", "Zorbex"], SlowGemini(), deadline_ms=5000))
+    assert [(e["event"], e.get("drug"), e.get("source")) for e in events] == [
+        ("drug", "Warfarin", "local"), ("drug", "Zorbex", "gemini"), ("done", None, None)]
+    assert events[0]["elapsed_ms"] < 50
+    assert events[1]["interactions"] == ["Warfarin"]
+
+
+def test_events_carry_the_key_all_spellings_share():
+    events = list(iter_analysis_events("Warfarin 5 mg daily. WAR-FARIN 5 mg od.", 40, SlowGemini(), 5000))
+    assert [d["key"] for d in events[0]["drugs"]] == ["warfarin", "warfarin"]
+    drug_events = [e for e in iter_drug_events(["Co-Amoxiclav", "co amoxiclav"], SlowGemini(), 40, 5000)
+                   if e["event"] == "drug"]
+    assert [(e["drug"], e["key"]) for e in drug_events] == [("Co-Amoxiclav", "coamoxiclav")]
+
+
+def test_stream_and_non_stream_agree_per_drug():
+    drugs = ["Aspirin", "Zorbex", "Warfarin"]
+    events = {e["drug"]: e for e in iter_drug_events(drugs, SlowGemini(), 40, 5000) if e["event"] == "drug"}
+    interactions = check_interactions(drugs, SlowGemini())
+    for drug in drugs:
+        assert events[drug]["dosage"] == get_dosage(drug, 40, SlowGemini())
+        assert events[drug]["alternatives"] == suggest_alternatives(drug, 40, SlowGemini())
+        assert events[drug]["interactions"] == interactions[drug.lower()]
+
+    result = analyze_prescription("Aspirin 75 mg daily. Zorbex 5 mg bd. Warfarin 5 mg daily.", 40, SlowGemini(),
+                                  deadline_ms=5000)
+    events = [e for e in iter_analysis_events("Aspirin 75 mg daily. Zorbex 5 mg bd. Warfarin 5 mg daily.", 40,
+                                              SlowGemini(), 5000) if e["event"] == "drug"]
+    streamed = {e["drug"]: (e["dosage"], e["alternatives"], e["interactions"]) for e in events}
+    assert streamed == {d["name"]: (d["recommended_dosage"], d["alternatives"], result["interactions"][d["name"].lower()])
+                        for d in result["drugs"]}
+
+
+if __name__ == "__main__":
+    test_lookups_are_deduplicated_and_concurrent()
+    test_deadline_returns_partial_results()
+    test_stream_sends_local_hits_before_gemini()
+    test_events_carry_the_key_all_spellings_share()
+    test_stream_and_non_stream_agree_per_drug()
+    print("ok")
@@ -0,0 +1,33 @@
+from backend.section_parser import SectionParser, parse_sections, UNKNOWN
+
+ANSWER = ("Name: Paracetamol\nDosage: 500 mg for adults\nchildren: 10 mg/kg\nFrequency: every 6 hours\n"
+          "Interactions: warfarin, alcohol\nisoniazid\nAlternatives: ibuprofen, aspirin\n")
+
+
+def test_sections_complete_when_the_next_header_starts():
+    parser = SectionParser()
+    completed = []
+    for i in range(0, len(ANSWER), 5):
+        done = parser.feed(ANSWER[i:i + 5])
+        completed.extend(done)
+        if "dosage" in done:
+            # Frequency has only just started, so dosage holds both of its lines.
+            assert parser.values["dosage"] == "500 mg for adults children: 10 mg/kg"
+            assert "interactions" not in parser.values
+    completed.extend(parser.close())
+    assert completed == ["name", "dosage", "frequency", "interactions", "alternatives"]
+    assert parser.values["interactions"] == ["warfarin", "alcohol", "isoniazid"]
+
+
+def test_unknown_medication_rules():
+    assert parse_sections("Name: x\nunknown_medication, maybe a typo").unknown
+    first_line_only = parse_sections("Name: x\nUNKNOWN_MEDICATION", unknown_on_first_line=True)
+    assert not first_line_only.unknown and first_line_only.values == {"name": "x"}
+    parser = SectionParser(unknown_on_first_line=True)
+    assert parser.feed("UNKNOWN_MEDICATION: looks like a typo\nName: x\n") == [UNKNOWN]
+    assert parser.values == {}
+
+
+if __name__ == "__main__":
+    import pytest
+    raise SystemExit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,218 @@
+import multiprocessing
+import threading
+import time
+
+import pytest
+
+from backend.answer_cache import AnswerCache
+from backend.chat_sessions import ChatSessionStore
+from backend.drug_cache import DrugInfoCache, CachedDrugLookup
+from backend.shared_cache import RedisStore, SharedStore, SQLiteStore, open_store
+
+
+class WatchError(Exception):
+    pass
+
+
+class FakePipeline:
+    """redis-py pipeline in watch mode: reads run at once, writes after multi() wait for execute()."""
+
+    def __init__(self, redis, watches):
+        self.redis = redis
+        self.versions = {key: redis.versions.get(key, 0) for key in watches}
+        self.queued = []
+
+    def get(self, key):
+        return self.redis.get(key)
+
+    def multi(self):
+        pass
+
+    def set(self, key, value, px):
+        self.queued.append((key, value, px))
+
+    def execute(self):
+        with self.redis.lock:
+            if any(self.redis.versions.get(k, 0) != v for k, v in self.versions.items()):
+                raise WatchError()
+            for command in self.queued:
+                self.redis.set(*command)
+
+
+class FakeRedis:
+    """The part of the redis.Redis client RedisStore uses, kept in a dict."""
+
+    def __init__(self, latency=0.0):
+        self.data = {}
+        self.latency = latency
+        # Writes per key, for WATCH
+        self.versions = {}
+        self.lock = threading.RLock()
+        self.conflicts = 0
+
+    def get(self, key):
+        time.sleep(self.latency)
+        value, expires = self.data.get(key, (None, 0))
+        return value if expires > time.time() else None
+
+    def set(self, key, value, px):
+        time.sleep(self.latency)
+        with self.lock:
+            self.data[key] = (value, time.time() + px / 1000.0)
+            self.versions[key] = self.versions.get(key, 0) + 1
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+            self.versions[key] = self.versions.get(key, 0) + 1
+
+    def transaction(self, func, *watches, value_from_callable=False):
+        while True:
+            pipe = FakePipeline(self, watches)
+            value = func(pipe)
+            try:
+                pipe.execute()
+            except WatchError:
+                self.conflicts += 1
+                continue
+            return value if value_from_callable else None
+
+
+class CountingBackend:
+    def __init__(self):
+        self.calls = 0
+
+    def query_drug_fields(self, drug_name, fields):
+        self.calls += 1
+        return dict({f: f"{f} of {drug_name}" for f in fields}, name=drug_name, is_recognized=True)
+
+
+def _increment(path, times):
+    store = SQLiteStore(path)
+    for _ in range(times):
+        store.update("counter", lambda old: str(int(old or b"0") + 1).encode(), 60)
+
+
+def _fetch_dosage(path):
+    backend = CountingBackend()
+    CachedDrugLookup(backend, DrugInfoCache(shared=SQLiteStore(path))).query_drug_fields("rivaroxaban", ["dosage"])
+    assert backend.calls == 1
+
+
+def test_sqlite_updates_are_atomic_across_processes(tmp_path):
+    path = str(tmp_path / "cache.db")
+    ctx = multiprocessing.get_context("fork")
+    workers = [ctx.Process(target=_increment, args=(path, 50)) for _ in range(4)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    assert SQLiteStore(path).get("counter") == b"200"
+
+
+def test_one_process_fetch_warms_the_others(tmp_path):
+    path = str(tmp_path / "cache.db")
+    worker = multiprocessing.get_context("fork").Process(target=_fetch_dosage, args=(path,))
+    worker.start()
+    worker.join()
+    assert worker.exitcode == 0
+    backend = CountingBackend()
+    cache = DrugInfoCache(shared=SQLiteStore(path))
+    api = CachedDrugLookup(backend, cache)
+    assert api.query_drug_fields("Rivaroxaban", ["dosage"])["dosage"] == "dosage of rivaroxaban"
+    assert backend.calls == 0 and cache.stats()["shared_hits"] == 1
+    # Sections fetched by different processes are combined, not overwritten.
+    api.query_drug_fields("rivaroxaban", ["interactions"])
+    other = DrugInfoCache(shared=SQLiteStore(path))
+    record = other.get("rivaroxaban", ["dosage", "interactions"])
+    assert record["dosage"] == "dosage of rivaroxaban" and record["interactions"] == "interactions of rivaroxaban"
+
+
+def test_stale_sections_are_refreshed_from_the_shared_store():
+    store = RedisStore(FakeRedis())
+    slow = DrugInfoCache(ttl=0.05, stale_ttl=60, shared=store)
+    fast = DrugInfoCache(ttl=0.05, stale_ttl=60, shared=store)
+    slow.merge("warfarin", {"name": "warfarin", "dosage": "old"}, ["dosage"])
+    slow.lookup("warfarin", ["dosage"])
+    time.sleep(0.1)
+    fast.merge("warfarin", {"name": "warfarin", "dosage": "new"}, ["dosage"])
+    record, stale = slow.lookup("warfarin", ["dosage"])
+    assert record["dosage"] == "new" and stale == ()
+
+
+def test_answers_and_chat_sessions_are_shared():
+    store = RedisStore(FakeRedis())
+    AnswerCache(shared=store).put("paracetamol dosage", "500 mg")
+    other = AnswerCache(shared=store)
+    assert other.get("Tylenol dose?") == "500 mg" and other.stats()["shared_hits"] == 1
+
+    first, second = ChatSessionStore(shared=store), ChatSessionStore(shared=store)
+    session = first.open()
+    first.record(session, "I take metformin.", "Noted.")
+    same = second.open(session.id)
+    assert same.id == session.id and "user: I take metformin." in second.context(same)
+    second.record(same, "Alcohol?", "Limit it.")
+    assert "Alcohol?" in first.context(first.open(session.id))
+    assert second.delete(session.id) and first.open(session.id).id != session.id
+
+
+def test_redis_updates_from_concurrent_clients_are_not_lost():
+    redis = FakeRedis()
+
+    def increment(old):
+        # Slow enough that the two updaters interleave.
+        time.sleep(0.001)
+        return str(int(old or b"0") + 1).encode()
+
+    def updater():
+        store = RedisStore(redis)
+        for _ in range(50):
+            store.update("counter", increment, 60)
+
+    threads = [threading.Thread(target=updater) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert RedisStore(redis).get("counter") == b"100"
+    assert redis.conflicts > 0
+
+
+def test_chat_turns_recorded_by_two_workers_at_once_are_all_kept():
+    # A round trip long enough for the two workers to interleave
+    store = RedisStore(FakeRedis(latency=0.001))
+    first, second = ChatSessionStore(shared=store), ChatSessionStore(shared=store)
+    session_id = first.open().id
+
+    def chat(sessions, name):
+        for i in range(20):
+            sessions.record(sessions.open(session_id), f"{name} {i}", "ok")
+
+    threads = [threading.Thread(target=chat, args=(s, n)) for s, n in ((first, "a"), (second, "b"))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    session = ChatSessionStore(shared=store).open(session_id)
+    assert len(session.turns) + len(session.backlog) == 80
+
+
+def test_open_store_urls(tmp_path):
+    assert open_store("") is None
+    assert isinstance(open_store(f"sqlite:///{tmp_path / 'x.db'}"), SQLiteStore)
+
+
+def test_a_store_missing_a_method_fails_when_constructed():
+    class NoDelete(SharedStore):
+        def get(self, key):
+            return None
+
+        def set(self, key, value, ttl):
+            pass
+
+    with pytest.raises(TypeError):
+        NoDelete()
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-q"]))
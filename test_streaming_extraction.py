@@ -0,0 +1,29 @@
+import random
+
+from backend.models import extract_drug_info, iter_drug_info, SentenceSplitter
+from benchmarks.corpus import generate_corpus
+
+
+def test_chunked_stream_matches_batch_extraction():
+    rng = random.Random(0)
+    for doc in generate_corpus(n_docs=50, seed=5):
+        text = doc["text"]
+        cuts = sorted(rng.sample(range(len(text) + 1), 6))
+        chunks = [text[i:j] for i, j in zip([0] + cuts, cuts + [len(text)])]
+        assert list(iter_drug_info(chunks)) == extract_drug_info(text)
+
+
+def test_splitter_window_bounds_buffer():
+    splitter = SentenceSplitter(window=50)
+    sentences = []
+    for _ in range(100):
+        sentences += splitter.feed("word " * 7)
+        assert len(splitter._buffer) <= 50
+    sentences += splitter.close()
+    assert " ".join(sentences).split() == ["word"] * 700
+
+
+if __name__ == "__main__":
+    test_chunked_stream_matches_batch_extraction()
+    test_splitter_window_bounds_buffer()
+    print("ok")
@@ -0,0 +1,57 @@
+import threading
+
+from fastapi.testclient import TestClient
+
+import backend.app as backend_app
+import backend.gemini_api as gemini_module
+from backend import profiler
+
+
+class FakeResponse:
+    status_code = 200
+    text = ""
+
+    def json(self):
+        return {"candidates": [{"content": {"parts": [{"text": "Dosage: 10 mg daily\n"}]}}]}
+
+
+def test_server_timing_includes_gemini_calls_made_in_router_threads(monkeypatch):
+    monkeypatch.setattr(gemini_module.requests, "post", lambda url, **kwargs: FakeResponse())
+    monkeypatch.setattr(backend_app.gemini_api, "api_key", "key")
+    backend_app.drug_cache.clear()
+    response = TestClient(backend_app.app).post("/get_dosage", json={"drug": "rivaroxaban", "age": 40})
+    assert response.json()["dosage"] == "10 mg daily"
+    names = [part.split(";")[0] for part in response.headers["server-timing"].split(", ")]
+    assert names == ["gemini", "parse", "serialize", "total"]
+
+
+def test_profile_endpoint_is_admin_only(monkeypatch):
+    client = TestClient(backend_app.app)
+    monkeypatch.setattr(backend_app, "ADMIN_TOKEN", "")
+    assert client.get("/admin/profile?seconds=0.1").status_code == 404
+    monkeypatch.setattr(backend_app, "ADMIN_TOKEN", "s3cret")
+    assert client.get("/admin/profile?seconds=0.1", headers={"X-Admin-Token": "wrong"}).status_code == 403
+
+
+def test_profiler_returns_folded_stacks():
+    stop = threading.Event()
+
+    def spin():
+        while not stop.is_set():
+            sum(range(1000))
+
+    worker = threading.Thread(target=spin, name="spinner")
+    worker.start()
+    try:
+        text = profiler.profile(0.2, interval=0.005)
+    finally:
+        stop.set()
+        worker.join()
+    lines = [line for line in text.splitlines() if line.startswith("spinner;")]
+    assert lines and lines[0].split(";")[-1].startswith("spin (test_timing.py:")
+    assert int(lines[0].rsplit(" ", 1)[1]) > 0
+
+
+if __name__ == "__main__":
+    import pytest
+    raise SystemExit(pytest.main([__file__, "-q"]))